@@ -0,0 +1,86 @@
+"""
+Cursor iteration benchmarks.
+
+The decoding benchmark doesn't need a database. The others need a
+MongoDB server, by default on localhost:27017. Set the
+``HUMBLEDB_BENCH_HOST`` and ``HUMBLEDB_BENCH_PORT`` environment variables to
+use a different one. Run from the repository root::
+
+    python -m bench.cursor
+
+"""
+
+import os
+import timeit
+
+import bson
+from bson.codec_options import CodecOptions
+
+from humbledb import Document, Mongo
+
+NUMBER = 100000
+
+
+class BenchMongo(Mongo):
+    config_host = os.environ.get("HUMBLEDB_BENCH_HOST", "localhost")
+    config_port = int(os.environ.get("HUMBLEDB_BENCH_PORT", 27017))
+
+
+class BenchDoc(Document):
+    config_database = "humbledb_bench"
+    config_collection = "cursor"
+
+    value = "v"
+    name = "n"
+
+
+def report(name, seconds, number=NUMBER):
+    """Print the per-document cost of a benchmark."""
+    print("{:<32} {:>8.1f} ns/doc".format(name, seconds / number * 1e9))
+
+
+def decoding():
+    """Time decoding a batch of documents into dicts and copying them into
+    the document class, against decoding straight into the document class.
+    """
+    data = b"".join(
+        bson.encode({"v": i, "n": "doc {}".format(i), "e": {"v": i}})
+        for i in range(NUMBER)
+    )
+    as_dicts = CodecOptions(document_class=dict)
+    as_docs = CodecOptions(document_class=BenchDoc)
+
+    cases = [
+        (
+            "decode to dicts and copy",
+            lambda: [BenchDoc(doc) for doc in bson.decode_all(data, as_dicts)],
+        ),
+        ("decode to documents", lambda: bson.decode_all(data, as_docs)),
+    ]
+    for name, func in cases:
+        report(name, min(timeit.repeat(func, number=1, repeat=5)))
+
+
+def main():
+    decoding()
+
+    with BenchMongo:
+        BenchDoc.collection.drop()
+        BenchDoc.collection.insert_many(
+            [{"v": i, "n": "doc {}".format(i)} for i in range(NUMBER)]
+        )
+
+        cases = [
+            ("collection.find() (dicts)", lambda: list(BenchDoc.collection.find())),
+            ("BenchDoc.find()", lambda: list(BenchDoc.find())),
+        ]
+
+        try:
+            for name, func in cases:
+                report(name, min(timeit.repeat(func, number=1, repeat=3)))
+        finally:
+            BenchDoc.collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Document attribute access benchmarks.
+
+These don't need a database connection. Run from the repository root::
+
+    python -m bench.document
+
+"""
+
+import timeit
+
+from humbledb import Document, Embed
+
+NUMBER = 200000
+
+
+class BenchDoc(Document):
+    config_database = "bench"
+    config_collection = "bench"
+
+    value = "v"
+    missing = ("x", 0)
+
+    meta = Embed("m")
+    meta.tags = "t"
+    meta.slug = "s"
+
+
+def report(name, seconds, number=NUMBER):
+    """Print the per-call cost of a benchmark."""
+    print("{:<32} {:>8.1f} ns/op".format(name, seconds / number * 1e9))
+
+
+def main():
+    doc = BenchDoc({"_id": 1, "v": "value", "m": {"t": ["a", "b"], "s": "slug"}})
+
+    cases = [
+        ("doc['v'] (baseline)", lambda: doc["v"]),
+        ("doc.value", lambda: doc.value),
+        ("doc.missing (default)", lambda: doc.missing),
+        ("doc.meta", lambda: doc.meta),
+        ("doc.meta.slug", lambda: doc.meta.slug),
+        ("doc.meta.tags", lambda: doc.meta.tags),
+        ("BenchDoc.value", lambda: BenchDoc.value),
+        ("doc.value = 1", lambda: setattr(doc, "value", 1)),
+    ]
+
+    for name, func in cases:
+        report(name, min(timeit.repeat(func, number=NUMBER, repeat=5)))
+
+
+if __name__ == "__main__":
+    main()
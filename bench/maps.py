@@ -0,0 +1,49 @@
+"""
+Memory use of :class:`~humbledb.maps.DictMap` and
+:class:`~humbledb.maps.ListMap` wrappers.
+
+These don't need a database connection. Run from the repository root::
+
+    python -m bench.maps
+
+"""
+
+import gc
+import tracemalloc
+
+from humbledb import Document, Embed
+from humbledb.maps import DictMap, ListMap
+
+COUNT = 100000
+
+
+class BenchDoc(Document):
+    meta = Embed("m")
+    meta.tags = "t"
+
+
+def measure(name, factory, count=COUNT):
+    """Print the average memory used by each object `factory` creates."""
+    gc.collect()
+    tracemalloc.start()
+    objects = [factory() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Don't count the list holding the objects
+    size -= objects.__sizeof__()
+    print("{:<10} {:>8.1f} bytes/instance".format(name, size / count))
+
+
+def main():
+    doc = BenchDoc({"m": {"t": []}})
+    data = doc["m"]
+    tags = data["t"]
+    name_map = BenchDoc._name_map.meta
+    reverse = BenchDoc._reverse_name_map[name_map]
+
+    measure("DictMap", lambda: DictMap(data, name_map, doc, "m", reverse))
+    measure("ListMap", lambda: ListMap(tags, name_map.tags, doc, "t", reverse))
+
+
+if __name__ == "__main__":
+    main()
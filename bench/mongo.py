@@ -0,0 +1,57 @@
+"""
+Connection context and collection method dispatch benchmarks.
+
+These don't need a running database, since pymongo connects lazily and
+cursors don't query until they're iterated. Run from
+the repository root::
+
+    python -m bench.mongo
+
+"""
+
+import timeit
+
+from humbledb import Document, Mongo
+
+NUMBER = 200000
+
+
+class BenchMongo(Mongo):
+    config_host = "localhost"
+    config_port = 27017
+
+
+class BenchDoc(Document):
+    config_database = "bench"
+    config_collection = "bench"
+
+
+def report(name, seconds, number=NUMBER):
+    """Print the per-call cost of a benchmark."""
+    print("{:<32} {:>8.1f} ns/op".format(name, seconds / number * 1e9))
+
+
+def main():
+    cases = [
+        ("Mongo.context (no context)", lambda: Mongo.context),
+    ]
+
+    for name, func in cases:
+        report(name, min(timeit.repeat(func, number=NUMBER, repeat=5)))
+
+    with BenchMongo:
+        cases = [
+            ("Mongo.context", lambda: Mongo.context),
+            ("Mongo.contexts", lambda: Mongo.contexts),
+            ("BenchDoc.collection", lambda: BenchDoc.collection),
+            ("BenchDoc.find (dispatch)", lambda: BenchDoc.find),
+            ("BenchDoc.collection.find()", lambda: BenchDoc.collection.find()),
+            ("BenchDoc.find()", lambda: BenchDoc.find()),
+        ]
+
+        for name, func in cases:
+            report(name, min(timeit.repeat(func, number=NUMBER, repeat=5)))
+
+
+if __name__ == "__main__":
+    main()
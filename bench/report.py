@@ -0,0 +1,161 @@
+"""
+Report query parsing and preallocation benchmarks.
+
+These parse synthetic report documents and build preallocation updates
+without sending them, so they don't need a database connection. Run from the repository root::
+
+    python -m bench.report
+
+"""
+
+import datetime
+import random
+import timeit
+
+import bson
+import pytool
+
+from humbledb import report
+from humbledb.report import DAY, HOUR, MINUTE, MONTH, Report
+
+EVENTS = 10
+ROLLOVER = 1000
+
+
+class BenchReport(Report):
+    config_database = "bench"
+    config_collection = "report"
+    config_period = MONTH
+    config_intervals = [MONTH, DAY, HOUR, MINUTE]
+
+
+def _legacy_parse_section(values, interval, stamp, index=0):
+    """The recursive parser which builds a timestamp for every value."""
+    if isinstance(values, int):
+        yield stamp, values
+    else:
+        for i in range(index, index + len(values)):
+            if interval == MINUTE:
+                stamp = stamp.replace(minute=i)
+            elif interval == HOUR:
+                stamp = stamp.replace(hour=i)
+            elif interval == DAY:
+                try:
+                    stamp = stamp.replace(day=i + 1)
+                except ValueError:
+                    continue
+            elif interval == MONTH:
+                stamp = stamp.replace(month=i + 1)
+            value = values[i - index]
+            if isinstance(value, int):
+                yield stamp, value
+                continue
+            for vals in _legacy_parse_section(value, interval - 1, stamp):
+                yield vals
+
+
+def make_docs(start, density):
+    """Return a month of per-minute report documents, with `density` of the
+    minutes having a count.
+    """
+    docs = []
+    for n in range(EVENTS):
+        minutes = BenchReport._preallocate_interval(MONTH, MINUTE, start)
+        for day in minutes:
+            for hour in day:
+                for minute in range(60):
+                    if random.random() < density:
+                        hour[minute] = random.randint(1, 100)
+        docs.append(
+            BenchReport(
+                {
+                    "_id": "event{}".format(n),
+                    BenchReport.minute: minutes,
+                    BenchReport.meta.key: {
+                        BenchReport.meta.event.key: "event{}".format(n),
+                        BenchReport.meta.period.key: start,
+                    },
+                }
+            )
+        )
+    return docs
+
+
+def _legacy_preallocate_query(event, stamp):
+    """Build a preallocation update without templates."""
+    cls = BenchReport
+    query = {"_id": cls.record_id(event, stamp)}
+    update = {}
+    for interval in cls.config_intervals:
+        key = cls._map_interval(interval)
+        query[key] = {"$exists": 0}
+        update[key] = cls._preallocate_interval(cls.config_period, interval, stamp)
+    update[cls.meta.event] = event
+    update[cls.meta.period] = cls._period(stamp)
+    return query, {"$set": update}
+
+
+def report_time(name, seconds, unit="query"):
+    """Print the cost of a benchmark."""
+    print("{:<40} {:>8.1f} ms/{}".format(name, seconds * 1e3, unit))
+
+
+def preallocation():
+    """Time preallocating many events at once, like at a period rollover."""
+    start = datetime.datetime(2013, 7, 1, tzinfo=pytool.time.UTC())
+    events = ["event{}".format(n) for n in range(ROLLOVER)]
+
+    for name, build in (
+        ("legacy", _legacy_preallocate_query),
+        ("current", BenchReport._preallocate_query),
+    ):
+
+        def run():
+            # Encoding is included, since pymongo has to do it for each update
+            for event in events:
+                query, update = build(event, start)
+                bson.encode(update)
+
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        report_time(
+            "preallocate {} events ({})".format(ROLLOVER, name),
+            seconds,
+            "rollover",
+        )
+
+
+def parse_results():
+    """Time parsing a month of per minute results."""
+    start = datetime.datetime(2013, 7, 1, tzinfo=pytool.time.UTC())
+    stop = datetime.datetime(2013, 8, 1, tzinfo=pytool.time.UTC())
+    query = BenchReport.per_minute
+
+    parse_section = report._parse_section
+    for density in (0.01, 0.1, 1.0):
+        docs = make_docs(start, density)
+
+        def run():
+            return query._parse_results(docs, start, stop, query.query_key, MINUTE)
+
+        for name, parser in (
+            ("legacy", _legacy_parse_section),
+            ("current", parse_section),
+        ):
+            report._parse_section = parser
+            try:
+                seconds = min(timeit.repeat(run, number=1, repeat=3))
+            finally:
+                report._parse_section = parse_section
+            report_time(
+                "per_minute, {} events, {:.0%} ({})".format(EVENTS, density, name),
+                seconds,
+            )
+
+
+def main():
+    parse_results()
+    preallocation()
+
+
+if __name__ == "__main__":
+    main()
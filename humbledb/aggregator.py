@@ -0,0 +1,270 @@
+"""
+Report aggregator
+=================
+
+This module contains :class:`ReportAggregator`, a small sidecar server which
+receives counts from :meth:`Report.record <humbledb.report.Report.record>`
+in many processes, merges them, and writes them to the database in bulk.
+
+It can be run as its own process::
+
+    python -m humbledb.aggregator --address /tmp/humbledb.sock \\
+            myapp.db:MyConnection myapp.reports:PageViews
+
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytool
+
+from humbledb.report import ReportBuffer, _report_name
+
+# Largest datagram we accept, which is plenty for a single count
+_MAX_DATAGRAM = 65535
+
+# Longest time to wait for a datagram before checking if we've been closed
+_POLL_TIMEOUT = 0.1
+
+
+class ReportAggregator(object):
+    """
+    Receives counts sent by :meth:`Report.record
+    <humbledb.report.Report.record>` for reports with
+    :attr:`~humbledb.report.Report.config_aggregator` set to `address`, and
+    merges them in a :class:`~humbledb.report.ReportBuffer` for each report.
+    The buffers are written every `interval` seconds, so each report document
+    gets one upsert per interval no matter how many processes are recording.
+
+    The `address` is either a Unix socket path, or a ``(host, port)`` tuple to
+    listen for UDP. Counts for reports which aren't in `reports` and
+    malformed datagrams are dropped and counted in :attr:`dropped`.
+
+    Example::
+
+        class PageViews(Report):
+            config_database = 'humble'
+            config_collection = 'views.page'
+            config_aggregator = '/tmp/humbledb.sock'
+
+        # In the sidecar process
+        address = PageViews.config_aggregator
+        ReportAggregator(MyConnection, [PageViews], address).serve_forever()
+
+        # In each worker process, this returns without waiting
+        PageViews.record('home')
+
+    :param connection: Mongo subclass used for writing
+    :param reports: Report subclasses to accept counts for
+    :param address: Unix socket path or ``(host, port)`` tuple
+    :param interval: Seconds between writes (default: ``1.0``)
+    :param max_size: Number of buffered counters for a report which \\
+            triggers a write (default: ``10000``)
+    :type connection: humbledb.mongo.Mongo
+    :type reports: list
+    :type address: str or tuple
+    :type interval: float
+    :type max_size: int
+
+    """
+
+    def __init__(self, connection, reports, address, interval=1.0, max_size=10000):
+        self.connection = connection
+        self.address = address
+        self.interval = interval
+
+        self.received = 0
+        """ Number of counts received. """
+        self.dropped = 0
+        """ Number of datagrams dropped. """
+
+        self._buffers = {
+            _report_name(report): ReportBuffer(
+                report, connection, interval=None, max_size=max_size
+            )
+            for report in reports
+        }
+
+        if isinstance(address, str):
+            # Remove a socket left behind by a previous aggregator
+            try:
+                if stat.S_ISSOCK(os.stat(address).st_mode):
+                    os.unlink(address)
+            except FileNotFoundError:
+                pass
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+
+        self._closed = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """Serve in a background thread, and return this aggregator."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="humbledb-report-aggregator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Receive and write counts until :meth:`close` is called."""
+        sock = self._socket
+        flush_at = time.monotonic() + self.interval
+        while not self._closed.is_set():
+            sock.settimeout(min(_POLL_TIMEOUT, max(0, flush_at - time.monotonic())))
+            try:
+                self.handle(sock.recv(_MAX_DATAGRAM))
+            except (socket.timeout, BlockingIOError):
+                pass
+
+            if time.monotonic() >= flush_at:
+                self.flush()
+                flush_at = time.monotonic() + self.interval
+
+        # Take whatever was sent before we closed
+        sock.setblocking(False)
+        while True:
+            try:
+                self.handle(sock.recv(_MAX_DATAGRAM))
+            except BlockingIOError:
+                break
+        self.flush()
+
+    def handle(self, data):
+        """
+        Merge the count in the datagram `data` into its report's buffer.
+
+        :param data: Datagram sent by :meth:`Report.record \\
+                <humbledb.report.Report.record>`
+        :type data: bytes
+
+        """
+        name = None
+        try:
+            name, event, timestamp, count = json.loads(data)
+            stamp = datetime.datetime.fromtimestamp(timestamp, pytool.time.UTC())
+            buf = self._buffers[name]
+            # This checks the count, and writes the buffer if it's full
+            buf.record(event, stamp, count)
+        except (ValueError, TypeError, KeyError, OverflowError):
+            self.dropped += 1
+            return
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "Discarding aggregated counts for %r", name
+            )
+            self.dropped += 1
+            return
+        self.received += 1
+
+    def flush(self):
+        """Write all the merged counts to the database."""
+        for name, buf in self._buffers.items():
+            try:
+                buf.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Discarding aggregated counts for %r", name
+                )
+
+    def close(self):
+        """Stop serving, write any remaining counts, and close the socket."""
+        self._closed.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        elif thread is None:
+            self.flush()
+
+        for buf in self._buffers.values():
+            buf.close()
+
+        self._socket.close()
+        if isinstance(self.address, str):
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+
+
+def _parse_address(address):
+    """
+    Return a ``(host, port)`` tuple for ``'host:port'`` strings, otherwise
+    return `address` as a Unix socket path.
+
+    :param address: Address string
+    :type address: str
+
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and "/" not in address and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _load(path):
+    """
+    Return the object for a ``'module:name'`` path.
+
+    :param path: Import path
+    :type path: str
+
+    """
+    module, _, name = path.partition(":")
+    obj = importlib.import_module(module)
+    for attr in name.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def main(argv=None):
+    """Run an aggregator from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m humbledb.aggregator",
+        description="Merge and write counts sent by Report.record.",
+    )
+    parser.add_argument(
+        "--address",
+        required=True,
+        help="Unix socket path or host:port to listen on for UDP",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds between writes"
+    )
+    parser.add_argument("connection", help="Mongo subclass, as module:name")
+    parser.add_argument("reports", nargs="+", help="Report subclasses, as module:name")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    aggregator = ReportAggregator(
+        _load(args.connection),
+        [_load(report) for report in args.reports],
+        _parse_address(args.address),
+        interval=args.interval,
+    )
+    try:
+        aggregator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close()
+
+
+if __name__ == "__main__":
+    main()
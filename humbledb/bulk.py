@@ -0,0 +1,320 @@
+"""
+Bulk writes
+===========
+
+This module contains the :class:`Bulk` helper which queues writes for a
+:class:`~humbledb.document.Document` subclass and sends them to the server in
+batches using :meth:`pymongo.collection.Collection.bulk_write`.
+
+"""
+
+import pymongo
+from pymongo.errors import BulkWriteError
+
+from humbledb import _version
+
+
+class Bulk(object):
+    """
+    Queues write operations for `doc_cls` and flushes them in batches of
+    `batch_size` using a single
+    :meth:`~pymongo.collection.Collection.bulk_write` call per batch. Queries
+    and updates use document keys, so mapped attributes work as they do with
+    the rest of the :class:`~humbledb.document.Document` API.
+
+    This is usually created with :meth:`Document.bulk`, and used as a context
+    manager, which flushes any remaining operations when it exits without an
+    error. A connection context is only needed while the operations are being
+    flushed.
+
+    Example::
+
+        with MyConnection:
+            with MyDoc.bulk(ordered=False) as bulk:
+                for value in values:
+                    bulk.insert(MyDoc(value=value))
+                bulk.upsert({MyDoc.name: 'total'}, {'$inc': {MyDoc.count: 1}})
+
+        print(bulk.result.inserted_count)
+
+    If `manipulate` is ``True``, saved default values are set on inserted and
+    replacement documents. Upserts with update operators get their saved
+    defaults through ``$setOnInsert``, unless the key is already part of the
+    query or update.
+
+    .. note:: Saved defaults are generated when the operation is queued, so
+              an upsert which matches an existing document will still use up
+              values from helpers like
+              :func:`~humbledb.helpers.auto_increment`.
+
+    :param doc_cls: A Document subclass
+    :param ordered: Whether the server should stop at the first error \
+            (default: ``True``)
+    :param batch_size: Maximum number of queued operations per batch \
+            (default: ``1000``)
+    :param manipulate: Whether to set saved defaults (default: ``True``)
+    :type doc_cls: type
+    :type ordered: bool
+    :type batch_size: int
+    :type manipulate: bool
+
+    """
+
+    def __init__(self, doc_cls, ordered=True, batch_size=1000, manipulate=True):
+        if _version._lt("3.0.0"):
+            raise RuntimeError("Need pymongo.version >= 3.0 for bulk writes.")
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be at least 1")
+
+        self.doc_cls = doc_cls
+        self.ordered = ordered
+        self.batch_size = batch_size
+        self.manipulate = manipulate
+        self.result = BulkResult()
+        self._operations = []
+        # Documents queued for insert, so we can collect their ids
+        self._inserts = []
+
+    def __len__(self):
+        """Return the number of queued operations."""
+        return len(self._operations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Don't write anything else if the block raised an error
+        if exc_type is not None:
+            self.clear()
+            return
+        self.flush()
+
+    def insert(self, doc):
+        """
+        Queue `doc` to be inserted.
+
+        :param doc: Document to insert
+        :type doc: dict
+
+        """
+        if not isinstance(doc, dict):
+            raise ValueError("Invalid document type: {}".format(type(doc)))
+        if self.manipulate:
+            self.doc_cls._ensure_saved_defaults(doc)
+        self._inserts.append(doc)
+        self._queue(pymongo.InsertOne(doc))
+
+    def update(self, query, update, upsert=False, multi=False):
+        """
+        Queue an update of the documents matching `query`. If `update` doesn't
+        use any modifier operators, the matched document is replaced.
+
+        :param query: Query document
+        :param update: Update or replacement document
+        :param upsert: Whether to insert if nothing matches (optional)
+        :param multi: Whether to update all matching documents (optional)
+        :type query: dict
+        :type update: dict
+        :type upsert: bool
+        :type multi: bool
+
+        """
+        if not _is_operator_update(update):
+            if multi:
+                raise ValueError("Replacement updates cannot use 'multi'")
+            self.replace(query, update, upsert=upsert)
+            return
+
+        if upsert and self.manipulate:
+            update = self._set_on_insert(query, update)
+
+        if multi:
+            self._queue(pymongo.UpdateMany(query, update, upsert=upsert))
+        else:
+            self._queue(pymongo.UpdateOne(query, update, upsert=upsert))
+
+    def upsert(self, query, update, multi=False):
+        """
+        Queue an update of the documents matching `query`, inserting a new
+        document if nothing matches.
+
+        This is a shortcut for ``update(query, update, upsert=True)``.
+
+        """
+        self.update(query, update, upsert=True, multi=multi)
+
+    def replace(self, query, doc, upsert=False):
+        """
+        Queue a replacement of the document matching `query` with `doc`.
+
+        :param query: Query document
+        :param doc: Replacement document
+        :param upsert: Whether to insert if nothing matches (optional)
+        :type query: dict
+        :type doc: dict
+        :type upsert: bool
+
+        """
+        if not isinstance(doc, dict):
+            raise ValueError("Invalid document type: {}".format(type(doc)))
+        if self.manipulate:
+            self.doc_cls._ensure_saved_defaults(doc)
+        self._queue(pymongo.ReplaceOne(query, doc, upsert=upsert))
+
+    def remove(self, query, multi=True):
+        """
+        Queue a removal of the documents matching `query`.
+
+        :param query: Query document
+        :param multi: Whether to remove all matching documents (default: \
+                ``True``)
+        :type query: dict
+        :type multi: bool
+
+        """
+        if multi:
+            self._queue(pymongo.DeleteMany(query))
+        else:
+            self._queue(pymongo.DeleteOne(query))
+
+    def flush(self):
+        """
+        Write all the queued operations and return the aggregated
+        :class:`BulkResult` for this instance.
+
+        If a batch fails, the counts which the server reported are still added
+        to :attr:`result` before the :exc:`~pymongo.errors.BulkWriteError` is
+        raised, and the rest of the queue is discarded.
+
+        """
+        while self._operations:
+            self._write(self.batch_size)
+        return self.result
+
+    def clear(self):
+        """Discard all the queued operations."""
+        self._operations = []
+        self._inserts = []
+
+    def _queue(self, operation):
+        """Queue `operation` and write a batch if the queue is full."""
+        self._operations.append(operation)
+        if len(self._operations) >= self.batch_size:
+            self._write(self.batch_size)
+
+    def _write(self, size):
+        """Write the first `size` queued operations."""
+        operations = self._operations[:size]
+        del self._operations[:size]
+        # Inserted documents are queued in the same order as their operations
+        count = sum(1 for op in operations if isinstance(op, pymongo.InsertOne))
+        inserts = self._inserts[:count]
+        del self._inserts[:count]
+
+        offset = self.result.operation_count
+        self.result.operation_count += len(operations)
+        try:
+            result = self.doc_cls.collection.bulk_write(
+                operations, ordered=self.ordered
+            )
+        except BulkWriteError as exc:
+            self.result._merge_details(exc.details, offset)
+            self.clear()
+            raise
+
+        self.result._merge(result, offset)
+        if result.acknowledged:
+            self.result.inserted_ids.extend(doc.get("_id") for doc in inserts)
+
+    def _set_on_insert(self, query, update):
+        """Return `update` with saved defaults added with ``$setOnInsert``."""
+        saved_defaults = self.doc_cls._saved_defaults
+        if not saved_defaults:
+            return update
+
+        # Any key which is already set by the query or update will conflict
+        paths = set(query)
+        for clause in update.values():
+            if isinstance(clause, dict):
+                paths.update(clause)
+
+        set_on_insert = dict(update.get("$setOnInsert", {}))
+        for key, value in saved_defaults.items():
+            if any(_conflicts(key, path) for path in paths):
+                continue
+            set_on_insert[key] = value()
+
+        if not set_on_insert:
+            return update
+
+        update = dict(update)
+        update["$setOnInsert"] = set_on_insert
+        return update
+
+
+class BulkResult(object):
+    """
+    Aggregated result for all the batches written by a :class:`Bulk`
+    instance. If the writes were unacknowledged (``w=0``) the counts stay at
+    zero.
+
+    """
+
+    def __init__(self):
+        self.operation_count = 0
+        """ Number of operations sent to the server. """
+        self.inserted_count = 0
+        """ Number of documents inserted. """
+        self.matched_count = 0
+        """ Number of documents matched for update. """
+        self.modified_count = 0
+        """ Number of documents modified. """
+        self.deleted_count = 0
+        """ Number of documents deleted. """
+        self.upserted_count = 0
+        """ Number of documents upserted. """
+        self.inserted_ids = []
+        """ The ``_id`` values of the inserted documents, in queue order. """
+        self.upserted_ids = {}
+        """ Map of operation index to upserted ``_id``. """
+
+    def __repr__(self):
+        return (
+            "{}(inserted={}, matched={}, modified={}, deleted={}, upserted={})".format(
+                type(self).__name__,
+                self.inserted_count,
+                self.matched_count,
+                self.modified_count,
+                self.deleted_count,
+                self.upserted_count,
+            )
+        )
+
+    def _merge(self, result, offset):
+        """Merge a :class:`pymongo.results.BulkWriteResult` into this one."""
+        if not result.acknowledged:
+            return
+        self._merge_details(result.bulk_api_result, offset)
+
+    def _merge_details(self, details, offset):
+        """Merge a raw bulk API result document into this one."""
+        self.inserted_count += details.get("nInserted", 0)
+        self.matched_count += details.get("nMatched", 0)
+        self.modified_count += details.get("nModified", 0)
+        self.deleted_count += details.get("nRemoved", 0)
+        self.upserted_count += details.get("nUpserted", 0)
+        for upserted in details.get("upserted", []):
+            self.upserted_ids[upserted["index"] + offset] = upserted["_id"]
+
+
+def _is_operator_update(update):
+    """Return ``True`` if `update` uses modifier operators."""
+    for key in update:
+        if key.startswith("$"):
+            return True
+    return False
+
+
+def _conflicts(key, path):
+    """Return ``True`` if the dotted paths `key` and `path` overlap."""
+    return key == path or path.startswith(key + ".") or key.startswith(path + ".")
@@ -4,6 +4,11 @@ import pymongo
 
 from humbledb import _version
 
+try:
+    from pymongo.asynchronous.cursor import AsyncCursor as _AsyncCursor
+except ImportError:
+    _AsyncCursor = None
+
 
 class Cursor(pymongo.cursor.Cursor):
     """This subclass of :class:`pymongo.cursor.Cursor` is used to ensure that
@@ -16,13 +21,14 @@ class Cursor(pymongo.cursor.Cursor):
     # cursor instance
     _doc_cls = dict
 
+    # Resolve the base class' next method once, rather than for every document
+    if _version._gte("3"):
+        _base_next = pymongo.cursor.Cursor.next
+    else:
+        _base_next = pymongo.cursor.Cursor.__next__
+
     def next(self):
-        if _version._gte("3"):
-            doc = super().next()
-        else:
-            doc = super().__next__()
-        doc = self._doc_cls(doc)
-        return doc
+        return self._doc_cls(self._base_next())
 
     __next__ = next
 
@@ -96,3 +102,32 @@ class Cursor(pymongo.cursor.Cursor):
 
     def __deepcopy__(self, memo):
         return self.__clone(deepcopy=True)
+
+
+if _AsyncCursor is not None:
+
+    class AsyncCursor(_AsyncCursor):
+        """This subclass of :class:`pymongo.asynchronous.cursor.AsyncCursor`
+        is used to ensure that documents are coerced to the correct type as
+        they are returned by the cursor.
+
+        """
+
+        # This works the same way as it does for Cursor
+        _doc_cls = dict
+
+        async def next(self):
+            doc = await super().next()
+            return self._doc_cls(doc)
+
+        async def to_list(self, length=None):
+            docs = await super().to_list(length)
+            return [self._doc_cls(doc) for doc in docs]
+
+        def _clone(self, deepcopy=True, base=None):
+            clone = super()._clone(deepcopy, base)
+            clone._doc_cls = self._doc_cls
+            return clone
+
+else:  # pragma: no cover
+    AsyncCursor = None
@@ -2,6 +2,7 @@
 
 import logging
 from functools import wraps
+from types import MethodType
 from typing import Optional
 
 import pyconfig
@@ -9,10 +10,11 @@ import pymongo
 from pytool.lang import UNSET
 
 from humbledb import _version
-from humbledb.cursor import Cursor
+from humbledb.bulk import Bulk
+from humbledb.cursor import AsyncCursor, Cursor
 from humbledb.errors import DatabaseMismatch, MissingConfig, NoConnection
 from humbledb.index import Index
-from humbledb.maps import DictMap, ListMap, NameMap
+from humbledb.maps import DictMap, ListMap, NameMap, _cached_wrapper
 from humbledb.mongo import Mongo
 
 _ = None
@@ -25,6 +27,9 @@ COLLECTION_METHODS = set(
 )
 del _  # This is necessary since _ lingers in the module namespace otherwise
 
+# Used to check whether a collection's find() can be bypassed
+_collection_find = pymongo.collection.Collection.find
+
 
 class Embed(str):
     """This class is used to map attribute names on embedded subdocuments.
@@ -100,6 +105,45 @@ class CollectionAttribute(object):
     """Acts as the collection attribute. Refuses to be read unless the
     the executing code is in a :class:`Mongo` context or has already called
     :meth:`Mongo.start`.
+
+    Resolved collections are cached on the :class:`Mongo` subclass for each
+    document class, database and collection name, and are discarded when it
+    reconnects.
+    """
+
+    def __get__(self, instance, owner):
+        database = owner.config_database
+        collection = owner.config_collection
+        # Only allow access to the collection in a Mongo context
+        context = Mongo.context
+        if context:
+            # The names are part of the key since they may be changed, for
+            # instance by a pyconfig setting
+            key = (owner, database, collection)
+            try:
+                return context._collections[key]
+            except KeyError:
+                pass
+        if not database or not collection:
+            raise MissingConfig("Missing config_database or config_collection")
+        if context:
+            connection = context.connection
+            db = context.database
+            if db is not None and db.name != database:
+                raise DatabaseMismatch(
+                    "This document is configured for "
+                    "database %r, while the connection is using %r"
+                    % (database, db.name)
+                )
+            collection = connection[database][collection]
+            context._collections[key] = collection
+            return collection
+        raise NoConnection("'collection' unavailable without connection context")
+
+
+class AsyncCollectionAttribute(object):
+    """Acts as the async collection attribute. Refuses to be read unless the
+    executing code is in an async :class:`Mongo` context.
     """
 
     def __get__(self, instance, owner):
@@ -108,16 +152,92 @@ class CollectionAttribute(object):
         collection = self.config_collection
         if not database or not collection:
             raise MissingConfig("Missing config_database or config_collection")
-        # Only allow access to the collection in a Mongo context
-        if Mongo.context:
-            db = Mongo.context.database
+        context = Mongo.async_context
+        if context:
+            db = context.async_database
             if db is not None and db.name != database:
                 raise DatabaseMismatch(
                     "This document is configured for "
                     "database %r, while the connection is using %r"
+                    % (database, db.name)
                 )
-            return Mongo.context.connection[database][collection]
-        raise NoConnection("'collection' unavailable without connection context")
+            return context.async_connection[database][collection]
+        raise NoConnection(
+            "'async_collection' unavailable without async connection context"
+        )
+
+
+class MappedAttribute(object):
+    """Data descriptor created by :class:`DocumentMeta` for each mapped
+    attribute. The document key, reverse name map and default values are
+    resolved once at class creation time so attribute access on instances
+    doesn't have to look anything up in the name maps.
+
+    When accessed on the class, this returns the attribute's
+    :class:`~humbledb.maps.NameMap` so it can be used to build queries.
+
+    """
+
+    __slots__ = ("name_map", "key", "reverse_name_map", "saved_default")
+
+    def __init__(self, name_map, reverse_name_map, saved_default=None):
+        self.name_map = name_map
+        self.key = str(name_map)
+        self.reverse_name_map = reverse_name_map
+        self.saved_default = saved_default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.name_map
+
+        key = self.key
+        try:
+            value = instance[key]
+        except KeyError:
+            if self.saved_default is None:
+                # Return the default value for this NameMap
+                return self.name_map._default(instance, key, self.reverse_name_map)
+            # Assign the new saved value back to the document and fall through
+            # so it's wrapped appropriately, in case it's a dict or list
+            value = instance[key] = self.saved_default()
+
+        # If it's a dict or list, we need to keep mapping subkeys
+        if isinstance(value, dict):
+            wrapper_cls = DictMap
+        elif isinstance(value, list):
+            wrapper_cls = ListMap
+        else:
+            return value
+
+        # Reuse the wrapper from the last access as long as it still wraps the
+        # same object for this document
+        wrappers = instance._wrappers
+        if wrappers is None:
+            wrappers = instance._wrappers = {}
+        else:
+            wrapper = wrappers.get(key)
+            if (
+                wrapper is not None
+                and wrapper._data is value
+                and wrapper._parent is instance
+            ):
+                return wrapper
+
+        wrapper = _cached_wrapper(
+            wrapper_cls, value, self.name_map, instance, key, self.reverse_name_map
+        )
+        wrappers[key] = wrapper
+        return wrapper
+
+    def __set__(self, instance, value):
+        instance[self.key] = value
+        if instance._wrappers:
+            instance._wrappers.pop(self.key, None)
+
+    def __delete__(self, instance):
+        del instance[self.key]
+        if instance._wrappers:
+            instance._wrappers.pop(self.key, None)
 
 
 class DocumentMeta(type):
@@ -127,10 +247,12 @@ class DocumentMeta(type):
     _collection_methods = COLLECTION_METHODS
     _wrapped_methods = set(["find", "find_one", "find_and_modify"])
     _wrapped_doc_methods = set(["find_one", "find_and_modify"])
+    _method_wrappers = {}
     _update = None
 
     # Helping pylint with identifying class attributes
     collection = None
+    async_collection = None
 
     def __new__(mcs, cls_name, bases, cls_dict):
         # Don't process Document superclass
@@ -143,6 +265,7 @@ class DocumentMeta(type):
         # Attribute names that conflict with the dict base class
         bad_names = mcs._collection_methods | set(
             [
+                "async_collection",
                 "clear",
                 "collection",
                 "copy",
@@ -238,8 +361,20 @@ class DocumentMeta(type):
         cls_dict["_name_map"] = name_map
         cls_dict["_reverse_name_map"] = reverse_name_map
 
+        # Create a descriptor for each mapped attribute, including inherited
+        # ones, so saved defaults resolve against this class. Names which
+        # were redefined as something else in this class are left alone.
+        for name in list(name_map.mapped()) + ["_id"]:
+            if name in cls_dict or name not in name_map:
+                continue
+            value = name_map[name]
+            cls_dict[name] = MappedAttribute(
+                value, reverse_name_map[value], saved_defaults.get(str(value))
+            )
+
         # Create collection attribute
         cls_dict["collection"] = CollectionAttribute()
+        cls_dict["async_collection"] = AsyncCollectionAttribute()
 
         # Create saved default value attribute
         cls_dict["_saved_defaults"] = saved_defaults
@@ -247,6 +382,12 @@ class DocumentMeta(type):
         # Create the class
         cls = type.__new__(mcs, cls_name, bases, cls_dict)
 
+        # Build the wrappers for collection methods once per class
+        cls._method_wrappers = dict(
+            (name, cls._wrap(name))
+            for name in mcs._wrapped_methods & mcs._collection_methods
+        )
+
         # Check all the indexes
         indexes = getattr(cls, "config_indexes", None)
         if indexes is not None:
@@ -270,35 +411,37 @@ class DocumentMeta(type):
 
         # See if we're looking for a collection method
         if name in cls._collection_methods:
-            value = getattr(cls.collection, name, None)
-            if name in cls._wrapped_methods:
-                value = cls._wrap(value)
-            return value
-
-        # Check if we have a mapped attribute name
-        name_map = object.__getattribute__(cls, "_name_map")
-        if name in name_map:
-            return name_map[name]
-
-        # Otherwise, let's just error
+            collection = cls.collection
+            wrapper = cls._method_wrappers.get(name)
+            if wrapper is not None:
+                # Bind the prebuilt wrapper to the current collection
+                return MethodType(wrapper, collection)
+            return getattr(collection, name, None)
+
+        # Mapped attribute names are handled by their MappedAttribute
+        # descriptors, so otherwise, let's just error
         return object.__getattribute__(cls, name)
 
-    def _wrap(cls, func):
-        """Wraps ``func`` to ensure that it has the as_class keyword
-        argument set to ``cls``. Also guarantees indexes.
+    def _wrap(cls, name):
+        """Return a wrapper for the collection method `name` which ensures
+        indexes and that documents are returned as instances of ``cls``. The
+        wrapper takes the collection as its first argument, so it can be built
+        once and bound to whichever collection is current.
 
-        :param function func: Function to wrap.
+        :param str name: Name of the collection method to wrap.
 
         """
+        method = getattr(pymongo.collection.Collection, name)
+
         # We have to handle find_and_modify separately because it doesn't take
         # a convenient as_class keyword argument, which is really too bad.
-        if func.__name__ in cls._wrapped_doc_methods:
+        if name in cls._wrapped_doc_methods:
 
-            @wraps(func)
-            def doc_wrapper(*args, **kwargs):
+            @wraps(method)
+            def doc_wrapper(collection, *args, **kwargs):
                 """Wrapper function to guarantee object typing and indexes."""
                 cls._ensure_indexes()
-                doc = func(*args, **kwargs)
+                doc = getattr(collection, name)(*args, **kwargs)
                 # If doc is not iterable (e.g. None), then this will error
                 if doc:
                     doc = cls(doc)
@@ -308,12 +451,19 @@ class DocumentMeta(type):
 
         # If we've made it this far, it's not find_and_modify, and we can do a
         # "normal" wrap.
-        @wraps(func)
-        def cursor_wrapper(*args, **kwargs):
+        @wraps(method)
+        def cursor_wrapper(collection, *args, **kwargs):
             """Wrapper function to guarantee indexes and object typing."""
             cls._ensure_indexes()
+            # Collection.find() just creates a cursor, so we can create our
+            # own directly instead of changing its class afterwards
+            find = getattr(type(collection), "find", None)
+            if name == "find" and find is _collection_find:
+                cursor = Cursor(collection, *args, **kwargs)
+                cursor._doc_cls = cls
+                return cursor
             # Get the cursor
-            cursor = func(*args, **kwargs)
+            cursor = getattr(collection, name)(*args, **kwargs)
             if not isinstance(cursor, pymongo.cursor.Cursor):
                 return cursor
             # Change the cursor's class... this is pretty fidgety
@@ -433,6 +583,31 @@ class DocumentMeta(type):
         else:
             raise ValueError("Invalid document type: {}".format(type(doc_or_docs)))
 
+    def bulk(cls, ordered=True, batch_size=1000, manipulate=True):
+        """
+        Return a :class:`~humbledb.bulk.Bulk` instance for queueing inserts,
+        updates, upserts, replacements and removals of this document type,
+        which are written in batches with ``bulk_write``.
+
+        Example::
+
+            with MyConnection:
+                with MyDoc.bulk() as bulk:
+                    for doc in docs:
+                        bulk.insert(doc)
+
+        :param ordered: Whether the server should stop at the first error \
+                (default: ``True``)
+        :param batch_size: Maximum number of operations per batch \
+                (default: ``1000``)
+        :param manipulate: If ``True`` set saved defaults (optional)
+        :type ordered: bool
+        :type batch_size: int
+        :type manipulate: bool
+
+        """
+        return Bulk(cls, ordered=ordered, batch_size=batch_size, manipulate=manipulate)
+
     def find_and_modify(cls, query: dict, update: Optional[dict] = None, **kwargs):
         """
         Implements a backwards-compatible find_and_modify taking the same arguments as :meth:`pymongo.collection.Collection.find_and_modify` before :mod:`pymongo` 4.x.
@@ -469,6 +644,141 @@ class DocumentMeta(type):
         else:
             return cls.collection.delete_one(query, **kwargs)
 
+    async def async_find(cls, *args, **kwargs):
+        """
+        Return an :class:`~humbledb.cursor.AsyncCursor` which returns
+        instances of this document type. Takes the same arguments as
+        :meth:`pymongo.asynchronous.collection.AsyncCollection.find`.
+
+        This is a coroutine, so indexes can be ensured before the cursor is
+        returned.
+
+        Example::
+
+            async with MyConnection:
+                async for doc in await MyDoc.async_find({MyDoc.value: 1}):
+                    print(doc.value)
+
+        """
+        await cls._async_ensure_indexes()
+        # AsyncCollection.find() just creates a cursor, so we create our own
+        cursor = AsyncCursor(cls.async_collection, *args, **kwargs)
+        cursor._doc_cls = cls
+        return cursor
+
+    async def async_find_one(cls, *args, **kwargs):
+        """
+        Return a single document of this type or ``None``. Takes the same
+        arguments as
+        :meth:`pymongo.asynchronous.collection.AsyncCollection.find_one`.
+
+        """
+        await cls._async_ensure_indexes()
+        doc = await cls.async_collection.find_one(*args, **kwargs)
+        if doc:
+            doc = cls(doc)
+        return doc
+
+    async def async_insert(cls, doc_or_docs, manipulate=True, **kwargs):
+        """
+        Insert a document or a list of documents, returning the inserted id or
+        ids. This is the async version of :meth:`insert`.
+
+        :param doc_or_docs: Document or list of documents to insert
+        :param manipulate: If ``True`` set saved defaults (optional)
+        :type doc_or_docs: dict or list
+        :type manipulate: bool
+
+        """
+        if isinstance(doc_or_docs, dict):
+            if manipulate:
+                cls._ensure_saved_defaults(doc_or_docs)
+            result = await cls.async_collection.insert_one(doc_or_docs, **kwargs)
+            if result:
+                return result.inserted_id
+        elif isinstance(doc_or_docs, list):
+            if manipulate:
+                for doc in doc_or_docs:
+                    cls._ensure_saved_defaults(doc)
+            result = await cls.async_collection.insert_many(doc_or_docs, **kwargs)
+            if result:
+                return result.inserted_ids
+        else:
+            raise ValueError("Invalid document type: {}".format(type(doc_or_docs)))
+
+    async def async_save(cls, doc, manipulate=True):
+        """
+        Insert or replace `doc`, depending on whether it has an ``_id``. This
+        is the async version of :meth:`save`.
+
+        :param doc: Document to save
+        :param manipulate: If ``True`` set saved defaults (optional)
+        :type doc: dict
+        :type manipulate: bool
+
+        """
+        if not isinstance(doc, dict):
+            raise ValueError("Invalid document type: {}".format(type(doc)))
+        if manipulate:
+            cls._ensure_saved_defaults(doc)
+
+        if "_id" in doc:
+            return await cls.async_collection.replace_one(
+                {"_id": doc["_id"]}, doc, upsert=True
+            )
+        result = await cls.async_collection.insert_one(doc)
+        if result:
+            return result.inserted_id
+
+    async def async_update(cls, *args, **kwargs):
+        """
+        Update documents, returning the raw result if anything matched. This
+        is the async version of :attr:`update`.
+
+        """
+        _version._clean(kwargs)
+
+        if kwargs.pop("multi", False):
+            result = await cls.async_collection.update_many(*args, **kwargs)
+        else:
+            result = await cls.async_collection.update_one(*args, **kwargs)
+
+        if result.matched_count:
+            return result.raw_result
+
+        return None
+
+    async def async_find_and_modify(
+        cls, query: dict, update: Optional[dict] = None, **kwargs
+    ):
+        """
+        The async version of :meth:`find_and_modify`.
+        """
+        if kwargs.pop("new", False):
+            kwargs["return_document"] = pymongo.ReturnDocument.AFTER
+
+        collection = cls.async_collection
+        if not update:
+            return await collection.find_one_and_delete(query, **kwargs)
+
+        if any(k.startswith("$") for k in update):
+            doc = await collection.find_one_and_update(query, update, **kwargs)
+        else:
+            doc = await collection.find_one_and_replace(query, update, **kwargs)
+
+        if doc:
+            return cls(doc)
+        return None
+
+    async def async_remove(cls, query: dict, **kwargs):
+        """
+        The async version of :meth:`remove`.
+        """
+        if kwargs.pop("multi", True):
+            return await cls.async_collection.delete_many(query, **kwargs)
+        else:
+            return await cls.async_collection.delete_one(query, **kwargs)
+
     def _ensure_saved_defaults(cls, doc):
         """Update `doc` to ensure saved defaults exist before saving."""
         # Shortcut out if we don't have any
@@ -512,11 +822,22 @@ class Document(dict, metaclass=DocumentMeta):
     config_indexes = None
     """ Indexes for this document. """
 
+    # Cache of DictMap and ListMap wrappers for mapped keys, created on first
+    # access by MappedAttribute
+    _wrappers = None
+
     def __repr__(self):
         return "{}({})".format(
             self.__class__.__name__, super(Document, self).__repr__()
         )
 
+    def __getstate__(self):
+        # The wrapper cache refers back to this document, so we don't want it
+        # to be copied or pickled
+        state = self.__dict__.copy()
+        state.pop("_wrappers", None)
+        return state
+
     def for_json(self):
         """Return this document as a dictionary, with short key names mapped
         to long names. This method is used by :meth:`pytools.json.as_json`.
@@ -577,78 +898,6 @@ class Document(dict, metaclass=DocumentMeta):
 
         return mapper(self, reverse_name_map)
 
-    def __getattr__(self, name):
-        # Get the mapped attributes
-        name_map = object.__getattribute__(self, "_name_map")
-        reverse_name_map = object.__getattribute__(self, "_reverse_name_map")
-        saved_defaults = object.__getattribute__(self, "_saved_defaults")
-        # If the attribute is mapped, map it!
-        if name in name_map:
-            # name_map is a dict key and potentially a NameMap too here
-            name_map = name_map[name]
-            key = str(name_map)
-            reverse_name_map = reverse_name_map[key]
-            # Check if we actually have a key for that value
-            if key in self:
-                value = self[key]
-                # TBD shakefu: Whether we should check whether the name_map is
-                # empty before continuing to map subkeys - this may be a slight
-                # performance improvement by removing the DictMap and ListMap
-                # layers for unmapped items
-                # If it's a dict, we need to keep mapping subkeys
-                if isinstance(value, dict):
-                    value = DictMap(value, name_map, self, key, reverse_name_map)
-                # If it's a list, we need to keep mapping subkeys
-                elif isinstance(value, list):
-                    value = ListMap(value, name_map, self, key, reverse_name_map)
-                return value
-            elif isinstance(name_map, NameMap):
-                if key in saved_defaults:
-                    # Get the new saved value
-                    value = saved_defaults[key]()
-                    # Assign it back to this document's dict
-                    self[key] = value
-                    # Use getattr to re-retrieve the value appropriately
-                    # wrapped, in case it's a dict or list
-                    return getattr(self, name)
-                # Return the default value for this NameMap
-                return name_map._default(self, key, reverse_name_map)
-            else:
-                # Return if a mapped attribute is missing
-                # XXX: This should never happen
-                return None  # pragma: no cover
-
-        # TODO: Decide whether to allow non-mapped keys via attribute access
-        object.__getattribute__(self, name)
-
-    def __setattr__(self, name, value):
-        # Get the mapped attributes
-        name_map = object.__getattribute__(self, "_name_map")
-        # If it's mapped, let's map it!
-        if name in name_map:
-            key = name_map[name]
-            if isinstance(key, NameMap):
-                key = key.key
-            # Assign the mapped key
-            self[key] = value
-            return
-
-        # TODO: Decide whether to allow non-mapped keys via attribute access
-        object.__setattr__(self, name, value)
-
-    def __delattr__(self, name):
-        # Get the mapped attributes
-        name_map = object.__getattribute__(self, "_name_map")
-        # If we have the key, we delete it
-        if name in name_map:
-            key = name_map[name]
-            if isinstance(key, NameMap):
-                key = key.key
-            del self[key]
-            return
-
-        object.__delattr__(self, name)
-
     @classmethod
     def _ensure_indexes(cls):
         """Guarantees indexes are created once per connection instance."""
@@ -678,10 +927,36 @@ class Document(dict, metaclass=DocumentMeta):
 
         # Create a reload hook for the first time we run
         if ensured is None:
+            cls._add_ensure_reload_hook()
+
+    @classmethod
+    async def _async_ensure_indexes(cls):
+        """Guarantees indexes are created once per connection instance, using
+        the async collection.
+        """
+        ensured = getattr(cls, "_ensured", None)
+        if ensured:
+            return
+
+        if cls.config_indexes:
+            for index in cls.config_indexes:
+                logging.getLogger(__name__).info("Ensuring index: {}".format(index))
+                if not isinstance(index, Index):
+                    raise RuntimeError("Pymongo 4.x does not support ensure_index")
+                await index.async_ensure(cls)
+
+        logging.getLogger(__name__).info("Indexing ensured.")
+        cls._ensured = True
+
+        if ensured is None:
+            cls._add_ensure_reload_hook()
+
+    @classmethod
+    def _add_ensure_reload_hook(cls):
+        """Allow index recreation if configuration settings change via
+        pyconfig.
+        """
 
-            @pyconfig.reload_hook
-            def _reload():
-                """Allow index recreation if configuration settings change via
-                pyconfig.
-                """
-                cls._ensured = False
+        @pyconfig.reload_hook
+        def _reload():
+            cls._ensured = False
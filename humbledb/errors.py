@@ -28,6 +28,7 @@ def _import_pymongo_errors():
     _pymongo_errors = [
         "AutoReconnect",
         "BSONError",
+        "BulkWriteError",
         "CertificateError",
         "CollectionInvalid",
         "ConfigurationError",
@@ -53,6 +53,19 @@ class Index(object):
         # times, you probably know what you're doing.
         cls.collection.create_index(index, **self.kwargs)
 
+    async def async_ensure(self, cls):
+        """Does a create_index call for this index with the given `cls`, using
+        its async collection.
+
+        :param cls: A Document subclass
+
+        """
+        if not pyconfig.get("humbledb.ensure_indexes", True):
+            return
+
+        index = self._resolve_index(cls)
+        await cls.async_collection.create_index(index, **self.kwargs)
+
     def _resolve_index(self, cls):
         """Resolves an index to its actual dot notation counterpart, or
         returns the index as is.
@@ -1,11 +1,18 @@
 """ """
 
+import weakref
+from collections import abc
+
 from pytool.lang import UNSET
 from pytool.proxy import DictProxy, ListProxy
 
 
 class NameMap(str):
-    """This class is used to map attribute names to document keys internally."""
+    """This class is used to map attribute names to document keys internally.
+    Mapped subattributes are stored in the instance ``__dict__``, which is
+    only allocated once a subattribute is assigned."""
+
+    __slots__ = ("_key", "_default_value", "__dict__")
 
     def __new__(cls, value=""):
         return super().__new__(cls, value)
@@ -37,7 +44,7 @@ class NameMap(str):
         return key in self.__dict__
 
     def filtered(self):
-        """Return self.__dict__ minus any private keys."""
+        """Return the mapped subattributes minus any private keys."""
         return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
 
     def mapped(self):
@@ -64,30 +71,116 @@ class NameMap(str):
         .. versionadded: 4.0
 
         """
-        _dict = self.__dict__
-        if len(_dict) == 2 and "_key" in _dict and "_default_value" in _dict:
-            return True
-        return False
+        return not self.__dict__
 
 
-class DictMap(DictProxy):
+def _cached_wrapper(wrapper_cls, value, name_map, parent, key, reverse_name_map):
+    """
+    Return a new `wrapper_cls` for `value` to be cached on `parent`. Cached
+    wrappers only hold a weak reference to their parent, since the parent
+    holds the wrapper, so documents can still be freed by reference counting.
+
+    """
+    parent_ref = weakref.ref(parent)
+    return wrapper_cls(value, name_map, parent_ref, key, reverse_name_map)
+
+
+class DictMap(abc.MutableMapping):
     """This class is used to map embedded documents to their attribute names.
     This class ensures that the original document is kept up to sync with
     the embedded document clones via a reference to the `parent`, which at
-    the highest level is the main document.
+    the highest level is the main document. The `parent` may be given as a
+    :func:`weakref.ref`, for wrappers cached on their parent.
+
+    This proxies the wrapped dictionary the same way
+    :class:`pytool.proxy.DictProxy` does, but uses ``__slots__`` to keep
+    instances small.
 
     """
 
+    __slots__ = (
+        "_data",
+        "_parent_ref",
+        "_key",
+        "_name_map",
+        "_reverse_name_map",
+        "_wrappers",  # Cache of DictMap and ListMap wrappers for subkeys
+        "__weakref__",
+    )
+
+    __hash__ = None  # Mutable mapping, so not hashable
+
     def __init__(self, value, name_map, parent, key, reverse_name_map):
-        self._parent = parent
+        self._data = value
+        self._parent_ref = parent
         self._key = key
         self._name_map = name_map
         self._reverse_name_map = reverse_name_map
-        super(DictMap, self).__init__(value)
+        self._wrappers = None
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return self._data.items()
+
+    def values(self):
+        return self._data.values()
+
+    def iteritems(self):
+        return iter(self._data.items())
+
+    def iterkeys(self):
+        return iter(self._data.keys())
+
+    def itervalues(self):
+        return iter(self._data.values())
+
+    def has_key(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def pop(self, key, *args):
+        return self._data.pop(key, *args)
+
+    def popitem(self):
+        return self._data.popitem()
+
+    def copy(self):
+        return type(self)(
+            self._data.copy(),
+            self._name_map,
+            self._parent,
+            self._key,
+            self._reverse_name_map,
+        )
 
     @property
-    def _parent_mutable(self):
-        return isinstance(self._parent, (dict, DictMap))
+    def _parent(self):
+        parent = self._parent_ref
+        if parent.__class__ is weakref.ref:
+            return parent()
+        return parent
 
     def __getattr__(self, name):
         # Exclude private names from this behavior
@@ -112,11 +205,32 @@ class DictMap(DictProxy):
             value = self[key]
             # Only create a new DictMap instance if we map into it
             if isinstance(value, dict) and not attr.empty():
-                value = DictMap(value, attr, self, key, reverse_name_map)
+                wrapper_cls = DictMap
             # We always create a new ListMap instance for the .new() method
             elif isinstance(value, list):
-                value = ListMap(value, attr, self, key, reverse_name_map)
-            return value
+                wrapper_cls = ListMap
+            else:
+                return value
+
+            # Reuse the wrapper from the last access if it still wraps the
+            # same object
+            wrappers = self._wrappers
+            if wrappers is None:
+                wrappers = self._wrappers = {}
+            else:
+                wrapper = wrappers.get(key)
+                if (
+                    wrapper is not None
+                    and wrapper._data is value
+                    and wrapper._parent is self
+                ):
+                    return wrapper
+
+            wrapper = _cached_wrapper(
+                wrapper_cls, value, attr, self, key, reverse_name_map
+            )
+            wrappers[key] = wrapper
+            return wrapper
 
         if isinstance(attr, NameMap) and not attr.empty():
             return DictMap({}, attr, self, key, reverse_name_map)
@@ -143,6 +257,8 @@ class DictMap(DictProxy):
 
         # Assign the mapped key
         self[key] = value
+        if self._wrappers:
+            self._wrappers.pop(key, None)
 
     def __delattr__(self, name):
         # Exclude private names from this behavior
@@ -164,6 +280,8 @@ class DictMap(DictProxy):
         # Delete the key if we have it
         if key in self:
             del self[key]
+            if self._wrappers:
+                self._wrappers.pop(key, None)
             return
 
         # This will attempt a normal delete, and probably raise an error
@@ -171,29 +289,36 @@ class DictMap(DictProxy):
 
     def __setitem__(self, key, value):
         # The current dictionary may not exist in the parent yet, so we have
-        # to create a new one if it's missing
-        if self._key not in self._parent and self._parent_mutable:
+        # to create a new one if it's missing. If the parent has been freed,
+        # there's nothing left to keep in sync.
+        parent = self._parent
+        if (
+            parent is not None
+            and self._key not in parent
+            and isinstance(parent, (dict, DictMap))
+        ):
             # The parent is empty, so we need a new empty dict
             self._data = {}
-            self._parent[self._key] = self._data
+            parent[self._key] = self._data
 
         # Assign to self
-        super(DictMap, self).__setitem__(key, value)
+        self._data[key] = value
 
     def __delitem__(self, key):
-        if self._key not in self._parent:
+        parent = self._parent
+        if parent is not None and self._key not in parent:
             # Fuck it
             return
 
         # Delete from self
         if key in self:
-            super(DictMap, self).__delitem__(key)
+            del self._data[key]
             # If this dict is empty, remove it totally from the parent
-            if not self and self._parent_mutable:
-                del self._parent[self._key]
+            if not self and isinstance(parent, (dict, DictMap)):
+                del parent[self._key]
         else:
             # Raise an error
-            super(DictMap, self).__delitem__(key)
+            del self._data[key]
 
     def for_json(self):
         """Return this suitable for JSON encoding."""
@@ -213,13 +338,130 @@ class DictMap(DictProxy):
         return mapped
 
 
-class ListMap(ListProxy):
+class ListMap(abc.MutableSequence):
+    """This class is used to map lists of embedded documents to their
+    attribute names. Dictionaries in the list are returned wrapped in a
+    :class:`DictMap` when the list's name map has subattributes.
+
+    This proxies the wrapped list the same way
+    :class:`pytool.proxy.ListProxy` does, but uses ``__slots__`` to keep
+    instances small.
+
+    """
+
+    __slots__ = (
+        "_data",
+        "_parent_ref",
+        "_key",
+        "_name_map",
+        "_reverse_name_map",
+        "__weakref__",
+    )
+
+    __hash__ = None  # Mutable sequence, so not hashable
+
     def __init__(self, value, name_map, parent, key, reverse_name_map):
-        self._parent = parent
+        self._data = value
+        self._parent_ref = parent
         self._key = key
         self._name_map = name_map
         self._reverse_name_map = reverse_name_map
-        super(ListMap, self).__init__(value)
+
+    def __repr__(self):
+        return repr(self._data)
+
+    _parent = DictMap._parent
+
+    @staticmethod
+    def _cast(other):
+        if isinstance(other, ListMap):
+            return other._data
+        return other
+
+    def __lt__(self, other):
+        return self._data < self._cast(other)
+
+    def __le__(self, other):
+        return self._data <= self._cast(other)
+
+    def __eq__(self, other):
+        return self._data == self._cast(other)
+
+    def __ne__(self, other):
+        return self._data != self._cast(other)
+
+    def __gt__(self, other):
+        return self._data > self._cast(other)
+
+    def __ge__(self, other):
+        return self._data >= self._cast(other)
+
+    def __contains__(self, item):
+        return item in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setitem__(self, index, item):
+        self._data[index] = item
+
+    def __delitem__(self, index):
+        del self._data[index]
+
+    def __getslice__(self, i, j):
+        return self._data[max(i, 0) : max(j, 0)]
+
+    def __setslice__(self, i, j, other):
+        self._data[max(i, 0) : max(j, 0)] = list(self._cast(other))
+
+    def __delslice__(self, i, j):
+        del self._data[max(i, 0) : max(j, 0)]
+
+    def __add__(self, other):
+        return self._data + list(self._cast(other))
+
+    def __radd__(self, other):
+        return list(self._cast(other)) + self._data
+
+    def __iadd__(self, other):
+        self._data += list(self._cast(other))
+        return self
+
+    def __mul__(self, n):
+        return self._data * n
+
+    __rmul__ = __mul__
+
+    def __imul__(self, n):
+        self._data *= n
+        return self
+
+    def append(self, item):
+        self._data.append(item)
+
+    def insert(self, index, item):
+        self._data.insert(index, item)
+
+    def pop(self, index=-1):
+        return self._data.pop(index)
+
+    def remove(self, item):
+        self._data.remove(item)
+
+    def count(self, item):
+        return self._data.count(item)
+
+    def index(self, item, *args):
+        return self._data.index(item, *args)
+
+    def reverse(self):
+        self._data.reverse()
+
+    def sort(self, *args, **kwargs):
+        self._data.sort(*args, **kwargs)
+
+    def extend(self, other):
+        self._data.extend(self._cast(other))
 
     def new(self):
         """Create a new embedded document in this list."""
@@ -235,7 +477,7 @@ class ListMap(ListProxy):
         return value
 
     def __getitem__(self, index):
-        value = super(ListMap, self).__getitem__(index)
+        value = self._data[index]
         # Only create a new DictMap if we actually map into this list
         if isinstance(value, dict) and not self._name_map.empty():
             value = DictMap(value, self._name_map, self, None, self._reverse_name_map)
@@ -244,3 +486,9 @@ class ListMap(ListProxy):
     def for_json(self):
         """Return this suitable for JSON encoding."""
         return list(self)
+
+
+# These used to subclass the pytool proxies, so keep isinstance() checks
+# against them working
+DictProxy.register(DictMap)
+ListProxy.register(ListMap)
@@ -1,7 +1,8 @@
 """ """
 
+import asyncio
+import contextvars
 import logging
-import threading
 
 import pyconfig
 import pymongo
@@ -15,10 +16,25 @@ try:
 except ImportError:
     ssl = None
 
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
+
 __all__ = [
     "Mongo",
 ]
 
+# Stacks of connection contexts. These are tuples so each push or pop makes a
+# new stack, which keeps threads, greenlets and tasks that copy the current
+# context from sharing state.
+_contexts = contextvars.ContextVar("humbledb_contexts", default=())
+_async_contexts = contextvars.ContextVar("humbledb_async_contexts", default=())
+
+# Tasks closing async clients which have been replaced, kept so they aren't
+# garbage collected before they finish
+_closing = set()
+
 
 class MongoMeta(type):
     """Metaclass to allow :class:`Mongo` to be used as a context manager
@@ -33,6 +49,11 @@ class MongoMeta(type):
         # This ensures that a late-declared class does not inherit an existing
         # connection object.
         cls_dict["_connection"] = None
+        # Async clients are bound to an event loop, so there's one per loop
+        cls_dict["_async_connections"] = {}
+        # Resolved collection handles and default database for the connection
+        cls_dict["_collections"] = {}
+        cls_dict["_database"] = UNSET
 
         # Choose the correct connection class
         if cls_dict.get("config_connection_cls", UNSET) is UNSET:
@@ -76,8 +97,6 @@ class MongoMeta(type):
 
         # Specially handle base class
         if name == "Mongo" and bases == (object,):
-            # Create thread local self
-            cls_dict["_self"] = threading.local()
             return type.__new__(mcs, name, bases, cls_dict)
 
         if cls_dict.get("config_uri", UNSET) is UNSET:
@@ -107,7 +126,8 @@ class MongoMeta(type):
         """Public function for manually starting a session/context. Use
         carefully!
         """
-        if cls in Mongo.contexts:
+        contexts = _contexts.get()
+        if cls in contexts:
             raise NestedConnection(
                 "Do not nest a connection within itself, it "
                 "may cause undefined behavior."
@@ -116,7 +136,7 @@ class MongoMeta(type):
             "3.0.0"
         ):
             cls.connection.start_request()
-        Mongo.contexts.append(cls)
+        _contexts.set(contexts + (cls,))
 
     def end(cls):
         """Public function for manually closing a session/context. Should be
@@ -127,10 +147,9 @@ class MongoMeta(type):
             "3.0.0"
         ):
             cls.connection.end_request()
-        try:
-            Mongo.contexts.pop()
-        except (IndexError, AttributeError):
-            pass
+        contexts = _contexts.get()
+        if contexts:
+            _contexts.set(contexts[:-1])
 
     def reconnect(cls):
         """Replace the current connection with a new connection."""
@@ -138,6 +157,12 @@ class MongoMeta(type):
         if cls._connection and _version._lt("3.0.0"):
             cls._connection.disconnect()
         cls._connection = cls._new_connection()
+        cls._collections = {}
+        cls._database = UNSET
+        # The async clients are created again on their next use
+        connections, cls._async_connections = cls._async_connections, {}
+        for loop, connection in connections.items():
+            _close_async_connection(loop, connection)
 
     def __enter__(cls):
         cls.start()
@@ -145,6 +170,18 @@ class MongoMeta(type):
     def __exit__(cls, exc_type, exc_val, exc_tb):
         cls.end()
 
+    async def __aenter__(cls):
+        contexts = _async_contexts.get()
+        if cls in contexts:
+            raise NestedConnection(
+                "Do not nest a connection within itself, it "
+                "may cause undefined behavior."
+            )
+        _async_contexts.set(contexts + (cls,))
+
+    async def __aexit__(cls, exc_type, exc_val, exc_tb):
+        _async_contexts.set(_async_contexts.get()[:-1])
+
 
 class Mongo(object, metaclass=MongoMeta):
     """
@@ -161,7 +198,9 @@ class Mongo(object, metaclass=MongoMeta):
     the scope where a socket is in use from the pool to the absolute minimum
     necessary.
 
-    This class is made to be thread safe.
+    This class is made to be thread safe. The context stack is kept in a
+    :class:`contextvars.ContextVar`, so it is also local to each greenlet and
+    asyncio task.
 
     Example subclass::
 
@@ -174,9 +213,13 @@ class Mongo(object, metaclass=MongoMeta):
         with MyConnection:
             doc = MyDoc.find_one()
 
-    """
+    This class can also be used as an async context manager, which uses
+    :attr:`async_connection` and is local to the current asyncio task::
+
+        async with MyConnection:
+            doc = await MyDoc.async_find_one()
 
-    _self = None
+    """
 
     config_uri = UNSET
     """ A MongoDB URI to connect to. """
@@ -227,6 +270,10 @@ class Mongo(object, metaclass=MongoMeta):
         .. versionadded: 5.6
     """
 
+    config_async_connection_cls = None
+    """ This defines the connection class to use in async contexts. If not
+    set, :class:`pymongo.AsyncMongoClient` is used. """
+
     def __new__(cls):
         """This class cannot be instantiated."""
         return cls
@@ -234,6 +281,19 @@ class Mongo(object, metaclass=MongoMeta):
     @classmethod
     def _new_connection(cls):
         """Return a new connection to this class' database."""
+        return cls.config_connection_cls(**cls._connection_kwargs())
+
+    @classmethod
+    def _new_async_connection(cls):
+        """Return a new async connection to this class' database."""
+        connection_cls = cls.config_async_connection_cls or AsyncMongoClient
+        if connection_cls is None:
+            raise RuntimeError("Need pymongo.version >= 4.10 for asyncio support.")
+        return connection_cls(**cls._connection_kwargs())
+
+    @classmethod
+    def _connection_kwargs(cls):
+        """Return the keyword arguments for creating a new connection."""
         kwargs = cls._connection_info()
 
         kwargs.update(
@@ -265,7 +325,7 @@ class Mongo(object, metaclass=MongoMeta):
                 )
             )
 
-        return cls.config_connection_cls(**kwargs)
+        return kwargs
 
     @classmethod
     def _connection_info(cls):
@@ -287,24 +347,41 @@ class Mongo(object, metaclass=MongoMeta):
         """
         if not cls._connection:
             cls._connection = cls._new_connection()
+            cls._collections = {}
+            cls._database = UNSET
         return cls._connection
 
+    @classproperty
+    def async_connection(cls):
+        """Return the async connection for the running event loop. If no
+        connection exists, one is created.
+        """
+        loop = asyncio.get_running_loop()
+        connections = cls._async_connections
+        connection = connections.get(loop)
+        if connection is None:
+            # Connections for loops which have been closed can't be used again
+            for old in [old for old in connections if old.is_closed()]:
+                _close_async_connection(old, connections.pop(old))
+            connection = connections[loop] = cls._new_async_connection()
+        return connection
+
     @classproperty
     def contexts(cls):
-        """Return the current context stack."""
-        if not hasattr(Mongo._self, "contexts"):
-            Mongo._self.contexts = []
-        return Mongo._self.contexts
+        """Return the current context stack, as a tuple. The stack is local to
+        the current thread, greenlet or asyncio task.
+        """
+        return _contexts.get()
 
     @classproperty
     def context(cls):
         """Return the current context (a :class:`.Mongo` subclass) if it
         exists or ``None``.
         """
-        try:
-            return Mongo.contexts[-1]
-        except IndexError:
-            return None
+        contexts = _contexts.get()
+        if contexts:
+            return contexts[-1]
+        return None
 
     @classproperty
     def database(cls):
@@ -318,7 +395,73 @@ class Mongo(object, metaclass=MongoMeta):
         """
         if _version._lt("2.6.0"):
             return None
+        # Cache the result, since this is checked on every new collection
+        # handle and the lookup may raise and catch an exception
+        if cls._database is UNSET:
+            try:
+                database = cls.connection.get_default_database()
+            except pymongo.errors.ConfigurationError:
+                database = None
+            cls._database = database
+        return cls._database
+
+    @classproperty
+    def async_contexts(cls):
+        """Return the current async context stack for this task."""
+        return _async_contexts.get()
+
+    @classproperty
+    def async_context(cls):
+        """Return the current async context (a :class:`.Mongo` subclass) if it
+        exists or ``None``.
+        """
+        contexts = _async_contexts.get()
+        if contexts:
+            return contexts[-1]
+        return None
+
+    @classproperty
+    def async_database(cls):
+        """
+        Return the default database for the async connection, or ``None``.
+
+        """
         try:
-            return cls.connection.get_default_database()
+            return cls.async_connection.get_default_database()
         except pymongo.errors.ConfigurationError:
             return None
+
+
+def _close_async_connection(loop, connection):
+    """
+    Close the async `connection` which was used by the event `loop`, without
+    waiting for it to finish. If `loop` is closed, the connection is closed
+    on the running loop instead, or on a new loop if none is running.
+
+    :param loop: Event loop the connection was created for
+    :param connection: Async client to close
+    :type loop: asyncio.AbstractEventLoop
+    :type connection: pymongo.AsyncMongoClient
+
+    """
+    if not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_close(connection), loop)
+        return
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(_close(connection))
+        return
+
+    task = running.create_task(_close(connection))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+async def _close(connection):
+    """Close the async `connection`, logging any errors."""
+    try:
+        await connection.close()
+    except Exception:
+        logging.getLogger(__name__).exception("Error closing async connection")
@@ -3,18 +3,40 @@ Preaggregated reporting
 
 """
 
+import abc
+import array
+import atexit
+import bisect
 import calendar
+import collections
 import datetime
+import hashlib
+import json
+import logging
+import math
+import os
 import random
-from collections import defaultdict
+import re
+import socket
+import threading
+import time
+import weakref
 
+import bson
 import pytool
+from bson.raw_bson import RawBSONDocument
 from pytool.lang import classproperty
 
 import humbledb
 from humbledb import _version
-from humbledb.document import Document, Embed
+from humbledb.document import Document, DocumentMeta, Embed
 from humbledb.index import Index
+from humbledb.mongo import Mongo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Interval and Period constants
 YEAR = 5
@@ -23,6 +45,33 @@ DAY = 3
 HOUR = 2
 MINUTE = 1
 
+# Memoized BSON elements for preallocation updates, keyed by document key,
+# period, interval and whether it's a leap year
+_PREALLOCATION_TEMPLATES = {}
+
+# Sockets used to send counts to aggregators, keyed by address. Each value is
+# the process id and socket, so forked processes make their own
+_AGGREGATOR_SOCKETS = {}
+
+# Buffers which haven't been closed yet, so they can be flushed at exit.
+# Buffers which are garbage collected before then are dropped from the set
+_OPEN_BUFFERS = weakref.WeakSet()
+
+# The range of DistinctReport.config_precision
+_MIN_PRECISION = 4
+_MAX_PRECISION = 16
+
+# Used to find the last instant before an excluded stop time
+_EPSILON = datetime.timedelta(microseconds=1)
+
+# Offsets from the start of a section for each index of the intervals which
+# always have the same length, used by _parse_section
+_INTERVAL_OFFSETS = {
+    DAY: [datetime.timedelta(days=i) for i in range(31)],
+    HOUR: [datetime.timedelta(hours=i) for i in range(24)],
+    MINUTE: [datetime.timedelta(minutes=i) for i in range(60)],
+}
+
 # Constants used for informative string messages
 _PERIOD_NAMES = {
     YEAR: "YEAR",
@@ -63,6 +112,53 @@ class Report(Document):
     attempted, from 0.0 to 1.0. Set this to 0 to disable future preallocation.
     """
 
+    config_preallocation_tracker = None
+    """ A callable which returns the tracker used to remember which documents
+    have already been preallocated, such as :class:`BloomPreallocationTracker`.
+    By default an exact :class:`PreallocationTracker` is used. """
+
+    config_sparse = False
+    """ Whether documents are created without preallocation, so that counts
+    are stored as embedded documents keyed by their offset, for example
+    ``{'4': {'7': 1}}`` for the 8th hour of the 5th day. This uses far less
+    space for events which are rarely recorded, but is slower to write for
+    busy events. :class:`ReportQuery` reads both layouts. """
+
+    config_sparse_threshold = None
+    """ When :attr:`config_sparse` is set, this is the number of non-zero
+    counts at the smallest interval after which an event's documents are
+    preallocated, starting with the next period. By default documents are
+    never preallocated. """
+
+    config_rollup_separator = None
+    """ If this is set, counts for events containing this separator are also
+    recorded for each of their ancestors, in the same write. For example, with
+    ``'/'``, recording ``'content/a/b'`` also records ``'content/a/*'`` and
+    ``'content/*'``. Querying an ancestor, like ``PageViews.daily('content/*')``,
+    then reads a single document per period instead of summing a regex query.
+    Regex queries skip the ancestor events, unless they're asked for with
+    ``rollups=True``. """
+
+    config_aggregator = None
+    """ The address of a :class:`~humbledb.aggregator.ReportAggregator`,
+    either a Unix socket path or a ``(host, port)`` tuple for UDP. When this is
+    set, :meth:`record` sends counts to the aggregator without waiting for
+    them to be written, and counts are lost if the aggregator isn't running.
+    """
+
+    config_counter_shards = 1
+    """ The number of documents each event's counts are spread across for each
+    period. Every write goes to one of them at random, so very frequent events
+    don't all contend for a single document. :class:`ReportQuery` sums the
+    shards when reading. Each shard is preallocated, so this multiplies the
+    storage used by each event. """
+
+    config_query_cache = None
+    """ A :class:`ReportQueryCache` used to remember the documents read by
+    :class:`ReportQuery` for each period. Periods which have ended are cached
+    until they're evicted, so this should only be used if counts aren't
+    recorded for past periods. By default nothing is cached. """
+
     config_indexes = [
         Index([("meta.period", humbledb.ASC), ("meta.event", humbledb.ASC)])
     ]
@@ -83,8 +179,15 @@ class Report(Document):
     # if a subclass changes a key, it is picked up correctly.
     _intervals = {}
 
-    # Mapping of datetimes to already preallocated document strings
-    _preallocated = defaultdict(set)
+    # Tracker of already preallocated documents, created for each class by
+    # :meth:`_preallocation_tracker`
+    _tracker = None
+
+    # The active ReportPreallocator for this class, if any
+    _preallocator = None
+
+    # The ReportQuery subclass used for queries, if it isn't ReportQuery
+    _query_class = None
 
     @classmethod
     def record_id(cls, event, stamp):
@@ -127,47 +230,253 @@ class Report(Document):
         :type count: int
 
         """
-        if not isinstance(count, int):
-            raise ValueError("'count' must be int, got %r instead" % type(count))
-
-        if stamp and not isinstance(stamp, (datetime.datetime, datetime.date)):
-            raise ValueError(
-                "'stamp' must be datetime or date, got %r instead" % type(stamp)
-            )
-
-        # Get our stamp as UTC time or use the current time
-        stamp = pytool.time.as_utc(stamp) if stamp else pytool.time.utcnow()
+        stamp = cls._record_stamp(stamp, count)
+        # Let the aggregator write the counts, if there is one
+        if cls.config_aggregator:
+            _send_to_aggregator(cls, event, stamp, count)
+            return
+        # Rolled up events are written together in a single bulk write
+        separator = cls.config_rollup_separator
+        if separator and separator in event:
+            cls.record_many([(event, stamp, count)])
+            return
         # Do preallocation
         cls._attempt_preallocation(event, stamp)
         # Get the update query
         update = cls._update_query(stamp, count)
+        # Sparse documents aren't preallocated, so they need their metadata
+        if cls.config_sparse:
+            update["$setOnInsert"] = cls._meta_fields(event, stamp)
         # Get our query doc
-        doc = {"_id": cls.record_id(event, stamp)}
+        doc = {"_id": cls._shard_id(cls.record_id(event, stamp))}
         _opts = {}
         if _version._lt("3.0.0"):
             _opts["safe"] = safe
         # Update/upsert the document, hooray
         cls.update(doc, update, upsert=True, **_opts)
 
+    @classmethod
+    def record_many(cls, records):
+        """
+        Record many events at once, and return the
+        :class:`~humbledb.bulk.BulkResult`, or ``None`` if there was nothing
+        to record.
+
+        Counts for the same report document are summed before writing, the
+        documents are preallocated using a single query to find which ones
+        already exist, and the counts are written with a single unordered
+        bulk upsert. This includes any events rolled up with
+        :attr:`config_rollup_separator`.
+
+        Example::
+
+            PageViews.record_many([
+                ('home', stamp, 1),
+                ('about', None, 2),  # Recorded now
+            ])
+
+        :param records: Iterable of ``(event, stamp, count)`` tuples, which \
+                take the same values as :meth:`record`
+        :type records: iterable
+
+        """
+        increments = {}  # Maps document ids to $inc clauses
+        events = {}  # Maps document ids to (event, stamp) tuples
+        for event, stamp, count in records:
+            stamp = cls._record_stamp(stamp, count)
+            update = cls._update_query(stamp, count)["$inc"]
+
+            for event in cls._rollup_events(event):
+                _id = cls.record_id(event, stamp)
+                inc = increments.get(_id)
+                if inc is None:
+                    increments[_id] = dict(update)
+                    events[_id] = (event, stamp)
+                    continue
+                for key, value in update.items():
+                    inc[key] = inc.get(key, 0) + value
+
+        if not increments:
+            return None
+
+        return cls._write_increments(increments, events)
+
+    @classmethod
+    def buffered(cls, connection=None, interval=1.0, max_size=10000):
+        """
+        Return a :class:`ReportBuffer` which aggregates recorded events in
+        memory and writes them to this report in bulk.
+
+        :param connection: Mongo subclass used for writing (optional)
+        :param interval: Seconds between background writes (default: ``1.0``)
+        :param max_size: Number of buffered counters which triggers a write \
+                (default: ``10000``)
+        :type connection: humbledb.mongo.Mongo
+        :type interval: float
+        :type max_size: int
+
+        """
+        return ReportBuffer(
+            cls, connection=connection, interval=interval, max_size=max_size
+        )
+
+    @classmethod
+    def preallocator(cls, connection=None, lead=300, interval=10, batch_size=100):
+        """
+        Return a :class:`ReportPreallocator` which preallocates the next
+        period's documents for recently recorded events, before the period
+        begins.
+
+        :param connection: Mongo subclass used for writing (optional)
+        :param lead: Seconds before the next period to start preallocating \
+                (default: ``300``)
+        :param interval: Seconds between background checks (default: ``10``)
+        :param batch_size: Documents preallocated before pausing \
+                (default: ``100``)
+        :type connection: humbledb.mongo.Mongo
+        :type lead: float
+        :type interval: float
+        :type batch_size: int
+
+        """
+        return ReportPreallocator(
+            cls,
+            connection=connection,
+            lead=lead,
+            interval=interval,
+            batch_size=batch_size,
+        )
+
     @classproperty
     def yearly(cls):
-        return ReportQuery(cls, YEAR)
+        return (cls._query_class or ReportQuery)(cls, YEAR)
 
     @classproperty
     def monthly(cls):
-        return ReportQuery(cls, MONTH)
+        return (cls._query_class or ReportQuery)(cls, MONTH)
 
     @classproperty
     def daily(cls):
-        return ReportQuery(cls, DAY)
+        return (cls._query_class or ReportQuery)(cls, DAY)
 
     @classproperty
     def hourly(cls):
-        return ReportQuery(cls, HOUR)
+        return (cls._query_class or ReportQuery)(cls, HOUR)
 
     @classproperty
     def per_minute(cls):
-        return ReportQuery(cls, MINUTE)
+        return (cls._query_class or ReportQuery)(cls, MINUTE)
+
+    @classmethod
+    def _record_stamp(cls, stamp, count):
+        """
+        Return `stamp` as a UTC datetime, or the current time if `stamp` is
+        not given, after checking the arguments to :meth:`record`.
+
+        :param stamp: Datetime stamp for an event
+        :param count: Number to increment
+        :type stamp: datetime.datetime
+        :type count: int
+
+        """
+        if not isinstance(count, int):
+            raise ValueError("'count' must be int, got %r instead" % type(count))
+
+        if stamp and not isinstance(stamp, (datetime.datetime, datetime.date)):
+            raise ValueError(
+                "'stamp' must be datetime or date, got %r instead" % type(stamp)
+            )
+
+        # Get our stamp as UTC time or use the current time
+        return pytool.time.as_utc(stamp) if stamp else pytool.time.utcnow()
+
+    @classmethod
+    def _write_increments(cls, increments, events):
+        """
+        Upsert aggregated counts for many report documents with a single
+        unordered bulk write.
+
+        :param increments: Mapping of document ids to ``$inc`` clauses
+        :param events: Mapping of document ids to ``(event, stamp)`` tuples, \
+                used for preallocation
+        :type increments: dict
+        :type events: dict
+
+        """
+        cls._preallocate_many(events.values())
+
+        batch_size = len(increments)
+        with cls.bulk(ordered=False, batch_size=batch_size, manipulate=False) as bulk:
+            for _id, inc in increments.items():
+                update = {"$inc": inc}
+                if cls.config_sparse:
+                    update["$setOnInsert"] = cls._meta_fields(*events[_id])
+                bulk.upsert({"_id": cls._shard_id(_id)}, update)
+
+        return bulk.result
+
+    @classmethod
+    def _rollup_events(cls, event):
+        """
+        Return a list of `event` and the events it's rolled up into. See
+        :attr:`config_rollup_separator`.
+
+        :param event: Event identifier string
+        :type event: str
+
+        """
+        separator = cls.config_rollup_separator
+        if not separator or separator not in event:
+            return [event]
+
+        parts = event.split(separator)
+        return [event] + [
+            separator.join(parts[:i]) + separator + "*"
+            for i in range(len(parts) - 1, 0, -1)
+        ]
+
+    @classmethod
+    def _meta_fields(cls, event, stamp):
+        """
+        Return the metadata fields for the document for `event` during the
+        period containing `stamp`.
+
+        :param event: Event identifier string
+        :param stamp: A UTC datetime
+        :type event: str
+        :type stamp: datetime.datetime
+
+        """
+        return {cls.meta.event: event, cls.meta.period: cls._period(stamp)}
+
+    @classmethod
+    def _shard_id(cls, _id):
+        """
+        Return the id of a random counter shard for the document `_id`. See
+        :attr:`config_counter_shards`.
+
+        :param _id: Document id from :meth:`record_id`
+        :type _id: str
+
+        """
+        shards = cls.config_counter_shards
+        if shards > 1:
+            shard = random.randrange(shards)
+            # The first shard is the unsharded document
+            if shard:
+                return "%s#%d" % (_id, shard)
+        return _id
+
+    @classmethod
+    def _shard_ids(cls, _id):
+        """
+        Return the ids of all the counter shards for the document `_id`.
+
+        :param _id: Document id from :meth:`record_id`
+        :type _id: str
+
+        """
+        return [_id] + ["%s#%d" % (_id, s) for s in range(1, cls.config_counter_shards)]
 
     @classmethod
     def _update_query(cls, stamp, count=1):
@@ -255,6 +564,12 @@ class Report(Document):
         # very fast once it is confirmed as preallocated by the client
         cls._preallocate(event, stamp)
 
+        # When there is a preallocator, it handles the next period instead
+        preallocator = cls.__dict__.get("_preallocator")
+        if preallocator is not None:
+            preallocator.track(event, stamp)
+            return
+
         # We sometimes attempt to preallocate for the next period... this needs
         # to be tuned according to how many documents and writes are generated
         # per period
@@ -277,74 +592,234 @@ class Report(Document):
         """
         # Get the time period for this report
         period = cls._period(stamp)
+        tracker = cls._preallocation_tracker()
         # If we already have preallocated for this time period, get out of here
-        if event in cls._preallocated[period]:
+        if tracker.seen(period, event):
+            return
+
+        # Sparse documents are only preallocated once the event is busy
+        if cls.config_sparse and not cls._promote_sparse(event, period):
+            # If the period has started, the previous period is done, so we
+            # can remember this
+            if period <= cls._period(pytool.time.utcnow()):
+                tracker.add(period, event)
             return
 
-        # Do a fast check if the document exists
+        # Do a fast check if the documents exist
         # if cls.find({cls._id: cls.record_id(event, stamp)}).limit(1).count():
-        if cls.find_one({cls._id: cls.record_id(event, stamp)}):
+        ids = cls._shard_ids(cls.record_id(event, stamp))
+        if len(ids) > 1:
+            found = cls.find({cls._id: {"$in": ids}}, {cls._id: 1})
+            found = {doc._id for doc in found}
+            ids = [_id for _id in ids if _id not in found]
+        elif cls.find_one({cls._id: ids[0]}):
+            ids = []
+
+        for _id in ids:
+            # Get our query and update clauses
+            query, update = cls._preallocate_query(event, stamp, _id)
+            try:
+                _opts = {}
+                if _version._lt("3.0.0"):
+                    _opts["safe"] = True
+                # We always want preallocation to be "safe" in order to avoid
+                # race conditions with the subsequent update
+                cls.update(query, update, upsert=True, **_opts)
+            except humbledb.errors.DuplicateKeyError:  # pragma: no cover
+                # Someone else created it first, so we're done
+                continue
+
+        # Add the event identifier to the already preallocated documents for
+        # this period
+        tracker.add(period, event)
+
+    @classmethod
+    def _preallocate_many(cls, events, future=True):
+        """
+        Preallocate the documents for many events at once. This does the same
+        as :meth:`_attempt_preallocation` for each event, but finds which
+        documents already exist with a single query, and creates the rest
+        with a single unordered bulk upsert.
+
+        :param events: Iterable of ``(event, stamp)`` tuples
+        :param future: Whether the next period is also handled, as in \
+                :meth:`_attempt_preallocation` (default: ``True``)
+        :type events: iterable
+        :type future: bool
+
+        """
+        # Sparse documents need to be checked one at a time
+        if cls.config_sparse:
+            for event, stamp in events:
+                if future:
+                    cls._attempt_preallocation(event, stamp)
+                else:
+                    cls._preallocate(event, stamp)
             return
 
-        # Get our query and update clauses
-        query, update = cls._preallocate_query(event, stamp)
-        try:
-            _opts = {}
-            if _version._lt("3.0.0"):
-                _opts["safe"] = True
-            # We always want preallocation to be "safe" in order to avoid race
-            # conditions with the subsequent update
-            cls.update(query, update, upsert=True, **_opts)
-        except humbledb.errors.DuplicateKeyError:  # pragma: no cover
-            # Get out of here, we're done
+        period = cls.config_period
+        tracker = cls._preallocation_tracker()
+        preallocator = cls.__dict__.get("_preallocator")
+
+        pending = {}  # Maps document ids to (event, stamp, period) tuples
+        for event, stamp in events:
+            stamps = [stamp]
+            if future and preallocator is not None:
+                preallocator.track(event, stamp)
+            elif future and random.random() < cls.config_preallocation:
+                stamps.append(_relative_period(period, stamp, 1))
+
+            for stamp in stamps:
+                doc_period = cls._period(stamp)
+                if tracker.seen(doc_period, event):
+                    continue
+                for _id in cls._shard_ids(cls.record_id(event, stamp)):
+                    pending[_id] = (event, stamp, doc_period)
+
+        if not pending:
+            return
+
+        # Find out which documents already exist
+        for doc in cls.find({cls._id: {"$in": list(pending)}}, {cls._id: 1}):
+            event, _, doc_period = pending.pop(doc._id)
+            tracker.add(doc_period, event)
+
+        if not pending:
             return
 
-        # XXX: This will not scale well! However it should be good up to 100k
-        # or so event identifiers. Maybe a bloom filter would work better?
+        try:
+            with cls.bulk(
+                ordered=False, batch_size=len(pending), manipulate=False
+            ) as bulk:
+                for _id, (event, stamp, _) in pending.items():
+                    bulk.upsert(*cls._preallocate_query(event, stamp, _id))
+        except humbledb.errors.BulkWriteError as exc:
+            # Documents which were created since we checked will raise
+            # duplicate key errors, which are fine
+            details = exc.details
+            if details.get("writeConcernErrors") or any(
+                error.get("code") != 11000 for error in details.get("writeErrors", [])
+            ):
+                raise
+
+        for event, _, doc_period in pending.values():
+            tracker.add(doc_period, event)
+
+    @classmethod
+    def _promote_sparse(cls, event, period):
+        """
+        Return whether the sparse document for `event` during `period` should
+        be preallocated, because the previous period's document has at least
+        :attr:`config_sparse_threshold` non-zero counts.
+
+        :param event: Event identifier string
+        :param period: Start of a report period
+        :type event: str
+        :type period: datetime.datetime
+
+        """
+        threshold = cls.config_sparse_threshold
+        if not threshold:
+            return False
+
+        # Check the smallest interval, since it has the most counts
+        key = cls._map_interval(min(cls.config_intervals))
+        previous = _relative_period(cls.config_period, period, -1)
+        ids = cls._shard_ids(cls.record_id(event, previous))
+        if len(ids) > 1:
+            docs = cls.find({cls._id: {"$in": ids}}, {key: 1})
+        else:
+            docs = [cls.find_one({cls._id: ids[0]}, {key: 1})]
+
+        # Counter shards may each have counts for the same interval, so we
+        # count the distinct timestamps with counts
+        stamps = set()
+        for doc in docs:
+            values = doc and doc.get(key)
+            if values is not None:
+                section = _parse_section(values, cls.config_period - 1, previous)
+                stamps.update(stamp for stamp, _ in section)
+        return len(stamps) >= threshold
 
-        # Add the event identifier to the list of already preallocated
-        # documents for this period
-        cls._preallocated[period].add(event)
+    @classmethod
+    def _preallocation_tracker(cls):
+        """
+        Return the preallocation tracker for this class, creating it if it
+        doesn't exist yet.
 
-        # Clean up the old preallocation records
-        if len(cls._preallocated) > 2:
-            previous = _relative_period(cls.config_period, period, -2)
-            cls._preallocated.pop(previous, None)
+        """
+        tracker = cls.__dict__.get("_tracker")
+        if tracker is None:
+            factory = cls.config_preallocation_tracker or PreallocationTracker
+            tracker = factory()
+            cls._tracker = tracker
+        return tracker
 
     @classmethod
-    def _preallocate_query(cls, event, stamp):
+    def _preallocate_query(cls, event, stamp, _id=None):
         """
         Return the query and update for preallocating a document.
 
         :param event: Event identifier string
         :param stamp: A UTC datetime indicating the document period
+        :param _id: Document id, if it's a counter shard (optional)
         :type event: str
         :type stamp: datetime.datetime
+        :type _id: str
 
         """
         period = cls.config_period
 
         # Build the base query, which is just a lookup against the id
-        query = {"_id": cls.record_id(event, stamp)}
+        query = {"_id": _id or cls.record_id(event, stamp)}
 
-        # Start with an empty update clause
-        update = {}
+        # The event and period are the only values which aren't templated
+        update = bson.encode(cls._meta_fields(event, stamp))
+        elements = [update[4:-1]]
         for interval in cls.config_intervals:
             key = cls._map_interval(interval)
             # Update the query to exclude documents which already have a value
             # for each interval key
             query[key] = {"$exists": 0}
             # Update the update clause with the preallocated structures
-            update[key] = cls._preallocate_interval(period, interval, stamp)
-
-        update[cls.meta.event] = event
-        update[cls.meta.period] = cls._period(stamp)
+            elements.append(cls._preallocate_template(key, period, interval, stamp))
 
-        # Make the update clause a $set
-        update = {"$set": update}
+        # Make the update clause a $set of the BSON document we built
+        elements = b"".join(elements)
+        update = (len(elements) + 5).to_bytes(4, "little") + elements + b"\x00"
+        update = {"$set": RawBSONDocument(update)}
 
         return query, update
 
+    @classmethod
+    def _preallocate_template(cls, key, period, interval, stamp):
+        """
+        Return the BSON encoded `key` element of a preallocation update for
+        `interval` during the period containing `stamp`.
+
+        These are memoized, since they are only different for each period,
+        interval and (for yearly periods) whether it's a leap year.
+
+        :param key: Document key for `interval`
+        :param period: The containing period
+        :param interval: A time interval
+        :param stamp: A datetime UTC within the preallocated period
+        :type key: str
+        :type period: int
+        :type interval: int
+        :type stamp: datetime.datetime
+
+        """
+        leap = period == YEAR and interval <= DAY and calendar.isleap(stamp.year)
+        template = (key, period, interval, leap)
+        element = _PREALLOCATION_TEMPLATES.get(template)
+        if element is None:
+            value = cls._preallocate_interval(period, interval, stamp)
+            # Strip the length and terminator to leave just the element
+            element = bson.encode({key: value})[4:-1]
+            _PREALLOCATION_TEMPLATES[template] = element
+        return element
+
     @classmethod
     def _preallocate_interval(cls, period, interval, stamp, hint=None):
         """
@@ -363,9 +838,9 @@ class Report(Document):
         :type hint: int
 
         """
-        # XXX: This method does recursive allocation of the sub-keys values,
-        # which when done many, many times, may be slow. This would be easily
-        # optimized by memoizing these at module load time.
+        # This method does recursive allocation of the sub-keys values, which
+        # is slow for the finer intervals, so preallocation updates use
+        # memoized templates from _preallocate_template instead
         start = 1
         if period == interval:
             return 0
@@ -398,411 +873,1845 @@ class Report(Document):
         return _period(cls.config_period, stamp)
 
 
-class ReportQuery(object):
+class PreallocationTracker(object):
     """
-    Class used to slice :class:`Report`: objects and get data back in a
-    convenient form.
+    Remembers which events have had their :class:`Report` document
+    preallocated, for the two most recent periods, so that the database
+    doesn't have to be checked for every recorded event.
 
-    This enables syntactic sugar of the form:
-
-        class PageViews(Report):
-            config_database = 'humble'
-            config_collection = 'views.page'
-
-        # Datetimes always work for indices and slices
-        start = datetime.datetime(2013, 1, 1)
-        end = datetime.datetime(2013, 8, 1)
-        day = datetime.datetime(2013, 7, 5)
+    This tracker is exact, and keeps a set of the events for each period.
+    Subclasses can use a different container by overriding
+    :meth:`_new_period`.
 
-        views = PageViews.monthly[start:end]
+    """
 
-        home_views = PageViews.monthly('home')[start:]
+    def __init__(self):
+        self._periods = {}
 
-        content_views = PageViews.daily('content/.*')[day:]
+    def seen(self, period, event):
+        """
+        Return ``True`` if `event` has been added for `period`.
 
-        # What makes sense for yearly?
-        per_year = PageViews.yearly[-3:]  # Last three years (including this year)
+        :param period: Start of a report period
+        :param event: Event identifier string
+        :type period: datetime.datetime
+        :type event: str
 
-        # What makes sense for monthly?
-        per_month = PageViews.monthly[2:7]  # February through June (July excluded)
-        per_month = PageViews.monthly[1:]  # This year
+        """
+        events = self._periods.get(period)
+        return events is not None and event in events
 
-        # What makes sense for daily?
-        per_day = PageViews.daily[-7:]  # Last 7 days
-        per_day = PageViews.daily[1:]  # This month
+    def add(self, period, event):
+        """
+        Remember that `event` has been preallocated for `period`.
 
-        # What makes sense for hourly?
-        per_hour = PageViews.hourly[8:13]  # 8am - 12pm
-        per_hour = PageViews.hourly[1:]  # Today
+        :param period: Start of a report period
+        :param event: Event identifier string
+        :type period: datetime.datetime
+        :type event: str
 
-        # What makes sense for minutes
-        per_minute = PageViews.per_minute[-5:]  # Last 5 minutes
+        """
+        events = self._periods.get(period)
+        if events is None:
+            events = self._periods[period] = self._new_period()
+            # Only the current and next periods are needed, so we drop any
+            # older ones
+            for old in sorted(self._periods)[:-2]:
+                self._periods.pop(old, None)
+        events.add(event)
 
-        # Get all views for all URLs over the last 7 days
-        views = PageViews.daily[-7:]
-        # Without an event restriction, all matching events are returned as a
-        # dictionary mapping event identifier strings to lists of integers
-        for url in views:
-            for count in url:
-                print url, count.timestamp, count  # datetime(2013, 7, 5), 3
+    def _new_period(self):
+        """Return a new container for the events in a period."""
+        return set()
 
-        # With one, it just returns a list of integers
-        views = PageViews.daily('home')[-1:]
-        for count in views:
-            print 'home', count.timestamp, count
 
+class BloomPreallocationTracker(PreallocationTracker):
     """
+    A :class:`PreallocationTracker` which uses a bloom filter for each
+    period, so its memory use is fixed no matter how many events there are.
 
-    def __init__(self, cls, interval):
-        self.cls = cls
-        self.interval = interval
-        self.event = None
-        self.regex = False
-        self.anywhere = False
+    A false positive means an event's document isn't preallocated, and its
+    counts will be stored as embedded documents rather than lists, like a
+    :attr:`~Report.config_sparse` report. :class:`ReportQuery` reads and
+    sums these too, but they can't be sliced to the queried range. The
+    default `error_rate` makes this very unlikely, and should only be raised
+    with care. Misses still fall back to checking the database.
 
-        # We need to get a document key that works best for the interval we're
-        # looking for
-        self.query_interval = max(
-            [0] + [k for k in self.cls.config_intervals if k <= self.interval]
-        )
+    Example::
 
-        # If the query_interval is equal to 0, it means we can't satisfy the
-        # required precision for this query type
-        if not self.query_interval:
-            raise ValueError(
-                "Unable to satisfy precision: %r" % (_PERIOD_NAMES[self.interval])
+        class PageViews(Report):
+            config_preallocation_tracker = functools.partial(
+                BloomPreallocationTracker, capacity=5000000
             )
-        self.query_key = self.cls._map_interval(self.query_interval)
 
-    def __call__(self, event, regex=False, anywhere=False):
-        self.event = event
-        self.regex = regex
-        self.anywhere = anywhere
-        return self
+    :param capacity: Expected number of events per period
+    :param error_rate: False positive rate at `capacity` events
+    :type capacity: int
+    :type error_rate: float
 
-    def __getitem__(self, index):
-        if isinstance(index, slice):
-            if index.step:
-                raise TypeError("Reports do not allow extended slices")
-            return self._get_range(index.start, index.stop)
+    """
 
-        raise TypeError("Reports must use slice syntax")
+    def __init__(self, capacity=1000000, error_rate=1e-9):
+        if capacity < 1:
+            raise ValueError("'capacity' must be at least 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("'error_rate' must be between 0 and 1")
 
-    def _get_range(self, start, stop):
-        """
-        Return counts for the range `start` to `stop` as a list.
+        super(BloomPreallocationTracker, self).__init__()
+        # Optimal number of bits and hashes for the capacity and error rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
 
-        :param start: Start time (inclusive)
-        :param stop: Stop time (excluded)
-        :type start: datetime.datetime
-        :type stop: datetime.datetime
+    def _new_period(self):
+        return _BloomFilter(self.bits, self.hashes)
 
-        """
-        # We use the same value for `now` for both `start` and `stop` to cover
-        # the *very* rare edge case where the two method calls would cover an
-        # interval boundary
-        now = pytool.time.utcnow()
 
-        # Coerce whatever values the user gave us into datetimes or throw an
-        # exception
-        if start is None:
-            # XXX: This has a limit against Unix 0 (1970-01-01), but if you
-            # need data with dates before then, this probably isn't for you
-            # This means get all records up until stop
-            start = pytool.time.fromutctimestamp(0)
+class _BloomFilter(object):
+    """A set-like bloom filter of strings, with `bits` bits and `hashes` hash
+    functions."""
 
-        if stop is None:
-            # This means get all records between start and now
+    __slots__ = ("bits", "hashes", "_array")
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value):
+        """Return the bit positions for `value`, using double hashing."""
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        return [(first + i * second) % bits for i in range(self.hashes)]
+
+    def __contains__(self, value):
+        array = self._array
+        for position in self._positions(value):
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, value):
+        array = self._array
+        for position in self._positions(value):
+            array[position >> 3] |= 1 << (position & 7)
+
+
+class ReportBuffer(object):
+    """
+    Write-behind buffer for :meth:`Report.record`. Recorded counts are summed
+    in memory for each report document and counter, and written with a
+    single unordered bulk upsert when the buffer is flushed. Hot events which
+    are recorded many times between flushes only cost one increment per
+    counter.
+
+    The buffer is flushed:
+
+    * every `interval` seconds by a background thread, if a `connection` is
+      given,
+    * when more than `max_size` distinct counters are buffered,
+    * when :meth:`flush` or :meth:`close` are called, when used as a context
+      manager, and at interpreter exit.
+
+    If no `connection` is given, flushes have to happen within a
+    :class:`~humbledb.mongo.Mongo` context, as with :meth:`Report.record`.
+
+    Counts which fail to be written by the background thread or at exit are
+    logged and discarded, so that the buffer never grows without bound.
+
+    Example::
+
+        views = PageViews.buffered(MyConnection, interval=5)
+
+        # In a request handler
+        views.record('home')
+
+    :param report: Report subclass to record events for
+    :param connection: Mongo subclass used for writing (optional)
+    :param interval: Seconds between background writes (default: ``1.0``)
+    :param max_size: Number of buffered counters which triggers a write \
+            (default: ``10000``)
+    :type report: type
+    :type connection: humbledb.mongo.Mongo
+    :type interval: float
+    :type max_size: int
+
+    """
+
+    def __init__(self, report, connection=None, interval=1.0, max_size=10000):
+        if max_size < 1:
+            raise ValueError("'max_size' must be at least 1")
+
+        self.report = report
+        self.connection = connection
+        self.interval = interval
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._increments = {}  # Maps document ids to $inc clauses
+        self._events = {}  # Maps document ids to (event, stamp) tuples
+        self._size = 0  # Number of buffered counters
+
+        self._closed = threading.Event()
+        self._thread = None
+        if connection is not None and interval:
+            self._thread = threading.Thread(
+                target=self._run, name="humbledb-report-buffer", daemon=True
+            )
+            self._thread.start()
+
+        _OPEN_BUFFERS.add(self)
+
+    def __len__(self):
+        """Return the number of buffered counters."""
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, event, stamp=None, count=1):
+        """
+        Buffer an instance of `event` that happened at `stamp`. This takes
+        the same arguments as :meth:`Report.record`.
+
+        :param event: Event identifier string
+        :param stamp: Datetime stamp for this event (default: now)
+        :param count: Number to increment
+        :type event: str
+        :type stamp: datetime.datetime
+        :type count: int
+
+        """
+        report = self.report
+        stamp = report._record_stamp(stamp, count)
+        update = report._update_query(stamp, count)["$inc"]
+        ids = [(report.record_id(e, stamp), e) for e in report._rollup_events(event)]
+
+        with self._lock:
+            for _id, event in ids:
+                increments = self._increments.get(_id)
+                if increments is None:
+                    increments = self._increments[_id] = {}
+                    self._events[_id] = (event, stamp)
+                for key, value in update.items():
+                    if key not in increments:
+                        increments[key] = value
+                        self._size += 1
+                    else:
+                        increments[key] += value
+            full = self._size >= self.max_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the buffered counts to the database and return the
+        :class:`~humbledb.bulk.BulkResult`, or ``None`` if there was nothing
+        to write.
+
+        """
+        with self._lock:
+            increments, self._increments = self._increments, {}
+            events, self._events = self._events, {}
+            self._size = 0
+
+        if not increments:
+            return None
+
+        # Only enter the connection context if we're not already in it
+        connection = self.connection
+        if connection is None or connection in Mongo.contexts:
+            return self.report._write_increments(increments, events)
+
+        with connection:
+            return self.report._write_increments(increments, events)
+
+    def clear(self):
+        """Discard all the buffered counts."""
+        with self._lock:
+            self._increments = {}
+            self._events = {}
+            self._size = 0
+
+    def close(self):
+        """Stop the background thread, if any, and flush the buffer."""
+        _OPEN_BUFFERS.discard(self)
+        self._closed.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        """Background thread which flushes every :attr:`interval` seconds."""
+        while not self._closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Discarding buffered counts for %r", self.report.__name__
+                )
+
+    def _exit(self):
+        """Close the buffer at interpreter exit."""
+        try:
+            self.close()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "Discarding buffered counts for %r", self.report.__name__
+            )
+
+
+@atexit.register
+def _close_buffers():
+    """Close the buffers which are still open at interpreter exit."""
+    for buf in list(_OPEN_BUFFERS):
+        buf._exit()
+
+
+class ReportPreallocator(object):
+    """
+    Background preallocator for :class:`Report` documents. Events which are
+    recorded during the current period are tracked, and when the next
+    period is less than `lead` seconds away, their documents for the next
+    period are preallocated in batches of `batch_size`. This avoids a burst
+    of large preallocation upserts in the first writes of each period.
+
+    Checks happen every `interval` seconds in a background thread if a
+    `connection` is given. Otherwise, :meth:`run` can be called
+    periodically from within a :class:`~humbledb.mongo.Mongo` context.
+
+    Only one preallocator can be active for a report class at a time.
+
+    Example::
+
+        preallocator = PageViews.preallocator(MyConnection, lead=600)
+
+        # Later, to check on it
+        preallocator.metrics()
+
+    :param report: Report subclass to preallocate documents for
+    :param connection: Mongo subclass used for writing (optional)
+    :param lead: Seconds before the next period to start preallocating \
+            (default: ``300``)
+    :param interval: Seconds between background checks (default: ``10``)
+    :param batch_size: Documents preallocated before pausing \
+            (default: ``100``)
+    :param pause: Seconds to pause between batches (default: ``0.1``)
+    :type report: type
+    :type connection: humbledb.mongo.Mongo
+    :type lead: float
+    :type interval: float
+    :type batch_size: int
+    :type pause: float
+
+    """
+
+    def __init__(
+        self, report, connection=None, lead=300, interval=10, batch_size=100, pause=0.1
+    ):
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be at least 1")
+        if report.__dict__.get("_preallocator") is not None:
+            raise RuntimeError(
+                "%r already has an active preallocator" % report.__name__
+            )
+
+        self.report = report
+        self.connection = connection
+        self.lead = lead
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._lock = threading.Lock()
+        self._events = {}  # Maps events to the latest period they were seen in
+
+        # Metrics for the last run
+        self._period = None  # The period being preallocated
+        self._tracked = 0  # Events which were active in the previous period
+        self._covered = 0  # Tracked events which have been preallocated
+        self._lag = 0.0  # Seconds the last run finished after the period began
+
+        report._preallocator = self
+
+        self._closed = threading.Event()
+        self._thread = None
+        if connection is not None and interval:
+            self._thread = threading.Thread(
+                target=self._run, name="humbledb-report-preallocator", daemon=True
+            )
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def track(self, event, stamp):
+        """
+        Remember that `event` was recorded at `stamp`. This is called by
+        :meth:`Report.record` while the preallocator is active.
+
+        :param event: Event identifier string
+        :param stamp: A UTC datetime
+        :type event: str
+        :type stamp: datetime.datetime
+
+        """
+        period = self.report._period(stamp)
+        with self._lock:
+            latest = self._events.get(event)
+            if latest is None or latest < period:
+                self._events[event] = period
+
+    def run(self, now=None):
+        """
+        Preallocate the next period for every tracked event if it begins
+        within :attr:`lead` seconds, and return how many events needed
+        preallocating.
+
+        :param now: Datetime to use as the current time (optional)
+        :type now: datetime.datetime
+
+        """
+        report = self.report
+        started = time.monotonic()
+        now = pytool.time.as_utc(now) if now else pytool.time.utcnow()
+        current = report._period(now)
+        upcoming = _relative_period(report.config_period, current, 1)
+
+        # Only events active in this period are preallocated, and any
+        # inactive events are forgotten
+        with self._lock:
+            events = [e for e, p in self._events.items() if p >= current]
+            if len(events) < len(self._events):
+                self._events = {e: p for e, p in self._events.items() if p >= current}
+
+        if (upcoming - now).total_seconds() > self.lead:
+            return 0
+
+        tracker = report._preallocation_tracker()
+        pending = [e for e in events if not tracker.seen(upcoming, e)]
+        for i in range(0, len(pending), self.batch_size):
+            # Pause between batches to spread out the load
+            if i and self._closed.wait(self.pause):
+                break
+            batch = pending[i : i + self.batch_size]
+            report._preallocate_many([(e, upcoming) for e in batch], future=False)
+
+        self._period = upcoming
+        self._tracked = len(events)
+        self._covered = sum(1 for e in events if tracker.seen(upcoming, e))
+        finished = (now - upcoming).total_seconds() + time.monotonic() - started
+        self._lag = max(0.0, finished)
+        return len(pending)
+
+    def metrics(self):
+        """
+        Return a dictionary of metrics for the most recent run:
+
+        * ``period``: The period being preallocated, or ``None``
+        * ``tracked``: Number of events active in the current period
+        * ``covered``: Number of those events which are preallocated
+        * ``coverage``: Fraction of the tracked events which are covered
+        * ``lag``: Seconds after the period began that the run finished, \
+          which is ``0`` if it finished in time
+
+        """
+        tracked = self._tracked
+        return {
+            "period": self._period,
+            "tracked": tracked,
+            "covered": self._covered,
+            "coverage": self._covered / tracked if tracked else 1.0,
+            "lag": self._lag,
+        }
+
+    def close(self):
+        """Stop the background thread, if any, and stop tracking events."""
+        self._closed.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if self.report.__dict__.get("_preallocator") is self:
+            self.report._preallocator = None
+
+    def _run(self):
+        """Background thread which checks every :attr:`interval` seconds."""
+        while not self._closed.wait(self.interval):
+            try:
+                with self.connection:
+                    self.run()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Error preallocating for %r", self.report.__name__
+                )
+
+
+class ReportQueryCache(object):
+    """
+    A least recently used cache of :class:`Report` documents for each period
+    read by :class:`ReportQuery`, for use as
+    :attr:`Report.config_query_cache`.
+
+    Documents for periods which have ended are kept until they're evicted.
+    Documents for the current period are kept for `ttl` seconds, so repeated
+    queries only read the current period from the database. One cache can be
+    shared by many report classes.
+
+    :param max_size: Number of periods to cache (default: ``10000``)
+    :param ttl: Seconds to cache the current period (default: ``5``)
+    :type max_size: int
+    :type ttl: float
+
+    """
+
+    def __init__(self, max_size=10000, ttl=5):
+        if max_size < 1:
+            raise ValueError("'max_size' must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the documents cached for `key`, or ``None`` if there aren't
+        any.
+
+        :param key: Cache key
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            docs, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return docs
+
+    def set(self, key, docs, closed=True):
+        """
+        Cache `docs` for `key`. If `closed` is ``False``, the documents are
+        only cached for :attr:`ttl` seconds.
+
+        :param key: Cache key
+        :param docs: List of report documents
+        :param closed: Whether the period has ended (default: ``True``)
+        :type docs: list
+        :type closed: bool
+
+        """
+        expires = None
+        if not closed:
+            if not self.ttl:
+                return
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (docs, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached documents."""
+        with self._lock:
+            self._entries.clear()
+
+
+class ReportQuery(object):
+    """
+    Class used to slice :class:`Report`: objects and get data back in a
+    convenient form.
+
+    This enables syntactic sugar of the form:
+
+        class PageViews(Report):
+            config_database = 'humble'
+            config_collection = 'views.page'
+
+        # Datetimes always work for indices and slices
+        start = datetime.datetime(2013, 1, 1)
+        end = datetime.datetime(2013, 8, 1)
+        day = datetime.datetime(2013, 7, 5)
+
+        views = PageViews.monthly[start:end]
+
+        home_views = PageViews.monthly('home')[start:]
+
+        content_views = PageViews.daily('content/.*')[day:]
+
+        # What makes sense for yearly?
+        per_year = PageViews.yearly[-3:]  # Last three years (including this year)
+
+        # What makes sense for monthly?
+        per_month = PageViews.monthly[2:7]  # February through June (July excluded)
+        per_month = PageViews.monthly[1:]  # This year
+
+        # What makes sense for daily?
+        per_day = PageViews.daily[-7:]  # Last 7 days
+        per_day = PageViews.daily[1:]  # This month
+
+        # What makes sense for hourly?
+        per_hour = PageViews.hourly[8:13]  # 8am - 12pm
+        per_hour = PageViews.hourly[1:]  # Today
+
+        # What makes sense for minutes
+        per_minute = PageViews.per_minute[-5:]  # Last 5 minutes
+
+        # Get all views for all URLs over the last 7 days
+        views = PageViews.daily[-7:]
+        # Without an event restriction, all matching events are returned as a
+        # dictionary mapping event identifier strings to lists of integers
+        for url in views:
+            for count in url:
+                print url, count.timestamp, count  # datetime(2013, 7, 5), 3
+
+        # With one, it just returns a list of integers
+        views = PageViews.daily('home')[-1:]
+        for count in views:
+            print 'home', count.timestamp, count
+
+    """
+
+    def __init__(self, cls, interval):
+        self.cls = cls
+        self.interval = interval
+        self.event = None
+        self.regex = False
+        self.anywhere = False
+        self.rollups = False
+        self.columnar = False
+
+        # We need to get a document key that works best for the interval we're
+        # looking for
+        self.query_interval = max(
+            [0] + [k for k in self.cls.config_intervals if k <= self.interval]
+        )
+
+        # If the query_interval is equal to 0, it means we can't satisfy the
+        # required precision for this query type
+        if not self.query_interval:
+            raise ValueError(
+                "Unable to satisfy precision: %r" % (_PERIOD_NAMES[self.interval])
+            )
+        self.query_key = self.cls._map_interval(self.query_interval)
+
+    def __call__(self, event, regex=False, anywhere=False, rollups=False):
+        self.event = event
+        self.regex = regex
+        self.anywhere = anywhere
+        self.rollups = rollups
+        return self
+
+    def as_columns(self):
+        """
+        Return this query set to return its results as
+        :class:`ReportColumns`, which hold one list of timestamps shared by
+        all the events and a compact count vector for each event.
+
+        Example::
+
+            views = PageViews.per_minute.as_columns()[-60:]
+            for stamp, count in zip(views.timestamps, views['home']):
+                print(stamp, count)
+
+        """
+        self.columnar = True
+        return self
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step:
+                raise TypeError("Reports do not allow extended slices")
+            return self._get_range(index.start, index.stop)
+
+        raise TypeError("Reports must use slice syntax")
+
+    def _get_range(self, start, stop):
+        """
+        Return counts for the range `start` to `stop` as a list.
+
+        :param start: Start time (inclusive)
+        :param stop: Stop time (excluded)
+        :type start: datetime.datetime
+        :type stop: datetime.datetime
+
+        """
+        # We use the same value for `now` for both `start` and `stop` to cover
+        # the *very* rare edge case where the two method calls would cover an
+        # interval boundary
+        now = pytool.time.utcnow()
+
+        # Coerce whatever values the user gave us into datetimes or throw an
+        # exception
+        if start is None:
+            # XXX: This has a limit against Unix 0 (1970-01-01), but if you
+            # need data with dates before then, this probably isn't for you
+            # This means get all records up until stop
+            start = pytool.time.fromutctimestamp(0)
+
+        if stop is None:
+            # This means get all records between start and now
             stop = now
 
-        start = self._coerce_index(start, now)
-        stop = self._coerce_index(stop, now, stop=True)
+        start = self._coerce_index(start, now)
+        stop = self._coerce_index(stop, now, stop=True)
+
+        query_interval = self.query_interval
+        query_key = self.query_key
+
+        # Get our results, if the range isn't empty. Cached documents are
+        # summed locally, so they're never rolled up
+        results = []
+        if start < stop:
+            rollup = self.cls.config_query_cache is None and self._can_rollup(
+                start, stop, now
+            )
+            # Rolled up counts are still parsed as if they were at the query
+            # interval, so they're summed into the interval containing them
+            results = self._find_range(start, stop, query_key, query_interval, rollup)
+
+        # Columnar results are returned as is, whatever the query
+        if self.columnar:
+            return self._parse_columns(results, start, stop, query_key, query_interval)
+
+        # Now we have to parse the results for the maximum ease of consumption
+        results = self._parse_results(results, start, stop, query_key, query_interval)
+
+        # We need to coerce the results according to whether or not we have
+        # a distinct event, or we're using a regex query
+        results = self._coerce_results(results)
+
+        return results
+
+    def _find_range(self, start, stop, query_key, query_interval, rollup=False):
+        """
+        Return an iterable of report documents covering `start` to `stop`,
+        sorted by period.
+
+        Only the top level values of `query_key` which cover the range are
+        returned for each document, by slicing them in an aggregation
+        pipeline. For example, asking for the last 5 minutes from a report
+        with ``DAY`` periods returns 5 values rather than 1440.
+
+        If `rollup` is ``True``, the counts are also summed up to
+        :attr:`interval` by the pipeline. See :meth:`_can_rollup`.
+
+        :param start: Start time (inclusive)
+        :param stop: Stop time (excluded)
+        :param query_key: Document key to query against
+        :param query_interval: The interval for `query_key`
+        :param rollup: Whether to sum the counts in the pipeline
+        :type start: datetime.datetime
+        :type stop: datetime.datetime
+        :type query_key: str
+        :type query_interval: int
+        :type rollup: bool
+
+        """
+        cls = self.cls
+        period = cls.config_period
+        period_key = cls.meta.period
+
+        cache = cls.config_query_cache
+        if cache is not None and not rollup:
+            results = self._find_cached_range(cache, start, stop, query_key)
+            if results is not None:
+                return results
+
+        project = {cls.meta.event: 1, period_key: 1, query_key: 1}
+
+        # If the key holds a single count, there's nothing to slice
+        if query_interval < period:
+            # Find the documents and positions of the first and last values
+            last = stop - _EPSILON
+            first_period = _period(period, start)
+            last_period = _period(period, last)
+            first = self._section_index(start)
+            end = self._section_index(last) + 1
+
+            if first_period == last_period:
+                project[query_key] = {"$slice": ["$" + query_key, first, end - first]}
+            else:
+                # Documents between the first and last are returned whole,
+                # and no top level list is longer than the 60 minutes in an
+                # hour
+                is_first = {"$eq": ["$" + period_key, first_period]}
+                is_last = {"$eq": ["$" + period_key, last_period]}
+                skip = {"$cond": [is_first, first, 0]}
+                limit = {"$subtract": [{"$cond": [is_last, end, 60]}, skip]}
+                project[query_key] = {"$slice": ["$" + query_key, skip, limit]}
+
+            # Sparse documents, and documents which a tracker wrongly
+            # thought were preallocated, can't be sliced, so they're
+            # returned whole
+            is_list = {"$isArray": "$" + query_key}
+            project[query_key] = {
+                "$cond": [is_list, project[query_key], "$" + query_key]
+            }
+
+        pipeline = [
+            {"$match": self._range_query(start, stop)},
+            {"$sort": {period_key: 1}},
+            {"$project": project},
+        ]
+
+        if rollup:
+            stages = self._rollup_stages(period - query_interval, project, start)
+            pipeline.extend(stages)
+
+        cls._ensure_indexes()
+        return map(cls, cls.collection.aggregate(pipeline))
+
+    def _find_cached_range(self, cache, start, stop, query_key):
+        """
+        Return a list of report documents covering `start` to `stop`, sorted
+        by period, using `cache` for each period's documents.
+
+        Only the periods missing from `cache` are read from the database, and
+        they're read whole. The first period's documents are sliced to begin
+        at `start`, to match :meth:`_find_range`. If the range covers more
+        periods than the cache can hold, ``None`` is returned.
+
+        :param cache: The cache to use
+        :param start: Start time (inclusive)
+        :param stop: Stop time (excluded)
+        :param query_key: Document key to query against
+        :type cache: ReportQueryCache
+        :type start: datetime.datetime
+        :type stop: datetime.datetime
+        :type query_key: str
+
+        """
+        cls = self.cls
+        period = cls.config_period
+        period_key = cls.meta.period
+        now = pytool.time.utcnow()
+
+        # Find the periods in the range, and which of them we have cached
+        periods = []
+        current = _period(period, start)
+        while current < stop:
+            if len(periods) >= cache.max_size:
+                return None
+            periods.append(current)
+            current = _relative_period(period, current, 1)
+
+        base_key = (
+            cls,
+            query_key,
+            self.event,
+            self.regex,
+            self.anywhere,
+            self.rollups,
+        )
+        cached = {p: cache.get(base_key + (p,)) for p in periods}
+        missing = [p for p in periods if cached[p] is None]
+
+        if missing:
+            query = self._range_query(start, stop)
+            query[period_key] = {"$in": missing}
+            project = {cls.meta.event: 1, period_key: 1, query_key: 1}
+
+            found = {p: [] for p in missing}
+            for doc in cls.find(query, project):
+                found[doc.meta.period].append(doc)
+
+            # Periods which are still going only get cached briefly
+            for p, docs in found.items():
+                closed = _relative_period(period, p, 1) <= now
+                cache.set(base_key + (p,), docs, closed)
+            cached.update(found)
+
+        results = [doc for p in periods for doc in cached[p]]
+
+        # Slice the first period's values, without changing the cached docs
+        first = self._section_index(start)
+        if first and cls.config_period > self.query_interval:
+            for i, doc in enumerate(results):
+                if doc.meta.period != periods[0]:
+                    break
+                # Sparse documents are never sliced
+                if not isinstance(doc[query_key], list):
+                    continue
+                sliced = cls(doc)
+                sliced[query_key] = doc[query_key][first:]
+                results[i] = sliced
+
+        return results
+
+    def _can_rollup(self, start, stop, now=None):
+        """
+        Return whether the counts for `start` to `stop` can be summed to
+        :attr:`interval` by the database.
+
+        This is possible when each top level value of a document (or each
+        whole document, if the query key holds a single count) falls into a
+        single interval, and the range doesn't split any of those values.
+        If `stop` is `now`, the value containing it may be split, since
+        nothing after now has been counted yet.
+
+        :param start: Start time (inclusive)
+        :param stop: Stop time (excluded)
+        :param now: Datetime used as the current time (optional)
+        :type start: datetime.datetime
+        :type stop: datetime.datetime
+        :type now: datetime.datetime
+
+        """
+        interval = self.interval
+        query_interval = self.query_interval
+        if interval <= query_interval:
+            return False
+
+        # Sparse documents can't be summed with array operators
+        if self.cls.config_sparse:
+            return False
+
+        # This is the smallest piece of a document we can slice off
+        unit = max(self.cls.config_period - 1, query_interval)
+        if interval < unit:
+            return False
+
+        if _period(unit, start) != start:
+            return False
+        return stop == now or _period(unit, stop) == stop
+
+    def _rollup_stages(self, depth, project, start):
+        """
+        Return aggregation pipeline stages which sum the counts projected by
+        `project` up to :attr:`interval`.
+
+        If the interval is the top level interval of the documents, each top
+        level value is summed in place. Otherwise every document is summed,
+        and the documents are grouped by event and interval. If `start`
+        isn't at the start of an interval, the first group is labelled with
+        `start` rather than the start of its interval.
+
+        :param depth: How many levels of lists the query key has
+        :param project: The ``$project`` stage for the documents
+        :param start: Start time of the query (inclusive)
+        :type depth: int
+        :type project: dict
+        :type start: datetime.datetime
+
+        """
+        cls = self.cls
+        interval = self.interval
+        query_key = self.query_key
+        event_key = cls.meta.event
+        period_key = cls.meta.period
+        values = project[query_key]
+        if values == 1:
+            values = "$" + query_key
+
+        # Sum the top level values, and keep them in order. Documents which
+        # weren't preallocated hold dicts, which are returned whole.
+        if interval < cls.config_period:
+            sections = {
+                "$map": {
+                    "input": "$$values",
+                    "as": "section",
+                    "in": _sum_expression("$$section", depth - 1),
+                }
+            }
+            project[query_key] = {
+                "$let": {
+                    "vars": {"values": values},
+                    "in": {"$cond": [{"$isArray": "$$values"}, sections, "$$values"]},
+                }
+            }
+            return []
+
+        # Sum the documents, and group them by the interval they're in
+        project[query_key] = {
+            "$let": {
+                "vars": {"values": values},
+                "in": _sum_expression("$$values", depth),
+            }
+        }
+        parts = {"year": {"$year": "$" + period_key}}
+        if interval <= MONTH:
+            parts["month"] = {"$month": "$" + period_key}
+        if interval <= DAY:
+            parts["day"] = {"$dayOfMonth": "$" + period_key}
+        if interval <= HOUR:
+            parts["hour"] = {"$hour": "$" + period_key}
+        label = {"$dateFromParts": parts}
+        # Groups labelled before the start of the range would be dropped when
+        # the counts are parsed
+        if _period(interval, start) != start:
+            label = {"$max": [label, start]}
+
+        return [
+            {
+                "$group": {
+                    "_id": {
+                        "event": "$" + event_key,
+                        "period": label,
+                    },
+                    "count": {"$sum": "$" + query_key},
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    event_key: "$_id.event",
+                    period_key: "$_id.period",
+                    query_key: "$count",
+                }
+            },
+            {"$sort": {period_key: 1}},
+        ]
+
+    def _section_index(self, stamp):
+        """
+        Return the index of the top level value which contains `stamp` in a
+        report document.
+
+        :param stamp: A timestamp
+        :type stamp: datetime.datetime
+
+        """
+        key_interval = self.cls.config_period - 1
+        if key_interval == MONTH:
+            return stamp.month - 1
+        if key_interval == DAY:
+            return stamp.day - 1
+        if key_interval == HOUR:
+            return stamp.hour
+        return stamp.minute
+
+    def _range_query(self, start, stop):
+        """
+        Return the query dict for getting docs between `start` and `stop`,
+        inclusive.
+
+        :param start: Start time (inclusive)
+        :param stop: Stop time (excluded)
+        :type start: datetime.datetime
+        :type stop: datetime.datetime
+
+        """
+        # We need to get the periods that cover the start and end of the range,
+        # so we can query against the document periods
+        period = self.cls.config_period
+        period_key = self.cls.meta.period
+        starting_period = _period(period, start)
+        # The stop is excluded, so a document starting at it isn't needed
+        ending_period = _period(period, stop - _EPSILON)
+
+        # The base query looks for any report documents matching the period
+        query = {
+            period_key: {
+                "$gte": starting_period,
+                "$lte": ending_period,
+            },
+        }
+
+        # If the event is a regex, we make it a regex query against _id
+        event = self.event
+        if event and self.regex:
+            if not self.anywhere and not event.startswith("^"):
+                event = "^" + event
+            query["_id"] = {"$regex": event}
+            # The rolled up ancestors would be counted twice if the results
+            # were summed, so they're left out unless they're asked for
+            separator = self.cls.config_rollup_separator
+            if separator and not self.rollups:
+                ancestor = re.compile(re.escape(separator + "*") + "$")
+                query[self.cls.meta.event] = {"$not": ancestor}
+
+        # Otherwise we just query against the indexed event field
+        elif event and not self.regex:
+            query[self.cls.meta.event] = event
+
+        return query
+
+    def _parse_results(self, results, start, stop, query_key, query_interval):
+        """
+        Return a dictionary mapping event names to dicts of event counts.
+
+        The event counts are returned as :class:`ReportCount` which holds the
+        timestamp for the counts as well as the count itself.
+
+        :param results: Report documents from :meth:`_find_range`
+        :param start: Starting timestamp (inclusive)
+        :param end: Ending timestamp (excluded)
+        :param query_key: Document key which we queried against
+        :param query_interval: The interval for `query_key`
+        :type results: list
+        :type start: datetime.datetime
+        :type send: datetime.datetime
+        :type query_key: str
+        :type query_interval: int
+
+        """
+        # This is the period for this query
+        period = self.interval
+
+        parsed = {}  # Stores the stamp-count dicts per event
+        key_interval = self.cls.config_period - 1  # Top level interval
+
+        # Create a preallocated dict for the range (start, stop]. This ensures
+        # we always return the correct number of counts, even if we're going
+        # backwards or forwards to when we don't have any docs
+        periods = []  # All the periods in this query
+        current = _period(period, start)
+        end = _relative_period(period, current, 1)
+        while current < stop:
+            periods.append(current)
+            current = _relative_period(period, current, 1)
+        empty_counts = {p: ReportCount(0, p) for p in periods}
+
+        # The first document's values are sliced to begin at the start
+        first_period = _period(self.cls.config_period, start)
+        first_index = self._section_index(start)
+
+        # Iterate over the docs, which we got back in sorted order
+        for doc in results:
+            if period > query_interval:
+                # Set up the current and ending timeframe, based on the query
+                # starting period, which is only relavant if we have to sum the
+                # parsed counts
+                current = _period(period, start)
+                end = _relative_period(period, current, 1)
+            # Get the values for the key we used
+            values = doc[query_key]
+            # Get the doc's event and period
+            event = doc.meta.event
+            doc_period = doc.meta.period
+            # Ensure we have the empty counts for this event
+            if event not in parsed:
+                parsed[event] = empty_counts.copy()
+
+            # Iterate over the parsed counts and timestamps, which will come
+            # according to the doc's interval
+            index = first_index if doc_period == first_period else 0
+            for stamp, count in _parse_section(values, key_interval, doc_period, index):
+                # Ensure we only take values from within the query frame
+                if stamp < start:
+                    # If we're before the start, we skip
+                    continue
+                if stamp >= stop:
+                    # If we're after the stop we break because the parsed
+                    # counts will be ordered
+                    break
+
+                # If we have a greater period than what we queried for, we have
+                # to sum those values
+                if period > query_interval:
+                    # If the current stamp is past the end of this period
+                    # create new current and end timestamps
+                    if stamp >= end:
+                        current = _relative_period(period, stamp, 0)
+                        end = _relative_period(period, current, 1)
+
+                    # Otherwise we just sum it up
+                    parsed[event][current] += count
+
+                # It's impossible to have a smaller period than what's
+                # available in the doc, so this means we matched what we
+                # queried for, and we just add it
+                else:
+                    parsed[event][stamp] += count
+
+        # Convert the count dictionaries to lists
+        for event in parsed:
+            counts = parsed[event]
+            parsed[event] = [counts[p] for p in periods]
+
+        return parsed
+
+    def _parse_columns(self, results, start, stop, query_key, query_interval):
+        """
+        Return a :class:`ReportColumns` with the counts for each event.
+
+        This takes the same arguments as :meth:`_parse_results`, but sums the
+        counts in place into a count vector per event, instead of creating a
+        :class:`ReportCount` for every count.
+
+        """
+        # This is the period for this query
+        period = self.interval
+        key_interval = self.cls.config_period - 1  # Top level interval
+
+        # Get all the periods in this query, and their position in the vectors
+        periods = []
+        current = _period(period, start)
+        while current < stop:
+            periods.append(current)
+            current = _relative_period(period, current, 1)
+        positions = {p: i for i, p in enumerate(periods)}
+
+        columns = ReportColumns(periods)
+        counts = columns.counts
+        summing = period > query_interval
+
+        # The first document's values are sliced to begin at the start
+        first_period = _period(self.cls.config_period, start)
+        first_index = self._section_index(start)
+
+        # Iterate over the docs, which we got back in sorted order
+        for doc in results:
+            # Ensure we have a count vector for this event
+            event = doc.meta.event
+            vector = counts.get(event)
+            if vector is None:
+                vector = counts[event] = columns._new_vector()
+
+            doc_period = doc.meta.period
+            index = first_index if doc_period == first_period else 0
+
+            end = None
+            for stamp, count in _parse_section(
+                doc[query_key], key_interval, doc_period, index
+            ):
+                # Ensure we only take values from within the query frame
+                if stamp < start:
+                    continue
+                if stamp >= stop:
+                    break
+
+                # If the stamp is past the end of the current period, find the
+                # position of the period it's in
+                if not summing:
+                    position = positions[stamp]
+                elif end is None or stamp >= end:
+                    current = _relative_period(period, stamp, 0)
+                    end = _relative_period(period, current, 1)
+                    position = positions[current]
+
+                vector[position] += count
+
+        return columns
+
+    def _coerce_results(self, results):
+        """
+        Return results coerced appropriately. If this query has an event
+        specified and not a regex, it will just return the list.
+
+        """
+        # XXX: This may be prohibitively slow
+        # Coerce the results from a defaultdict to a dict
+        results = dict(results)
+
+        # If it's not a regex and the event is specified, we should expect
+        # only a single event, and thus return just the list of counts
+        if self.event and not self.regex:
+            if len(results) < 1:
+                return []
+            assert len(results) == 1, "%r != 1" % len(results)
+            event, results = results.popitem()
+            return results
+
+        return results
 
-        # Get the query dictionary
-        query = self._range_query(start, stop)
+    def _coerce_index(self, index, now, stop=False):
+        """
+        Return `index` as a datetime UTC object or raise an :exc:`IndexError`.
 
-        query_interval = self.query_interval
-        query_key = self.query_key
+        :param index: Object to be coerced
+        :param now: Datetime to be used as current time
+        :param stop: Whether or not this is an ending index
+        :type now: datetime.datetime
+        :type stop: bool
 
-        # Get our results
-        results = self.cls.find(
-            query,
-            {query_key: 1, self.cls.meta.event: 1, self.cls.meta.period: 1},
-            sort=[(self.cls.meta.period, 1)],
-        )
+        """
+        # If it's already a datetime, make sure it's UTC
+        if isinstance(index, datetime.datetime):
+            return pytool.time.as_utc(index)
 
-        # Now we have to parse the results for the maximum ease of consumption
-        results = self._parse_results(results, start, stop, query_key, query_interval)
+        # If it's a date, make a datetime out of it
+        if isinstance(index, datetime.date):
+            return datetime.datetime(*index.timetuple()[:6], tzinfo=pytool.time.UTC())
 
-        # We need to coerce the results according to whether or not we have
-        # a distinct event, or we're using a regex query
-        results = self._coerce_results(results)
+        # If it's an integer, we have to handle it depending on the interval
+        if isinstance(index, int):
+            now = now or pytool.time.utcnow()
+            return self._coerce_int(index, now, stop)
 
-        return results
+        # XXX: Handle strings? Probably not.
+        raise TypeError("Report indices must be datetime.datetime or integers")
 
-    def _range_query(self, start, stop):
+    def _coerce_int(self, index, now, stop=False):
         """
-        Return the query dict for getting docs between `start` and `stop`,
-        inclusive.
+        Return `index` converted to a datetime depending on :attr:`interval`.
 
-        :param start: Start time (inclusive)
-        :param stop: Stop time (excluded)
-        :type start: datetime.datetime
-        :type stop: datetime.datetime
+        :param index: An index value to coerce
+        :param now: Datetime to use as current time
+        :param stop: Whether or not this is an ending index
+        :type index: int
+        :type now: datetime.datetime
+        :type stop: bool
 
         """
-        # We need to get the periods that cover the start and end of the range,
-        # so we can query against the document periods
-        period = self.cls.config_period
-        period_key = self.cls.meta.period
-        starting_period = _period(period, start)
-        ending_period = _period(period, stop)
+        interval = self.interval
+        # TODO: Make this handle positive integers which are out of range in a
+        # sensible way
 
-        # The base query looks for any report documents matching the period
-        query = {
-            period_key: {
-                "$gte": starting_period,
-                "$lte": ending_period,
-            },
+        # Indices < 0 represent time from the present on back
+        if index < 0:
+            # We add 1 here because -1 represents the current timeframe (it is
+            # the last in the list)
+            index += 1
+            return _relative_period(interval, now, index)
+
+        # Positive indices correspond to exact years, months in the year, days
+        # in the month, hours in the day, or minutes in the hour
+        if interval == YEAR:
+            self._check_range(index, 1970, 2037)
+            return datetime.datetime(index, 1, 1, tzinfo=now.tzinfo)
+
+        if interval == MONTH:
+            if stop and index == 13:
+                # If the ending index is greater than 12, we return the first
+                # of the next year
+                return _relative_period(YEAR, now, 1)
+
+            self._check_range(index, 1, 13)
+            return datetime.datetime(now.year, index, 1, tzinfo=now.tzinfo)
+
+        if interval == DAY:
+            _, end_of_month = calendar.monthrange(now.year, now.month)
+            if stop and index == end_of_month + 1:
+                # If the ending index is greater than the end of the month, we
+                # return the start of the next month
+                return _relative_period(MONTH, now, 1)
+
+            self._check_range(index, 1, end_of_month + 1)
+            return datetime.datetime(now.year, now.month, index, tzinfo=now.tzinfo)
+
+        if interval == HOUR:
+            if stop and index == 24:
+                # If the ending index is greater than the end of the day, we
+                # return the start of the next day
+                return _relative_period(DAY, now, 1)
+
+            self._check_range(index, 0, 24)
+            return datetime.datetime(
+                now.year, now.month, now.day, index, tzinfo=now.tzinfo
+            )
+
+        if interval == MINUTE:
+            if stop and index == 60:
+                # If the ending index is greater than the last minute, we
+                # return the start of the next hour
+                return _relative_period(HOUR, now, 1)
+            self._check_range(index, 0, 60)
+            return datetime.datetime(
+                now.year, now.month, now.day, now.hour, index, tzinfo=now.tzinfo
+            )
+
+    @staticmethod
+    def _check_range(value, minimum, maximum):
+        """
+        Raise an IndexError if `value` is out of the given range.
+
+        :param value: Value to check
+        :param minimum: Minimum value (inclusive)
+        :param maximum: Maximum value (inclusive)
+        :type value: int
+        :type minimum: int
+        :type maximum: int
+
+        """
+        if value < minimum or value > maximum:
+            raise IndexError(
+                "Value %r out of range [%r, %r]" % (value, minimum, maximum)
+            )
+
+
+class _DistinctReportMeta(DocumentMeta):
+    """Metaclass for :class:`DistinctReport`, which checks its config."""
+
+    def __new__(mcs, cls_name, bases, cls_dict):
+        cls = super().__new__(mcs, cls_name, bases, cls_dict)
+        # There have to be enough registers for the estimates to work, and
+        # enough hash bits left over for the ranks
+        precision = cls.config_precision
+        if (
+            not isinstance(precision, int)
+            or isinstance(precision, bool)
+            or not _MIN_PRECISION <= precision <= _MAX_PRECISION
+        ):
+            raise ValueError(
+                "'config_precision' must be an integer from %d to %d"
+                % (_MIN_PRECISION, _MAX_PRECISION)
+            )
+        return cls
+
+
+class DistinctReport(Report, metaclass=_DistinctReportMeta):
+    """
+    A report of the approximate number of distinct values recorded for each
+    event, such as unique visitors, using HyperLogLog.
+
+    Each interval holds up to ``2 ** config_precision`` registers, which are
+    updated in the database with ``$max``, so the size of a document doesn't
+    depend on how many distinct values are recorded. Documents are stored
+    sparsely (see :attr:`Report.config_sparse`), and queries return the
+    estimated number of distinct values in each interval, merging the
+    registers when the query interval is larger than the recorded intervals.
+
+    Example::
+
+        class Visitors(DistinctReport):
+            config_database = 'humble'
+            config_collection = 'visitors'
+
+        Visitors.record('home', visitor_id)
+        Visitors.daily('home')[-7:]  # Unique visitors for the last 7 days
+
+    """
+
+    config_precision = 8
+    """ The number of bits of each value's hash used to pick a register, from
+    4 to 16. The standard error of the estimates is about ``1.04 / sqrt(2 **
+    config_precision)``, which is 6.5% for the default. Each additional bit
+    doubles the maximum size of the documents. """
+
+    config_sparse = True
+
+    @classmethod
+    def record(cls, event, value, stamp=None, safe=False):
+        """
+        Record that `value` was seen for `event` at `stamp`.
+
+        :param event: Event identifier string
+        :param value: Value to count distinctly, such as a user id
+        :param stamp: Datetime stamp for this event (default: now)
+        :param safe: Safe write option passed to pymongo
+        :type event: str
+        :type value: str
+        :type stamp: datetime.datetime
+        :type safe: bool
+
+        """
+        stamp = cls._record_stamp(stamp, 1)
+        # Rolled up events are written together in a single bulk write
+        separator = cls.config_rollup_separator
+        if separator and separator in event:
+            cls.record_many([(event, value, stamp)])
+            return
+
+        update = {
+            "$max": cls._register_update(value, stamp),
+            "$setOnInsert": cls._meta_fields(event, stamp),
         }
+        _opts = {}
+        if _version._lt("3.0.0"):
+            _opts["safe"] = safe
+        cls.update({"_id": cls.record_id(event, stamp)}, update, upsert=True, **_opts)
 
-        # If the event is a regex, we make it a regex query against _id
-        event = self.event
-        if event and self.regex:
-            if not self.anywhere and not event.startswith("^"):
-                event = "^" + event
-            query["_id"] = {"$regex": event}
+    @classmethod
+    def record_many(cls, records):
+        """
+        Record many values at once, and return the
+        :class:`~humbledb.bulk.BulkResult`, or ``None`` if there was nothing
+        to record. The registers for each document are merged before they
+        are written with a single unordered bulk upsert.
 
-        # Otherwise we just query against the indexed event field
-        elif event and not self.regex:
-            query[self.cls.meta.event] = event
+        :param records: Iterable of ``(event, value, stamp)`` tuples, which \
+                take the same values as :meth:`record`
+        :type records: iterable
 
-        return query
+        """
+        maxes = {}  # Maps document ids to $max clauses
+        events = {}  # Maps document ids to (event, stamp) tuples
+        for event, value, stamp in records:
+            stamp = cls._record_stamp(stamp, 1)
+            update = cls._register_update(value, stamp)
+
+            for event in cls._rollup_events(event):
+                _id = cls.record_id(event, stamp)
+                registers = maxes.get(_id)
+                if registers is None:
+                    maxes[_id] = dict(update)
+                    events[_id] = (event, stamp)
+                    continue
+                for key, rank in update.items():
+                    if rank > registers.get(key, 0):
+                        registers[key] = rank
+
+        if not maxes:
+            return None
+
+        with cls.bulk(ordered=False, batch_size=len(maxes), manipulate=False) as bulk:
+            for _id, registers in maxes.items():
+                update = {
+                    "$max": registers,
+                    "$setOnInsert": cls._meta_fields(*events[_id]),
+                }
+                bulk.upsert({"_id": _id}, update)
 
-    def _parse_results(self, results, start, stop, query_key, query_interval):
+        return bulk.result
+
+    @classmethod
+    def buffered(cls, *args, **kwargs):
+        """Distinct reports can't be buffered, since they don't have counts."""
+        raise TypeError("%r can't be buffered" % cls.__name__)
+
+    @classmethod
+    def _register_update(cls, value, stamp):
         """
-        Return a dictionary mapping event names to dicts of event counts.
+        Return a ``$max`` clause which sets the register for `value` in
+        every interval containing `stamp`.
 
-        The event counts are returned as :class:`ReportCount` which holds the
-        timestamp for the counts as well as the count itself.
+        :param value: Value to count distinctly
+        :param stamp: A UTC datetime
+        :type stamp: datetime.datetime
 
-        :param results: Raw result list
-        :param start: Starting timestamp (inclusive)
-        :param end: Ending timestamp (excluded)
-        :param query_key: Document key which we queried against
-        :param query_interval: The interval for `query_key`
-        :type results: list
-        :type start: datetime.datetime
-        :type send: datetime.datetime
-        :type query_key: str
-        :type query_interval: int
+        """
+        index, rank = _hll_register(value, cls.config_precision)
+        index = "." + str(index)
+        keys = cls._update_query(stamp)["$inc"]
+        return {key + index: rank for key in keys}
+
+
+class _SlotReportQuery(ReportQuery, metaclass=abc.ABCMeta):
+    """
+    Base query for reports which store a dict of values for each interval,
+    rather than a count, like :class:`DistinctReport` and
+    :class:`HistogramReport`. Subclasses must define how the dicts are
+    merged.
+
+    """
+
+    def _merge_slots(self, results, start, stop, query_key, query_interval):
+        """
+        Return a dictionary mapping event names to dictionaries of the merged
+        values for each period of the query, and a list of the periods. This
+        takes the same arguments as :meth:`ReportQuery._parse_results`.
 
         """
         # This is the period for this query
         period = self.interval
 
-        parsed = {}  # Stores the stamp-count dicts per event
-        key_interval = self.cls.config_period - 1  # Top level interval
-
-        # Create a preallocated dict for the range (start, stop]. This ensures
-        # we always return the correct number of counts, even if we're going
-        # backwards or forwards to when we don't have any docs
-        periods = []  # All the periods in this query
+        periods = []
         current = _period(period, start)
-        end = _relative_period(period, current, 1)
         while current < stop:
             periods.append(current)
             current = _relative_period(period, current, 1)
-        empty_counts = {p: ReportCount(0, p) for p in periods}
 
-        # Iterate over the docs, which we got back in sorted order
-        for doc in results:
-            if period > query_interval:
-                # Set up the current and ending timeframe, based on the query
-                # starting period, which is only relavant if we have to sum the
-                # parsed counts
-                current = _period(period, start)
-                end = _relative_period(period, current, 1)
-            # Get the values for the key we used
-            values = doc[query_key]
-            # Get the doc's event and period
-            event = doc.meta.event
-            doc_period = doc.meta.period
-            # Ensure we have the empty counts for this event
-            if event not in parsed:
-                parsed[event] = empty_counts.copy()
+        key_interval = self.cls.config_period - 1  # Top level interval
+        depth = self.cls.config_period - query_interval  # Levels above values
 
-            # Iterate over the parsed counts and timestamps, which will come
-            # according to the doc's interval
-            for stamp, count in _parse_section(values, key_interval, doc_period):
+        merged = {}
+        for doc in results:
+            event_slots = merged.setdefault(doc.meta.event, {})
+            for stamp, values in _parse_slots(
+                doc[query_key], key_interval, doc.meta.period, depth
+            ):
                 # Ensure we only take values from within the query frame
                 if stamp < start:
-                    # If we're before the start, we skip
                     continue
                 if stamp >= stop:
-                    # If we're after the stop we break because the parsed
-                    # counts will be ordered
                     break
 
-                # If we have a greater period than what we queried for, we have
-                # to sum those values
-                if period > query_interval:
-                    # If the current stamp is past the end of this period
-                    # create new current and end timestamps
-                    if stamp >= end:
-                        current = _relative_period(period, stamp, 0)
-                        end = _relative_period(period, current, 1)
+                slot = event_slots.setdefault(_period(period, stamp), {})
+                self._merge(slot, values)
+
+        return merged, periods
+
+    @abc.abstractmethod
+    def _merge(self, slot, values):
+        """
+        Merge the dict `values` into `slot`, in place.
+
+        :param slot: Merged values for a period of the query
+        :param values: Values for an interval of a document
+        :type slot: dict
+        :type values: dict
+
+        """
 
-                    # Otherwise we just sum it up
-                    parsed[event][current] += count
 
-                # It's impossible to have a smaller period than what's
-                # available in the doc, so this means we matched what we
-                # queried for, and we just add it
-                else:
-                    parsed[event][stamp] += count
+class DistinctReportQuery(_SlotReportQuery):
+    """
+    Query used for :class:`DistinctReport` classes. Instead of counts, this
+    returns the estimated number of distinct values in each interval.
 
-        # Convert the count dictionaries to lists
-        for event in parsed:
-            counts = parsed[event]
-            parsed[event] = [counts[p] for p in periods]
+    """
 
-        return parsed
+    def _parse_results(self, results, start, stop, query_key, query_interval):
+        """
+        Return a dictionary mapping event names to lists of
+        :class:`ReportCount` estimates. This takes the same arguments as
+        :meth:`ReportQuery._parse_results`.
 
-    def _coerce_results(self, results):
         """
-        Return results coerced appropriately. If this query has an event
-        specified and not a regex, it will just return the list.
+        merged, periods = self._merge_slots(
+            results, start, stop, query_key, query_interval
+        )
+        precision = self.cls.config_precision
+        return {
+            event: [
+                ReportCount(_hll_estimate(registers.get(p, {}), precision), p)
+                for p in periods
+            ]
+            for event, registers in merged.items()
+        }
 
+    def _parse_columns(self, results, start, stop, query_key, query_interval):
         """
-        # XXX: This may be prohibitively slow
-        # Coerce the results from a defaultdict to a dict
-        results = dict(results)
+        Return a :class:`ReportColumns` with the estimates for each event.
+        This takes the same arguments as :meth:`ReportQuery._parse_results`.
 
-        # If it's not a regex and the event is specified, we should expect
-        # only a single event, and thus return just the list of counts
-        if self.event and not self.regex:
-            if len(results) < 1:
-                return []
-            assert len(results) == 1, "%r != 1" % len(results)
-            event, results = results.popitem()
-            return results
+        """
+        merged, periods = self._merge_slots(
+            results, start, stop, query_key, query_interval
+        )
+        precision = self.cls.config_precision
+        columns = ReportColumns(periods)
+        for event, registers in merged.items():
+            vector = columns.counts[event] = columns._new_vector()
+            for i, p in enumerate(periods):
+                vector[i] = _hll_estimate(registers.get(p, {}), precision)
+        return columns
 
-        return results
+    def _merge(self, slot, values):
+        """Registers are merged by taking the highest rank."""
+        for index, rank in values.items():
+            if rank > slot.get(index, 0):
+                slot[index] = rank
 
-    def _coerce_index(self, index, now, stop=False):
+
+DistinctReport._query_class = DistinctReportQuery
+
+
+class HistogramReport(Report):
+    """
+    A report of the distribution of values recorded for each event, such as
+    request latencies, using a fixed set of bucket counters for each
+    interval.
+
+    Queries return a :class:`ReportHistogram` for each interval, which can be
+    added together to get the distribution for a whole range, and gives
+    approximate percentiles.
+
+    Example::
+
+        class Latency(HistogramReport):
+            config_database = 'humble'
+            config_collection = 'latency'
+            config_buckets = [10, 25, 50, 100, 250, 500, 1000]
+
+        Latency.record_value('home', 42)
+
+        # The 95th percentile over the last 24 hours
+        sum(Latency.hourly('home')[-24:]).p95
+
+    """
+
+    config_buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+    """ The sorted upper bounds of the buckets. Each value is counted in the
+    first bucket whose bound is greater than or equal to it, and values above
+    the last bound are counted in an extra overflow bucket. """
+
+    config_sparse = True
+
+    @classmethod
+    def record(cls, *args, **kwargs):
+        """Histograms need a value, so use :meth:`record_value` instead."""
+        raise TypeError("%r records values with record_value()" % cls.__name__)
+
+    @classmethod
+    def record_many(cls, *args, **kwargs):
+        """Histograms need a value, so use :meth:`record_value` instead."""
+        raise TypeError("%r records values with record_value()" % cls.__name__)
+
+    @classmethod
+    def record_value(cls, event, value, stamp=None, safe=False):
         """
-        Return `index` as a datetime UTC object or raise an :exc:`IndexError`.
+        Record `value` for `event` at `stamp`.
 
-        :param index: Object to be coerced
-        :param now: Datetime to be used as current time
-        :param stop: Whether or not this is an ending index
-        :type now: datetime.datetime
-        :type stop: bool
+        :param event: Event identifier string
+        :param value: Value to count in its bucket
+        :param stamp: Datetime stamp for this event (default: now)
+        :param safe: Safe write option passed to pymongo
+        :type event: str
+        :type value: float
+        :type stamp: datetime.datetime
+        :type safe: bool
 
         """
-        # If it's already a datetime, make sure it's UTC
-        if isinstance(index, datetime.datetime):
-            return pytool.time.as_utc(index)
+        if cls.config_aggregator:
+            raise TypeError(
+                "%r can't be sent to an aggregator, since it only forwards counts"
+                % cls.__name__
+            )
+        stamp = cls._record_stamp(stamp, 1)
+        bucket = "." + str(bisect.bisect_left(cls.config_buckets, value))
+        keys = cls._update_query(stamp)["$inc"]
+        inc = {key + bucket: 1 for key in keys}
+        # Histograms are merged by event when they're queried, so the counter
+        # shards and rolled up events work just like they do for counts
+        updates = []
+        for _event in cls._rollup_events(event):
+            _id = cls._shard_id(cls.record_id(_event, stamp))
+            meta = cls._meta_fields(_event, stamp)
+            updates.append(({"_id": _id}, {"$inc": inc, "$setOnInsert": meta}))
+
+        if len(updates) == 1:
+            _opts = {}
+            if _version._lt("3.0.0"):
+                _opts["safe"] = safe
+            cls.update(updates[0][0], updates[0][1], upsert=True, **_opts)
+            return
 
-        # If it's a date, make a datetime out of it
-        if isinstance(index, datetime.date):
-            return datetime.datetime(*index.timetuple()[:6], tzinfo=pytool.time.UTC())
+        with cls.bulk(ordered=False, batch_size=len(updates), manipulate=False) as bulk:
+            for query, update in updates:
+                bulk.upsert(query, update)
 
-        # If it's an integer, we have to handle it depending on the interval
-        if isinstance(index, int):
-            now = now or pytool.time.utcnow()
-            return self._coerce_int(index, now, stop)
+    @classmethod
+    def buffered(cls, *args, **kwargs):
+        """Histogram reports can't be buffered, since they don't have counts."""
+        raise TypeError("%r can't be buffered" % cls.__name__)
 
-        # XXX: Handle strings? Probably not.
-        raise TypeError("Report indices must be datetime.datetime or integers")
 
-    def _coerce_int(self, index, now, stop=False):
-        """
-        Return `index` converted to a datetime depending on :attr:`interval`.
+class HistogramReportQuery(_SlotReportQuery):
+    """
+    Query used for :class:`HistogramReport` classes. Instead of counts, this
+    returns a :class:`ReportHistogram` for each interval.
 
-        :param index: An index value to coerce
-        :param now: Datetime to use as current time
-        :param stop: Whether or not this is an ending index
-        :type index: int
-        :type now: datetime.datetime
-        :type stop: bool
+    """
 
+    def _parse_results(self, results, start, stop, query_key, query_interval):
         """
-        interval = self.interval
-        # TODO: Make this handle positive integers which are out of range in a
-        # sensible way
+        Return a dictionary mapping event names to lists of
+        :class:`ReportHistogram`. This takes the same arguments as
+        :meth:`ReportQuery._parse_results`.
 
-        # Indices < 0 represent time from the present on back
-        if index < 0:
-            # We add 1 here because -1 represents the current timeframe (it is
-            # the last in the list)
-            index += 1
-            return _relative_period(interval, now, index)
+        """
+        merged, periods = self._merge_slots(
+            results, start, stop, query_key, query_interval
+        )
+        bounds = self.cls.config_buckets
+        keys = [str(i) for i in range(len(bounds) + 1)]
+        return {
+            event: [
+                ReportHistogram(bounds, [slots.get(p, {}).get(k, 0) for k in keys], p)
+                for p in periods
+            ]
+            for event, slots in merged.items()
+        }
 
-        # Positive indices correspond to exact years, months in the year, days
-        # in the month, hours in the day, or minutes in the hour
-        if interval == YEAR:
-            self._check_range(index, 1970, 2037)
-            return datetime.datetime(index, 1, 1, tzinfo=now.tzinfo)
+    def _parse_columns(self, results, start, stop, query_key, query_interval):
+        """Histograms don't have a single count for each interval."""
+        raise TypeError("Histogram queries can't be returned as columns")
 
-        if interval == MONTH:
-            if stop and index == 13:
-                # If the ending index is greater than 12, we return the first
-                # of the next year
-                return _relative_period(YEAR, now, 1)
+    def _merge(self, slot, values):
+        """Bucket counts are summed."""
+        for bucket, count in values.items():
+            slot[bucket] = slot.get(bucket, 0) + count
 
-            self._check_range(index, 1, 13)
-            return datetime.datetime(now.year, index, 1, tzinfo=now.tzinfo)
 
-        if interval == DAY:
-            _, end_of_month = calendar.monthrange(now.year, now.month)
-            if stop and index == end_of_month + 1:
-                # If the ending index is greater than the end of the month, we
-                # return the start of the next month
-                return _relative_period(MONTH, now, 1)
+HistogramReport._query_class = HistogramReportQuery
 
-            self._check_range(index, 1, end_of_month + 1)
-            return datetime.datetime(now.year, now.month, index, tzinfo=now.tzinfo)
 
-        if interval == HOUR:
-            if stop and index == 24:
-                # If the ending index is greater than the end of the day, we
-                # return the start of the next day
-                return _relative_period(DAY, now, 1)
+class ReportHistogram(object):
+    """
+    The bucket counts of a :class:`HistogramReport` for an interval starting
+    at `timestamp`. Histograms can be added together, so ``sum()`` gives the
+    histogram for a range of intervals.
+
+    :param bounds: Upper bounds of the buckets
+    :param counts: Counts for each bucket, and the overflow bucket
+    :param timestamp: Datetime for this histogram
+    :type bounds: list
+    :type counts: list
+    :type timestamp: datetime.datetime
 
-            self._check_range(index, 0, 24)
-            return datetime.datetime(
-                now.year, now.month, now.day, index, tzinfo=now.tzinfo
-            )
+    """
 
-        if interval == MINUTE:
-            if stop and index == 60:
-                # If the ending index is greater than the last minute, we
-                # return the start of the next hour
-                return _relative_period(HOUR, now, 1)
-            self._check_range(index, 0, 60)
-            return datetime.datetime(
-                now.year, now.month, now.day, now.hour, index, tzinfo=now.tzinfo
-            )
+    __slots__ = ("bounds", "counts", "timestamp")
+
+    def __init__(self, bounds, counts, timestamp):
+        self.bounds = bounds
+        self.counts = counts
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (type(self).__name__, self.counts, self.timestamp)
+
+    def __eq__(self, other):
+        if not isinstance(other, ReportHistogram):
+            return NotImplemented
+        return self.bounds == other.bounds and self.counts == other.counts
+
+    def __add__(self, other):
+        # This allows sum() to work, which starts with 0
+        if isinstance(other, int) and other == 0:
+            return self
+        if not isinstance(other, ReportHistogram) or other.bounds != self.bounds:
+            return NotImplemented
+        counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return ReportHistogram(
+            self.bounds, counts, min(self.timestamp, other.timestamp)
+        )
 
-    @staticmethod
-    def _check_range(value, minimum, maximum):
+    __radd__ = __add__
+
+    @property
+    def total(self):
+        """Total number of values counted."""
+        return sum(self.counts)
+
+    def percentile(self, percent):
         """
-        Raise an IndexError if `value` is out of the given range.
+        Return the approximate value at `percent`, interpolated within its
+        bucket, or ``None`` if there are no values. Values in the overflow
+        bucket are reported as the last bound.
 
-        :param value: Value to check
-        :param minimum: Minimum value (inclusive)
-        :param maximum: Maximum value (inclusive)
-        :type value: int
-        :type minimum: int
-        :type maximum: int
+        :param percent: Percentile, from 0 to 100
+        :type percent: float
 
         """
-        if value < minimum or value > maximum:
-            raise IndexError(
-                "Value %r out of range [%r, %r]" % (value, minimum, maximum)
-            )
+        total = self.total
+        if not total:
+            return None
+
+        bounds = self.bounds
+        rank = total * percent / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(bounds):
+                    break
+                lower = bounds[i - 1] if i else min(0, bounds[0])
+                return lower + (bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return bounds[-1]
+
+    @property
+    def p50(self):
+        """Approximate median."""
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        """Approximate 95th percentile."""
+        return self.percentile(95)
+
+    @property
+    def p99(self):
+        """Approximate 99th percentile."""
+        return self.percentile(99)
 
 
 class ReportCount(int):
@@ -854,6 +2763,97 @@ class ReportCount(int):
         return self.timestamp.minute
 
 
+class ReportColumns(object):
+    """
+    Columnar results for a :class:`ReportQuery`, as returned when using
+    :meth:`ReportQuery.as_columns`.
+
+    The :attr:`timestamps` list is shared by every event, and :attr:`counts`
+    maps each event to a vector of counts for those timestamps. The vectors
+    are :class:`numpy.ndarray` if NumPy is installed, and
+    :class:`array.array` otherwise.
+
+    This can be used like a dictionary of events to count vectors.
+
+    :param timestamps: Starting datetime of each counted period
+    :type timestamps: list
+
+    """
+
+    __slots__ = ("timestamps", "counts")
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+        self.counts = {}
+
+    def __getitem__(self, event):
+        return self.counts[event]
+
+    def __contains__(self, event):
+        return event in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def items(self):
+        """Return the ``(event, counts)`` pairs."""
+        return self.counts.items()
+
+    def _new_vector(self):
+        """Return a new vector of zero counts."""
+        if numpy is not None:
+            return numpy.zeros(len(self.timestamps), dtype=numpy.int64)
+        return array.array("q", bytes(8 * len(self.timestamps)))
+
+
+def _sum_expression(values, depth):
+    """
+    Return an aggregation expression which sums all the counts in `values`,
+    which has `depth` levels of nested lists, or of sparse dicts for
+    documents which weren't preallocated.
+
+    :param values: Aggregation expression for the values
+    :param depth: Levels of nested lists
+    :type depth: int
+
+    """
+    if not depth:
+        return values
+    if depth == 1:
+        return {"$sum": _array_expression(values)}
+    name = "values{}".format(depth)
+    return {
+        "$sum": {
+            "$map": {
+                "input": _array_expression(values),
+                "as": name,
+                "in": _sum_expression("$$" + name, depth - 1),
+            }
+        }
+    }
+
+
+def _array_expression(values):
+    """
+    Return an aggregation expression for `values` as a list. Sparse dicts
+    are converted to a list of their values, since only their sum is needed.
+
+    :param values: Aggregation expression for a list or dict of values
+
+    """
+    dict_values = {
+        "$map": {
+            "input": {"$objectToArray": values},
+            "as": "item",
+            "in": "$$item.v",
+        }
+    }
+    return {"$cond": [{"$isArray": values}, values, dict_values]}
+
+
 def _relative_period(period, stamp, diff):
     """
     Return `stamp` offset by `diff` periods.
@@ -935,40 +2935,196 @@ def _period(period, stamp):
         )
 
 
-def _parse_section(values, interval, stamp):
+def _report_name(cls):
     """
-    A generator which yields 2-tuples of the timestamp and value for
-    each value in a section. This will recursively crawl the `values`
-    structure, which should be nested lists, to find integer values to
-    yield.
+    Return the name used to identify the report class `cls` to a
+    :class:`~humbledb.aggregator.ReportAggregator`.
+
+    :param cls: Report subclass
+    :type cls: type
 
     """
-    # If it's a number, we yield it
-    if isinstance(values, int):
+    return "%s:%s" % (cls.__module__, cls.__qualname__)
+
+
+def _send_to_aggregator(cls, event, stamp, count):
+    """
+    Send a count for `event` to the aggregator for `cls` as a single
+    datagram, without waiting. Counts which can't be sent are dropped.
+
+    :param cls: Report subclass
+    :param event: Event identifier string
+    :param stamp: A UTC datetime
+    :param count: Number to increment
+    :type cls: type
+    :type event: str
+    :type stamp: datetime.datetime
+    :type count: int
+
+    """
+    address = cls.config_aggregator
+    if not isinstance(address, str):
+        address = tuple(address)
+
+    pid = os.getpid()
+    sock = _AGGREGATOR_SOCKETS.get(address)
+    if sock is None or sock[0] != pid:
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        sock = (pid, socket.socket(family, socket.SOCK_DGRAM))
+        sock[1].setblocking(False)
+        _AGGREGATOR_SOCKETS[address] = sock
+
+    record = [_report_name(cls), event, calendar.timegm(stamp.utctimetuple()), count]
+    try:
+        sock[1].sendto(json.dumps(record).encode("utf-8"), address)
+    except OSError as exc:
+        logging.getLogger(__name__).debug("Dropped count for %r: %s", cls.__name__, exc)
+
+
+def _parse_sparse_section(values, interval, stamp):
+    """
+    A generator which yields 2-tuples of the timestamp and value for each
+    non-zero value in a sparse section, in order. The `values` structure
+    should be nested dicts, where the outermost dict maps offsets for
+    `interval` (as strings) to values, and `stamp` is the start of the
+    section.
+
+    """
+    for i, value in sorted((int(k), v) for k, v in values.items()):
+        if interval == MONTH:
+            start = stamp.replace(month=i + 1)
+        else:
+            start = stamp + _INTERVAL_OFFSETS[interval][i]
+
+        if isinstance(value, dict):
+            for vals in _parse_sparse_section(value, interval - 1, start):
+                yield vals
+        elif value:
+            yield start, value
+
+
+def _parse_slots(values, interval, stamp, depth):
+    """
+    A generator which yields 2-tuples of the timestamp and dict of values for
+    each interval in a section of a :class:`DistinctReport` or
+    :class:`HistogramReport`, in order. The `values` structure should be
+    `depth` levels of dicts keyed by offsets for `interval`, holding the dicts
+    of values.
+
+    """
+    if not depth:
         yield stamp, values
+        return
+
+    for i, value in sorted((int(k), v) for k, v in values.items()):
+        if interval == MONTH:
+            start = stamp.replace(month=i + 1)
+        else:
+            start = stamp + _INTERVAL_OFFSETS[interval][i]
+        for vals in _parse_slots(value, interval - 1, start, depth - 1):
+            yield vals
+
+
+def _hll_register(value, precision):
+    """
+    Return the HyperLogLog register index and rank for `value`.
+
+    :param value: Value to hash
+    :param precision: Number of bits used for the register index
+    :type precision: int
+
+    """
+    if not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+    bits = 64 - precision
+    index = hashed >> bits
+    # The rank is the position of the first set bit in the remaining bits
+    rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+    return index, rank
+
+
+def _hll_estimate(registers, precision):
+    """
+    Return the estimated number of distinct values for the HyperLogLog
+    `registers`, which maps register indexes to ranks.
+
+    :param registers: Dict of register ranks
+    :param precision: Number of bits used for the register index
+    :type registers: dict
+    :type precision: int
+
+    """
+    size = 1 << precision
+    if size >= 128:
+        alpha = 0.7213 / (1 + 1.079 / size)
     else:
-        # If it's a list, we iterate over it
-        for i in range(len(values)):
-            if interval == MINUTE:
-                stamp = stamp.replace(minute=i)
-            elif interval == HOUR:
-                stamp = stamp.replace(hour=i)
-            elif interval == DAY:
-                try:
-                    stamp = stamp.replace(day=i + 1)
-                except ValueError:
-                    # Due to lazy preallocation, we may actually end up with
-                    # illegal lengths of values (for instance 31 days in
-                    # September) so we just ignore this and move on
-                    continue
-            elif interval == MONTH:
-                stamp = stamp.replace(month=i + 1)
-            # Get the value we're working with
-            value = values[i]
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.673)
+
+    zeros = size - len(registers)
+    total = zeros + sum(2.0**-rank for rank in registers.values())
+    estimate = alpha * size * size / total
+
+    # Small cardinalities are better estimated by the empty registers
+    if estimate <= 2.5 * size and zeros:
+        estimate = size * math.log(size / zeros)
+
+    return int(round(estimate))
+
+
+def _parse_section(values, interval, stamp, index=0):
+    """
+    A generator which yields 2-tuples of the timestamp and value for each
+    non-zero value in a section, in order. The `values` structure should be
+    nested lists, where the outermost list holds values for `interval` and
+    `stamp` is the start of the section. If the outermost list was sliced,
+    `index` is the position of its first value in the section.
+
+    Zero values are skipped, since report counts start at zero, and
+    timestamps are only built for the values which are yielded.
+
+    """
+    # If it's a number, we yield it
+    if isinstance(values, int):
+        if values:
+            yield stamp, values
+        return
+
+    # Sparse documents are never sliced, so their offsets are used as is
+    if isinstance(values, dict):
+        for vals in _parse_sparse_section(values, interval, stamp):
+            yield vals
+        return
+
+    # Months vary in length, so each month is parsed as its own section
+    if interval == MONTH:
+        for i, value in enumerate(values, index):
+            month = stamp.replace(month=i + 1)
+            for vals in _parse_section(value, DAY, month):
+                yield vals
+        return
+
+    if interval == DAY:
+        # Due to lazy preallocation, we may actually end up with illegal
+        # lengths of values (for instance 31 days in September) so we just
+        # ignore the extra days
+        values = values[: calendar.monthrange(stamp.year, stamp.month)[1] - index]
+
+    # Every other interval has a fixed length, so we walk the nested lists
+    # with a stack, keeping the starting timestamp of each list
+    stack = [(enumerate(values, index), interval, stamp)]
+    while stack:
+        items, interval, stamp = stack[-1]
+        offsets = _INTERVAL_OFFSETS[interval]
+        for i, value in items:
             # If it's a number, yield it
             if isinstance(value, int):
-                yield stamp, value
+                if value:
+                    yield stamp + offsets[i], value
                 continue
-            # If it's a list, recursively process it
-            for vals in _parse_section(value, interval - 1, stamp):
-                yield vals
+            # If it's a list, descend into it, and come back to the rest of
+            # this list afterwards
+            stack.append((enumerate(value), interval - 1, stamp + offsets[i]))
+            break
+        else:
+            stack.pop()
@@ -0,0 +1,76 @@
+import json
+from unittest import mock
+
+import pytool
+
+from humbledb import aggregator, report
+from humbledb.aggregator import ReportAggregator
+from humbledb.report import HOUR, MONTH, Report
+
+from ..util import database_name
+
+
+class Aggregated(Report):
+    config_database = database_name()
+    config_collection = "report.aggregated"
+    config_period = MONTH
+    config_intervals = [MONTH, HOUR]
+
+
+def test_aggregator_merges_counts(DBTest, tmp_path):
+    address = str(tmp_path / "aggregator.sock")
+    event = "event_aggregator_merges_counts"
+    stamp = pytool.time.utcnow()
+
+    with ReportAggregator(DBTest, [Aggregated], address, interval=60) as agg:
+        agg.start()
+        with mock.patch.object(Aggregated, "config_aggregator", address):
+            # Recording doesn't need a connection when it's aggregated
+            Aggregated.record(event, stamp)
+            Aggregated.record(event, stamp, count=2)
+
+    assert agg.received == 2
+    assert agg.dropped == 0
+    with DBTest:
+        doc = Aggregated.find_one({Aggregated.meta.event: event})
+    assert doc.month == 3
+    assert doc.hour[stamp.day - 1][stamp.hour] == 3
+
+
+def test_aggregator_drops_bad_datagrams(tmp_path):
+    address = str(tmp_path / "aggregator.sock")
+    with ReportAggregator(None, [Aggregated], address) as agg:
+        agg.handle(b"not json")
+        agg.handle(json.dumps(["unknown:Report", "event", 0, 1]).encode())
+        name = report._report_name(Aggregated)
+        agg.handle(json.dumps([name, "event", 0, "1"]).encode())
+
+    assert agg.dropped == 3
+    assert agg.received == 0
+
+
+def test_aggregator_drops_counts_which_fail(tmp_path):
+    address = str(tmp_path / "aggregator.sock")
+    name = report._report_name(Aggregated)
+    with ReportAggregator(None, [Aggregated], address) as agg:
+        with mock.patch.object(report.ReportBuffer, "record") as record:
+            record.side_effect = RuntimeError
+            agg.handle(json.dumps([name, "event", 0, 1]).encode())
+        with mock.patch.object(aggregator.json, "loads") as loads:
+            loads.side_effect = RuntimeError
+            agg.handle(b"[]")
+
+    assert agg.dropped == 2
+    assert agg.received == 0
+
+
+def test_aggregator_record_without_listener_is_dropped(tmp_path):
+    address = str(tmp_path / "missing.sock")
+    with mock.patch.object(Aggregated, "config_aggregator", address):
+        Aggregated.record("event_aggregator_without_listener")
+
+
+def test_parse_address():
+    assert aggregator._parse_address("localhost:8125") == ("localhost", 8125)
+    assert aggregator._parse_address(":8125") == ("127.0.0.1", 8125)
+    assert aggregator._parse_address("/tmp/humbledb.sock") == "/tmp/humbledb.sock"
@@ -0,0 +1,139 @@
+import pytest
+
+from humbledb import Document
+from humbledb.bulk import Bulk
+
+from ..util import database_name
+
+
+class BulkTest(Document):
+    config_database = database_name()
+    config_collection = "bulk"
+
+    name = "n"
+    count = "c"
+    saved = "s", lambda: "saved"
+
+
+def test_bulk_returns_a_bulk_instance():
+    bulk = BulkTest.bulk(ordered=False, batch_size=10)
+    assert isinstance(bulk, Bulk)
+    assert bulk.doc_cls is BulkTest
+    assert bulk.ordered is False
+    assert bulk.batch_size == 10
+
+
+def test_bulk_requires_a_positive_batch_size():
+    with pytest.raises(ValueError):
+        BulkTest.bulk(batch_size=0)
+
+
+def test_bulk_queues_without_a_connection():
+    bulk = BulkTest.bulk()
+    bulk.insert(BulkTest(name="a"))
+    bulk.update({BulkTest.name: "a"}, {"$inc": {BulkTest.count: 1}})
+    bulk.remove({BulkTest.name: "b"})
+    assert len(bulk) == 3
+    bulk.clear()
+    assert len(bulk) == 0
+
+
+def test_bulk_insert_sets_saved_defaults():
+    doc = BulkTest()
+    BulkTest.bulk().insert(doc)
+    assert doc == {BulkTest.saved: "saved"}
+
+    doc = BulkTest()
+    BulkTest.bulk(manipulate=False).insert(doc)
+    assert doc == {}
+
+
+def test_bulk_upsert_sets_saved_defaults_on_insert():
+    bulk = BulkTest.bulk()
+    update = bulk._set_on_insert({BulkTest.name: "a"}, {"$inc": {BulkTest.count: 1}})
+    assert update == {
+        "$inc": {BulkTest.count: 1},
+        "$setOnInsert": {BulkTest.saved: "saved"},
+    }
+
+
+def test_bulk_upsert_skips_saved_defaults_already_in_the_query_or_update():
+    bulk = BulkTest.bulk()
+    update = {"$set": {BulkTest.saved: "mine"}}
+    assert bulk._set_on_insert({}, update) == update
+    update = {"$inc": {BulkTest.count: 1}}
+    assert bulk._set_on_insert({BulkTest.saved: "q"}, update) == update
+
+
+def test_bulk_update_without_operators_is_a_replace():
+    bulk = BulkTest.bulk()
+    with pytest.raises(ValueError):
+        bulk.update({}, {BulkTest.name: "a"}, multi=True)
+
+
+def test_bulk_writes_on_exit(DBTest):
+    with DBTest:
+        with BulkTest.bulk() as bulk:
+            for i in range(5):
+                bulk.insert({"_id": "bulk_exit_%s" % i})
+            assert (
+                BulkTest.collection.count_documents({"_id": {"$regex": "^bulk_exit_"}})
+                == 0
+            )
+
+        assert (
+            BulkTest.collection.count_documents({"_id": {"$regex": "^bulk_exit_"}}) == 5
+        )
+
+    assert bulk.result.inserted_count == 5
+    assert bulk.result.inserted_ids == ["bulk_exit_%s" % i for i in range(5)]
+
+
+def test_bulk_writes_in_batches(DBTest):
+    with DBTest:
+        bulk = BulkTest.bulk(batch_size=2)
+        for i in range(3):
+            bulk.insert({"_id": "bulk_batch_%s" % i})
+
+        assert len(bulk) == 1
+        assert (
+            BulkTest.collection.count_documents({"_id": {"$regex": "^bulk_batch_"}})
+            == 2
+        )
+
+        bulk.flush()
+        assert len(bulk) == 0
+
+    assert bulk.result.operation_count == 3
+    assert bulk.result.inserted_count == 3
+
+
+def test_bulk_does_not_write_on_error(DBTest):
+    with DBTest:
+        with pytest.raises(RuntimeError):
+            with BulkTest.bulk() as bulk:
+                bulk.insert({"_id": "bulk_error"})
+                raise RuntimeError()
+
+        assert not BulkTest.find_one({"_id": "bulk_error"})
+
+
+def test_bulk_aggregates_results(DBTest):
+    with DBTest:
+        BulkTest.insert({"_id": "bulk_agg_1", BulkTest.count: 0})
+        with BulkTest.bulk(ordered=False, batch_size=2) as bulk:
+            bulk.update({"_id": "bulk_agg_1"}, {"$inc": {BulkTest.count: 1}})
+            bulk.upsert({"_id": "bulk_agg_2"}, {"$inc": {BulkTest.count: 1}})
+            bulk.replace({"_id": "bulk_agg_1"}, {BulkTest.name: "replaced"})
+            bulk.remove({"_id": "bulk_agg_2"}, multi=False)
+
+        doc = BulkTest.find_one({"_id": "bulk_agg_1"})
+
+    result = bulk.result
+    assert result.matched_count == 2
+    assert result.modified_count == 2
+    assert result.upserted_count == 1
+    assert result.upserted_ids == {1: "bulk_agg_2"}
+    assert result.deleted_count == 1
+    assert doc.name == "replaced"
+    assert doc.saved == "saved"
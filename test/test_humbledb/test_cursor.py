@@ -85,3 +85,11 @@ def test_cursor_ensures_document_types_when_iterating_to_list(DBTest):
         cursor = DocTest.find()
         items = list(cursor)
         assert isinstance(items[0], DocTest)
+
+
+def test_find_creates_humbledb_cursor_directly(DBTest):
+    with DBTest:
+        cursor = DocTest.find({"_id": 1}, limit=1)
+        assert type(cursor) is Cursor
+        assert cursor._doc_cls is DocTest
+        assert cursor.collection is DocTest.collection
@@ -1,3 +1,4 @@
+import asyncio
 from unittest import mock
 
 import pyconfig
@@ -6,6 +7,9 @@ import pytool
 
 import humbledb
 from humbledb import Document, Embed, _version
+from humbledb.cursor import AsyncCursor
+from humbledb.document import MappedAttribute
+from humbledb.maps import NameMap
 
 from ..util import database_name
 
@@ -210,10 +214,21 @@ def test_ensure_indexes_reload_hook(DBTest):
 
 def test_wrap_methods(DBTest):
     with DBTest:
-        with mock.patch.object(DocTest, "_wrap") as _wrap:
-            _wrap.return_value = "_wrapper"
-            assert DocTest.find == _wrap.return_value
-            _wrap.assert_called_once()
+        find = DocTest.find
+        assert find.__func__ is DocTest._method_wrappers["find"]
+        assert find.__self__ is DocTest.collection
+        assert find.__name__ == "find"
+        # The wrapper is only built once per class
+        assert DocTest.find.__func__ is find.__func__
+
+
+def test_wrap_methods_are_per_class(DBTest):
+    class DocTest2(DocTest):
+        pass
+
+    with DBTest:
+        assert DocTest2.find.__func__ is not DocTest.find.__func__
+        assert isinstance(DocTest2.find_one(), (DocTest2, type(None)))
 
 
 def test_wrap_method_behaves_itself(DBTest):
@@ -370,6 +385,32 @@ def test_collection_accessible_from_instance(DBTest):
         t.collection
 
 
+def test_collection_is_cached(DBTest):
+    with DBTest:
+        collection = DocTest.collection
+        assert DocTest.collection is collection
+        assert DocTest().collection is collection
+
+
+def test_collection_cache_follows_config_changes(DBTest):
+    with DBTest:
+        collection = DocTest.collection
+        with mock.patch.object(DocTest, "config_collection", "other"):
+            assert DocTest.collection.name == "other"
+        assert DocTest.collection is collection
+
+
+def test_collection_cache_cleared_on_reconnect(DBTest):
+    with DBTest:
+        collection = DocTest.collection
+
+    DBTest.reconnect()
+
+    with DBTest:
+        assert DocTest.collection is not collection
+        assert DocTest.collection.database.client is DBTest.connection
+
+
 def test_attr():
     assert EmbedTestDoc.attr == "a"
 
@@ -924,6 +965,21 @@ def test_only_two_tuples_with_leading_string_are_interpreted_as_defaults():
     assert d.attr4 == v4
 
 
+def test_mapped_attributes_are_descriptors():
+    assert isinstance(vars(DocTest)["user_name"], MappedAttribute)
+    assert isinstance(vars(DocTest)["_id"], MappedAttribute)
+    assert isinstance(DocTest.user_name, NameMap)
+    assert DocTest.user_name == "u"
+
+
+def test_redefined_mapped_attribute_is_not_replaced():
+    class Redefined(DocTest):
+        def user_name(self):
+            return "method"
+
+    assert Redefined().user_name() == "method"
+
+
 def test_update_with_safe_keyword_doesnt_break_pymongo_3(DBTest):
     with DBTest:
         DocTest.update(
@@ -942,3 +998,76 @@ def test_save_with_safe_keyword_doesnt_break_pymongo_3(DBTest):
 def test_insert_with_safe_keyword_doesnt_break_pymongo_3(DBTest):
     with DBTest:
         DocTest.insert({"_id": "insert_safe_pymongo_3"}, safe=True)
+
+
+def run_async(conn, func):
+    """Run `func` in an async context for `conn` in a new event loop, closing
+    the loop's async client afterwards."""
+
+    async def main():
+        try:
+            async with conn:
+                return await func()
+        finally:
+            await conn.async_connection.close()
+
+    return asyncio.run(main())
+
+
+def test_async_without_context():
+    with pytest.raises(RuntimeError):
+        DocTest.async_collection
+
+
+def test_async_collection_is_not_a_collection_method():
+    with pytest.raises(TypeError):
+
+        class Test(Document):
+            async_collection = "c"
+
+
+def test_async_insert_and_find_one(DBTest):
+    async def check():
+        doc = DocTest(user_name="async_find_one")
+        _id = await DocTest.async_insert(doc)
+        found = await DocTest.async_find_one({"_id": _id})
+        assert isinstance(found, DocTest)
+        assert found.user_name == "async_find_one"
+        await DocTest.async_remove({"_id": _id})
+        assert await DocTest.async_find_one({"_id": _id}) is None
+
+    run_async(DBTest, check)
+
+
+def test_async_find_returns_documents(DBTest):
+    async def check():
+        await DocTest.async_insert([DocTest(user_name="async_find") for _ in range(3)])
+        cursor = await DocTest.async_find({DocTest.user_name: "async_find"})
+        assert type(cursor) is AsyncCursor
+        docs = [doc async for doc in cursor]
+        assert len(docs) == 3
+        assert all(isinstance(doc, DocTest) for doc in docs)
+
+        cursor = await DocTest.async_find({DocTest.user_name: "async_find"})
+        cursor = cursor.limit(2)
+        docs = await cursor.to_list()
+        assert len(docs) == 2
+        assert all(isinstance(doc, DocTest) for doc in docs)
+
+    run_async(DBTest, check)
+
+
+def test_async_update_and_find_and_modify(DBTest):
+    async def check():
+        _id = await DocTest.async_save(DocTest(user_name="async_update"))
+        await DocTest.async_update(
+            {"_id": _id}, {"$set": {DocTest.user_name: "async_updated"}}
+        )
+        doc = await DocTest.async_find_and_modify(
+            {"_id": _id}, {"$set": {"x": 1}}, new=True
+        )
+        assert isinstance(doc, DocTest)
+        assert doc.user_name == "async_updated"
+        assert doc["x"] == 1
+
+    run_async(DBTest, check)
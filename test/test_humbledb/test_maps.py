@@ -1,5 +1,11 @@
+import copy
+import gc
+import pickle
+import weakref
+
 import pytest
 import pytool
+from pytool.proxy import DictProxy, ListProxy
 
 from humbledb import Document, Embed
 from humbledb.maps import DictMap, ListMap
@@ -110,15 +116,57 @@ def test_unmapped_attribute_assignment_to_dict_map_is_an_error():
         t.em.foo = "bar"
 
 
-def test_deleting_an_unmapped_attribute_from_dict_map_works():
+def test_deleting_an_unmapped_attribute_from_dict_map_is_an_error():
     t = MapTest()
     em = t.em
-    object.__setattr__(em, "foo", True)
-    del em.foo
+    with pytest.raises(AttributeError):
+        del em.foo
 
     assert getattr(em, "foo", None) is None
 
 
+def test_maps_do_not_have_an_instance_dict():
+    doc = ListTest({"l": [{"o": 1}]})
+    assert not hasattr(MapTest().em, "__dict__")
+    assert not hasattr(doc.vals, "__dict__")
+    with pytest.raises(AttributeError):
+        object.__setattr__(doc.vals, "foo", True)
+
+
+def test_maps_keep_the_proxy_api():
+    doc = ListTest({"l": [1, 2, 3]})
+    em = MapTest({"e": {"v": 1}}).em
+    assert em.has_key("v")
+    assert not em.has_key("x")
+    assert list(em.iteritems()) == [("v", 1)]
+    assert list(em.iterkeys()) == ["v"]
+    assert list(em.itervalues()) == [1]
+
+    vals = doc.vals
+    assert vals.__getslice__(-1, 2) == [1, 2]
+    vals.__setslice__(0, 1, [4, 5])
+    assert doc["l"] == [4, 5, 2, 3]
+    vals.__delslice__(1, 3)
+    assert doc["l"] == [4, 3]
+
+    assert weakref.ref(em)() is em
+    assert weakref.ref(vals)() is vals
+
+
+def test_maps_are_still_pytool_proxies():
+    doc = ListTest({"l": [{"o": 1}]})
+    assert isinstance(MapTest().em, DictProxy)
+    assert isinstance(doc.vals, ListProxy)
+
+
+def test_name_map_only_stores_subattributes_in_dict():
+    assert ListTest._name_map.vals.__dict__ == {
+        "one": ListTest.vals.one,
+        "two": ListTest.vals.two,
+    }
+    assert ListTest.vals.one.key == "o"
+
+
 def test_deleting_an_unset_mapped_attribute_from_dict_map_is_an_error():
     t = MapTest()
     em = t.em
@@ -379,3 +427,74 @@ def test_saved_default_wraps_dicts_appropriately():
 def test_empty():
     assert ListTest._name_map.vals.empty() is False
     assert ListTest._name_map.vals.one.empty() is True
+
+
+def test_wrappers_are_reused_on_repeated_access():
+    class WrapTest(Document):
+        meta = Embed("m")
+        meta.tags = "t"
+        meta.slug = "s"
+
+    doc = WrapTest({"m": {"t": ["a"], "s": "slug"}})
+    assert doc.meta is doc.meta
+    assert doc.meta.tags is doc.meta.tags
+    assert doc.meta.slug == "slug"
+
+
+def test_wrappers_are_replaced_when_the_key_is_reassigned():
+    doc = ListTest({"l": [{"o": 1}]})
+    vals = doc.vals
+    doc["l"] = [{"o": 2}]
+    assert doc.vals is not vals
+    assert doc.vals[0].one == 2
+
+    vals = doc.vals
+    doc.vals = [{"o": 3}]
+    assert doc.vals is not vals
+    assert doc.vals[0].one == 3
+
+
+def test_wrappers_are_dropped_when_the_key_is_deleted():
+    doc = MapTest({"e": {"v": 1}})
+    em = doc.em
+    del doc.em
+    assert doc.em is not em
+    assert doc.em == {}
+    assert doc == {}
+
+
+def test_wrappers_are_not_shared_with_copies():
+    doc = MapTest({"e": {"v": 1}})
+    doc.em
+    clone = copy.copy(doc)
+    assert clone.em._parent is clone
+    assert "_wrappers" not in pickle.loads(pickle.dumps(doc)).__dict__
+
+
+def test_documents_with_cached_wrappers_are_freed_without_gc():
+    class WrapTest(Document):
+        meta = Embed("m")
+        meta.tags = "t"
+        meta.info = Embed("i")
+        meta.info.name = "n"
+
+    gc.disable()
+    try:
+        doc = WrapTest({"m": {"t": ["a"], "i": {"n": "name"}}})
+        assert doc.meta.tags == ["a"]
+        assert doc.meta.info.name == "name"
+        ref = weakref.ref(doc)
+        del doc
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_cached_wrappers_outlive_their_document():
+    doc = MapTest({"e": {"v": 1}})
+    em = doc.em
+    del doc
+    em.val = 2
+    assert em == {"v": 2}
+    del em["v"]
+    assert em == {}
@@ -1,3 +1,6 @@
+import asyncio
+import contextvars
+import threading
 from unittest import mock
 from unittest.case import SkipTest
 
@@ -188,3 +191,142 @@ def test_mongo_client_with_ssl_after_2_1(mongodb_service):
             assert SomeDoc.find({SomeDoc.name: "foobar"})
     except ConnectionFailure as err:
         raise SkipTest("SSL may not be enabled on mongodb server: %r" % err)
+
+
+def test_async_context_stack():
+    class AsyncTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    async def check():
+        assert Mongo.async_context is None
+        async with AsyncTest:
+            assert Mongo.async_context is AsyncTest
+            # The async context doesn't touch the thread's context stack
+            assert Mongo.context is None
+        assert Mongo.async_context is None
+
+    asyncio.run(check())
+
+
+def test_async_nested_conn():
+    class AsyncTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    async def check():
+        async with AsyncTest:
+            async with AsyncTest:
+                pass
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(check())
+
+
+def test_async_contexts_are_task_local():
+    class AsyncTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    class OtherTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    async def task(conn, ready, done):
+        async with conn:
+            ready.set()
+            await done.wait()
+            return Mongo.async_context
+
+    async def check():
+        ready = asyncio.Event(), asyncio.Event()
+        done = asyncio.Event()
+        first = asyncio.create_task(task(AsyncTest, ready[0], done))
+        second = asyncio.create_task(task(OtherTest, ready[1], done))
+        await ready[0].wait()
+        await ready[1].wait()
+        # Both tasks are inside their contexts at the same time
+        assert Mongo.async_context is None
+        done.set()
+        assert await first is AsyncTest
+        assert await second is OtherTest
+
+    asyncio.run(check())
+
+
+def test_reconnect_clears_async_connection(DBTest):
+    async def check():
+        DBTest.async_connection
+        DBTest.reconnect()
+        DBTest.async_connection
+
+    with mock.patch.object(DBTest, "_new_async_connection") as _new_conn:
+        _new_conn.return_value = mock.Mock(close=mock.AsyncMock())
+        asyncio.run(check())
+        assert _new_conn.call_count == 2
+
+    DBTest.reconnect()
+
+
+def test_async_connection_is_per_event_loop():
+    class AsyncTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    async def check():
+        assert AsyncTest.async_connection is AsyncTest.async_connection
+        # Let the client for the closed loop be closed
+        await asyncio.sleep(0)
+        return AsyncTest.async_connection
+
+    with mock.patch.object(AsyncTest, "_new_async_connection") as _new_conn:
+        _new_conn.side_effect = lambda: mock.Mock(close=mock.AsyncMock())
+        first = asyncio.run(check())
+        second = asyncio.run(check())
+
+    assert first is not second
+    assert _new_conn.call_count == 2
+    # The client for the first, closed, loop was dropped and closed
+    assert list(AsyncTest._async_connections.values()) == [second]
+    first.close.assert_awaited_once()
+    second.close.assert_not_called()
+
+    AsyncTest.reconnect()
+    assert AsyncTest._async_connections == {}
+    second.close.assert_awaited_once()
+
+
+def test_async_connection_needs_event_loop():
+    class AsyncTest(Mongo):
+        config_host = "localhost"
+        config_port = 27017
+
+    with pytest.raises(RuntimeError):
+        AsyncTest.async_connection
+
+
+def test_contexts_are_thread_local(DBTest):
+    seen = []
+
+    def check():
+        seen.append(Mongo.context)
+
+    with DBTest:
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+        assert Mongo.context is DBTest
+
+    assert seen == [None]
+
+
+def test_contexts_dont_leak_from_copied_context(DBTest):
+    def check():
+        DBTest.start()
+        return Mongo.context
+
+    # Code running in a copy of the context, like an asyncio task, can't
+    # change the caller's context stack
+    assert contextvars.copy_context().run(check) is DBTest
+    assert Mongo.context is None
+    assert Mongo.contexts == ()
@@ -1,6 +1,12 @@
 import calendar
 import datetime
+import functools
+import gc
+import threading
+import weakref
+from unittest import mock
 
+import bson
 import pytest
 import pytool
 
@@ -67,6 +73,46 @@ def test_update_clause_creates_dot_notated_clause():
     assert Daily._update_clause(MINUTE, stamp) == {Daily.minute + ".7.9": 1}
 
 
+def test_parse_section_yields_nonzero_values_in_order():
+    stamp = datetime.datetime(2013, 9, 1, tzinfo=pytool.time.UTC())
+    # Preallocated month of hours, with an extra day since September has 30
+    values = Monthly._preallocate_interval(MONTH, HOUR, stamp)
+    values[0][0] = 1
+    values[2][23] = 2
+    values[29][5] = 3
+    values[30][0] = 4
+
+    assert list(report._parse_section(values, DAY, stamp)) == [
+        (stamp, 1),
+        (datetime.datetime(2013, 9, 3, 23, tzinfo=stamp.tzinfo), 2),
+        (datetime.datetime(2013, 9, 30, 5, tzinfo=stamp.tzinfo), 3),
+    ]
+
+
+def test_parse_section_handles_months():
+    stamp = datetime.datetime(2012, 1, 1, tzinfo=pytool.time.UTC())
+    values = Full._preallocate_interval(YEAR, MINUTE, stamp)
+    values[1][28][23][59] = 1
+    values[11][30][0][1] = 2
+
+    assert list(report._parse_section(values, MONTH, stamp)) == [
+        (datetime.datetime(2012, 2, 29, 23, 59, tzinfo=stamp.tzinfo), 1),
+        (datetime.datetime(2012, 12, 31, 0, 1, tzinfo=stamp.tzinfo), 2),
+    ]
+
+
+def test_parse_section_handles_sparse_values():
+    stamp = datetime.datetime(2013, 1, 1, tzinfo=pytool.time.UTC())
+    values = {"10": {"23": 5}, "4": {"8": 2, "7": 1}, "5": {"0": 0}}
+
+    # Sparse values are never sliced, so the index doesn't apply
+    assert list(report._parse_section(values, DAY, stamp, 3)) == [
+        (datetime.datetime(2013, 1, 5, 7, tzinfo=stamp.tzinfo), 1),
+        (datetime.datetime(2013, 1, 5, 8, tzinfo=stamp.tzinfo), 2),
+        (datetime.datetime(2013, 1, 11, 23, tzinfo=stamp.tzinfo), 5),
+    ]
+
+
 def test_record_event_yearly(DBTest):
     event = "yearly_record_event"
     now = pytool.time.utcnow()
@@ -158,11 +204,243 @@ def test_preallocate_future(DBTest):
         assert PreallocAlways.find().count() == 2
 
         # Ensure we don't preallocate too many
-        PreallocAlways._preallocated[PreallocAlways._period(now)].remove(event)
+        PreallocAlways._tracker = report.PreallocationTracker()
         PreallocAlways.record(event)
         assert PreallocAlways.find().count() == 2
 
 
+def test_preallocate_with_bloom_tracker(DBTest):
+    class PreallocBloom(Report):
+        config_database = database_name()
+        config_collection = "prealloc_bloom"
+        config_period = MONTH
+        config_intervals = [MONTH, HOUR]
+        config_preallocation_tracker = functools.partial(
+            report.BloomPreallocationTracker, capacity=1000
+        )
+
+    event = "prealloc_bloom"
+    now = pytool.time.utcnow()
+
+    with DBTest:
+        PreallocBloom.record(event, now)
+        PreallocBloom.record(event, now)
+        assert PreallocBloom.find().count() == 1
+
+    tracker = PreallocBloom._preallocation_tracker()
+    assert isinstance(tracker, report.BloomPreallocationTracker)
+    assert tracker.seen(PreallocBloom._period(now), event)
+    # Each class has its own tracker
+    assert Daily._preallocation_tracker() is not tracker
+
+
+def test_preallocator_preallocates_before_boundary(DBTest):
+    class PreallocAhead(Report):
+        config_database = database_name()
+        config_collection = "prealloc_ahead"
+        config_period = DAY
+        config_intervals = [DAY, HOUR]
+        config_preallocation = 1
+
+    stamp = datetime.datetime(2013, 1, 5, 23, 50, tzinfo=pytool.time.UTC())
+    tomorrow = datetime.datetime(2013, 1, 6, tzinfo=stamp.tzinfo)
+
+    with PreallocAhead.preallocator(lead=300, batch_size=1) as preallocator:
+        with DBTest:
+            PreallocAhead.record("ahead1", stamp)
+            PreallocAhead.record("ahead2", stamp)
+            # Random preallocation is replaced by the preallocator
+            assert PreallocAhead.find().count() == 2
+
+            # Too early to preallocate
+            assert preallocator.run(stamp) == 0
+            assert preallocator.metrics()["period"] is None
+
+            assert preallocator.run(stamp + datetime.timedelta(minutes=6)) == 2
+            query = {PreallocAhead.meta.period: tomorrow}
+            assert PreallocAhead.find(query).count() == 2
+            assert preallocator.run(stamp + datetime.timedelta(minutes=7)) == 0
+
+        metrics = preallocator.metrics()
+        assert metrics["period"] == tomorrow
+        assert metrics["tracked"] == 2
+        assert metrics["coverage"] == 1.0
+        assert metrics["lag"] == 0
+
+    assert PreallocAhead._preallocator is None
+
+
+def test_preallocator_forgets_inactive_events():
+    stamp = datetime.datetime(2013, 1, 5, 23, 50, tzinfo=pytool.time.UTC())
+    with Daily.preallocator() as preallocator:
+        preallocator.track("inactive", stamp - datetime.timedelta(days=1))
+        assert preallocator.run(stamp) == 0
+        assert preallocator._events == {}
+
+        with pytest.raises(RuntimeError):
+            Daily.preallocator()
+
+
+def test_preallocator_preallocates_in_batches():
+    stamp = datetime.datetime(2013, 1, 5, 23, 58, tzinfo=pytool.time.UTC())
+    tomorrow = datetime.datetime(2013, 1, 6, tzinfo=stamp.tzinfo)
+    with Daily.preallocator(batch_size=2) as preallocator:
+        for event in ("batch1", "batch2", "batch3"):
+            preallocator.track(event, stamp)
+        with mock.patch.object(Daily, "_preallocate_many") as preallocate:
+            assert preallocator.run(stamp) == 3
+
+    assert preallocate.call_args_list == [
+        mock.call([("batch1", tomorrow), ("batch2", tomorrow)], future=False),
+        mock.call([("batch3", tomorrow)], future=False),
+    ]
+
+
+def test_sparse_report(DBTest):
+    class Sparse(Report):
+        config_database = database_name()
+        config_collection = "report.sparse"
+        config_period = MONTH
+        config_intervals = [MONTH, HOUR]
+        config_sparse = True
+        config_sparse_threshold = 2
+
+    event = "event_sparse_report"
+    stamp = datetime.datetime(2013, 1, 5, 7, tzinfo=pytool.time.UTC())
+    hour = datetime.timedelta(hours=1)
+    february = datetime.datetime(2013, 2, 1, tzinfo=stamp.tzinfo)
+    with DBTest:
+        Sparse.record(event, stamp)
+        Sparse.record(event, stamp + hour, count=2)
+        Sparse.record_many([(event, february, 3)])
+
+        january = Sparse.find_one({Sparse._id: Sparse.record_id(event, stamp)})
+        # January had two hours recorded, so February was preallocated
+        promoted = Sparse.find_one({Sparse._id: Sparse.record_id(event, february)})
+
+        counts = Sparse.hourly(event)[stamp : stamp + hour * 3]
+        daily = Sparse.daily(event)[stamp : february + datetime.timedelta(days=1)]
+        columns = Sparse.monthly(event).as_columns()[stamp : february + hour]
+
+    assert january.hour == {"4": {"7": 1, "8": 2}}
+    assert january.meta.period == datetime.datetime(2013, 1, 1, tzinfo=stamp.tzinfo)
+    assert isinstance(promoted.hour, list)
+    assert promoted.hour[0][0] == 3
+
+    assert counts == [1, 2, 0]
+    assert daily[0] == 3
+    assert daily[-1] == 3
+    assert sum(daily) == 6
+    assert list(columns[event]) == [3, 3]
+
+
+def test_sparse_promotion_counts_shards_once():
+    class ShardedSparse(Report):
+        config_database = database_name()
+        config_collection = "report.sparse_sharded"
+        config_period = MONTH
+        config_intervals = [MONTH, HOUR]
+        config_sparse = True
+        config_sparse_threshold = 3
+        config_counter_shards = 2
+
+    february = datetime.datetime(2013, 2, 1, tzinfo=pytool.time.UTC())
+    docs = [
+        {ShardedSparse.hour: {"4": {"7": 1}}},
+        {ShardedSparse.hour: {"4": {"7": 2, "8": 1}}},
+    ]
+    with mock.patch.object(ShardedSparse, "collection") as collection:
+        collection.find.return_value = docs
+        # Both shards counted the same hour, so January had two hours
+        assert not ShardedSparse._promote_sparse("event", february)
+        ShardedSparse.config_sparse_threshold = 2
+        assert ShardedSparse._promote_sparse("event", february)
+
+    january = ShardedSparse.record_id("event", february - datetime.timedelta(days=1))
+    query = collection.find.call_args[0][0]
+    assert query == {ShardedSparse._id: {"$in": ShardedSparse._shard_ids(january)}}
+
+
+def test_preallocation_tracker_keeps_two_periods():
+    tracker = report.PreallocationTracker()
+    periods = [datetime.datetime(2013, month, 1) for month in (1, 2, 3)]
+    for period in periods:
+        tracker.add(period, "event")
+
+    assert not tracker.seen(periods[0], "event")
+    assert tracker.seen(periods[1], "event")
+    assert tracker.seen(periods[2], "event")
+    assert not tracker.seen(periods[2], "other")
+
+
+def test_preallocation_tracker_is_thread_safe():
+    tracker = report.PreallocationTracker()
+    start = datetime.datetime(2013, 1, 1)
+    errors = []
+
+    def add():
+        try:
+            for hour in range(2000):
+                tracker.add(start + datetime.timedelta(hours=hour), "event")
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert tracker.seen(start + datetime.timedelta(hours=1999), "event")
+
+
+def test_bloom_preallocation_tracker():
+    tracker = report.BloomPreallocationTracker(capacity=1000, error_rate=0.001)
+    period = datetime.datetime(2013, 1, 1)
+    for i in range(1000):
+        tracker.add(period, "event{}".format(i))
+
+    assert all(tracker.seen(period, "event{}".format(i)) for i in range(1000))
+    false_positives = sum(
+        tracker.seen(period, "other{}".format(i)) for i in range(10000)
+    )
+    assert false_positives < 50
+
+    with pytest.raises(ValueError):
+        report.BloomPreallocationTracker(error_rate=0)
+
+
+def test_preallocate_query_uses_templates():
+    stamp = datetime.datetime(2012, 3, 5, 7, tzinfo=pytool.time.UTC())
+    query, update = Full._preallocate_query("event", stamp)
+
+    options = bson.CodecOptions(tz_aware=True, tzinfo=stamp.tzinfo)
+    update = bson.decode(update["$set"].raw, options)
+    assert update == {
+        Full.meta.event: "event",
+        Full.meta.period: Full._period(stamp),
+        Full.year: 0,
+        Full.minute: Full._preallocate_interval(YEAR, MINUTE, stamp),
+    }
+    assert query == {
+        "_id": Full.record_id("event", stamp),
+        Full.year: {"$exists": 0},
+        Full.minute: {"$exists": 0},
+    }
+
+
+def test_preallocate_templates_are_memoized():
+    stamp = datetime.datetime(2012, 3, 5, 7, tzinfo=pytool.time.UTC())
+    template = Full._preallocate_template(Full.minute, YEAR, MINUTE, stamp)
+    # Any other time in a leap year uses the same template
+    other = stamp.replace(year=2016, month=12)
+    assert Full._preallocate_template(Full.minute, YEAR, MINUTE, other) is template
+    # But not a regular year
+    other = stamp.replace(year=2013)
+    assert Full._preallocate_template(Full.minute, YEAR, MINUTE, other) != template
+
+
 def test_report_query_by_hour(DBTest):
     now = pytool.time.utcnow()
     event = "event_test_report_query_by_hour"
@@ -192,6 +470,194 @@ def test_report_query_by_hour_across_edge(DBTest):
     assert [c.minute for c in counts] == [0] * 4
 
 
+def test_report_query_slices_values_within_a_period(DBTest):
+    stamp = datetime.datetime(2013, 3, 5, 7, 30, tzinfo=pytool.time.UTC())
+    minute = datetime.timedelta(seconds=60)
+    event = "event_report_query_slices_values_within_a_period"
+    with DBTest:
+        Daily.record(event, stamp)
+        Daily.record(event, stamp + minute * 2, count=2)
+        Daily.record(event, stamp + minute * 5)
+
+        query = Daily.per_minute(event)
+        docs = list(
+            query._find_range(stamp, stamp + minute * 5, query.query_key, MINUTE)
+        )
+        counts = Daily.per_minute(event)[stamp : stamp + minute * 5]
+
+    # Only the hour of the range is returned from the document
+    assert len(docs) == 1
+    assert len(docs[0][Daily.minute]) == 1
+    assert counts == [1, 0, 2, 0, 0]
+    assert counts[0].timestamp == stamp
+
+
+def test_report_query_slices_values_across_periods(DBTest):
+    stamp = datetime.datetime(2013, 3, 5, 23, 58, tzinfo=pytool.time.UTC())
+    minute = datetime.timedelta(seconds=60)
+    event = "event_report_query_slices_values_across_periods"
+    with DBTest:
+        Daily.record(event, stamp)
+        Daily.record(event, stamp + minute * 3)
+
+        query = Daily.per_minute(event)
+        docs = list(
+            query._find_range(stamp, stamp + minute * 4, query.query_key, MINUTE)
+        )
+        counts = Daily.per_minute(event)[stamp : stamp + minute * 4]
+
+    assert len(docs) == 2
+    # The last hour of the first day, and the first hour of the next day
+    assert [len(doc[Daily.minute]) for doc in docs] == [1, 1]
+    assert counts == [1, 0, 0, 1]
+    assert counts[3].timestamp == stamp + minute * 3
+
+
+def test_report_query_rolls_up_top_level_values(DBTest):
+    stamp = datetime.datetime(2013, 3, 5, 7, tzinfo=pytool.time.UTC())
+    hour = datetime.timedelta(seconds=60 * 60)
+    day = datetime.timedelta(days=1)
+    event = "event_report_query_rolls_up_top_level_values"
+    with DBTest:
+        Monthly.record(event, stamp)
+        Monthly.record(event, stamp + hour, count=2)
+        Monthly.record(event, stamp + day)
+
+        query = Monthly.daily(event)
+        start = datetime.datetime(2013, 3, 4, tzinfo=pytool.time.UTC())
+        stop = start + day * 3
+        assert query._can_rollup(start, stop)
+        docs = list(query._find_range(start, stop, query.query_key, HOUR, True))
+        counts = Monthly.daily(event)[start:stop]
+
+    # Each day's hours are summed by the database
+    assert len(docs) == 1
+    assert docs[0][Monthly.hour] == [0, 3, 1]
+    assert counts == [0, 3, 1]
+    assert counts[1].timestamp == start + day
+
+
+def test_report_query_rolls_up_documents(DBTest):
+    stamp = datetime.datetime(2013, 3, 5, 7, tzinfo=pytool.time.UTC())
+    day = datetime.timedelta(days=1)
+    event = "event_report_query_rolls_up_documents"
+    with DBTest:
+        Daily.record(event, stamp)
+        Daily.record(event, stamp + day, count=2)
+        Daily.record(event, stamp + day * 30)
+
+        query = Daily.monthly(event)
+        start = datetime.datetime(2013, 3, 1, tzinfo=pytool.time.UTC())
+        stop = datetime.datetime(2013, 5, 1, tzinfo=pytool.time.UTC())
+        assert query._can_rollup(start, stop)
+        docs = list(query._find_range(start, stop, query.query_key, DAY, True))
+        counts = Daily.monthly(event)[start:stop]
+
+    # The documents for each month are summed by the database
+    assert [doc[Daily.day] for doc in docs] == [3, 1]
+    assert counts == [3, 1]
+    assert counts[1].timestamp == datetime.datetime(2013, 4, 1, tzinfo=stamp.tzinfo)
+
+
+def test_report_query_rolls_up_until_now(DBTest):
+    event = "event_report_query_rolls_up_until_now"
+    find_range = report.ReportQuery._find_range
+    with DBTest:
+        Monthly.record(event)
+        Monthly.record(event, count=2)
+
+        with mock.patch.object(
+            report.ReportQuery, "_find_range", autospec=True, side_effect=find_range
+        ) as _find_range:
+            counts = Monthly.daily(event)[-2:]
+
+    # The current day is summed by the database, up to now
+    assert _find_range.call_args[0][-1] is True
+    assert counts == [0, 3]
+
+
+def test_report_query_rolls_up_from_unaligned_start(DBTest):
+    event = "event_report_query_rolls_up_from_unaligned_start"
+    start = datetime.datetime(2020, 3, 1, tzinfo=pytool.time.UTC())
+    stop = datetime.datetime(2021, 1, 1, tzinfo=pytool.time.UTC())
+    with DBTest:
+        Monthly.record(event, datetime.datetime(2020, 2, 5, tzinfo=start.tzinfo))
+        Monthly.record(event, start + datetime.timedelta(days=3), count=4)
+        Monthly.record(
+            event, datetime.datetime(2020, 7, 9, tzinfo=start.tzinfo), count=6
+        )
+
+        query = Monthly.yearly(event)
+        assert query._can_rollup(start, stop)
+        counts = Monthly.yearly(event)[start:stop]
+        columns = Monthly.yearly(event).as_columns()[start:stop]
+
+    assert counts == [10]
+    assert counts[0].timestamp == datetime.datetime(2020, 1, 1, tzinfo=start.tzinfo)
+    assert list(columns[event]) == [10]
+
+
+def test_report_query_labels_unaligned_rollups_with_start():
+    query = Monthly.yearly("event")
+    key = query.query_key
+    start = datetime.datetime(2020, 3, 1, tzinfo=pytool.time.UTC())
+    stages = query._rollup_stages(0, {key: 1}, start)
+    assert stages[0]["$group"]["_id"]["period"]["$max"][1] == start
+
+    # Counts labelled with the start are summed into the interval holding it
+    doc = Monthly({Monthly.meta.key: {"e": "event", "p": start}, key: 10})
+    stop = datetime.datetime(2021, 1, 1, tzinfo=start.tzinfo)
+    results = query._parse_results([doc], start, stop, key, query.query_interval)
+    assert results == {"event": [10]}
+
+    start = datetime.datetime(2020, 1, 1, tzinfo=pytool.time.UTC())
+    stages = query._rollup_stages(0, {key: 1}, start)
+    assert "$dateFromParts" in stages[0]["$group"]["_id"]["period"]
+
+
+def test_rollups_handle_values_which_werent_preallocated():
+    expression = report._sum_expression("$$values", 1)
+    assert expression == {
+        "$sum": {
+            "$cond": [
+                {"$isArray": "$$values"},
+                "$$values",
+                {
+                    "$map": {
+                        "input": {"$objectToArray": "$$values"},
+                        "as": "item",
+                        "in": "$$item.v",
+                    }
+                },
+            ]
+        }
+    }
+
+    # Top level values of dicts are returned whole, to be summed locally
+    query = Monthly.daily("event")
+    key = query.query_key
+    start = datetime.datetime(2013, 3, 4, tzinfo=pytool.time.UTC())
+    project = {key: "$" + key}
+    assert query._rollup_stages(2, project, start) == []
+    values = project[key]["$let"]["in"]["$cond"]
+    assert values[0] == {"$isArray": "$$values"}
+    assert values[2] == "$$values"
+
+
+def test_report_query_doesnt_roll_up_partial_values():
+    query = Monthly.daily("event")
+    start = datetime.datetime(2013, 3, 4, 12, tzinfo=pytool.time.UTC())
+    stop = datetime.datetime(2013, 3, 6, tzinfo=pytool.time.UTC())
+    assert not query._can_rollup(start, stop)
+    assert not Monthly.hourly("event")._can_rollup(start, stop)
+
+    # Ranges may end part way through a value if nothing after it is counted
+    start = datetime.datetime(2013, 3, 4, tzinfo=pytool.time.UTC())
+    now = stop - datetime.timedelta(hours=1)
+    assert not query._can_rollup(start, now)
+    assert query._can_rollup(start, now, now)
+
+
 def test_resolution_error():
     with pytest.raises(ValueError):
         ByHour.per_minute
@@ -317,6 +783,92 @@ def test_report_query_regex(DBTest):
         assert counts["regex_test1"] == [1]
 
 
+def test_report_query_as_columns(DBTest):
+    stamp = pytool.time.utcnow()
+    stamp = stamp.replace(hour=1, minute=0, second=0, microsecond=0)
+    hour = datetime.timedelta(seconds=60 * 60)
+    with DBTest:
+        Monthly.record("columns_test1", stamp)
+        Monthly.record("columns_test1", stamp + hour)
+        Monthly.record("columns_test2", stamp + hour + hour, count=3)
+
+        query = Monthly.hourly("columns_test", regex=True).as_columns()
+        columns = query[stamp - hour : stamp + hour * 4]
+
+    assert isinstance(columns, report.ReportColumns)
+    assert columns.timestamps == [stamp + hour * i for i in range(-1, 4)]
+    assert sorted(columns) == ["columns_test1", "columns_test2"]
+    assert list(columns["columns_test1"]) == [0, 1, 1, 0, 0]
+    assert list(columns["columns_test2"]) == [0, 0, 0, 3, 0]
+
+
+def test_report_query_as_columns_sums_intervals(DBTest):
+    stamp = pytool.time.utcnow()
+    stamp -= datetime.timedelta(days=1)
+    stamp = stamp.replace(hour=1, minute=0, second=0, microsecond=0)
+    hour = datetime.timedelta(seconds=60 * 60)
+    event = "event_report_query_as_columns_sums_intervals"
+    with DBTest:
+        Monthly.record(event, stamp)
+        Monthly.record(event, stamp + hour)
+        Monthly.record(event, stamp + hour + hour)
+
+        columns = Monthly.daily(event).as_columns()[-2:]
+
+    assert len(columns.timestamps) == 2
+    assert columns.timestamps[0].timetuple()[:3] == stamp.timetuple()[:3]
+    assert list(columns[event]) == [3, 0]
+
+
+def test_report_query_caches_closed_periods(DBTest):
+    class Cached(Report):
+        config_database = database_name()
+        config_collection = "report.cached"
+        config_period = MONTH
+        config_intervals = [MONTH, HOUR]
+        config_query_cache = report.ReportQueryCache(ttl=0)
+
+    event = "event_report_query_caches_closed_periods"
+    stamp = datetime.datetime(2013, 3, 30, 5, tzinfo=pytool.time.UTC())
+    now = pytool.time.utcnow()
+    with DBTest:
+        Cached.record(event, stamp - datetime.timedelta(days=1))
+        Cached.record(event, stamp)
+        Cached.record(event, now)
+
+        # The first period's values are sliced to the start of the range
+        query = Cached.daily(event)
+        assert query[stamp : stamp + datetime.timedelta(days=5)] == [1, 0, 0, 0, 0]
+        assert query[-1:] == [1]
+        assert len(Cached.config_query_cache) == 2
+
+        # The closed period is cached, and the current one isn't
+        Cached.record(event, stamp)
+        Cached.record(event, now)
+        assert query[stamp : stamp + datetime.timedelta(days=1)] == [1]
+        assert query[-1:] == [2]
+
+        Cached.config_query_cache.clear()
+        assert query[stamp : stamp + datetime.timedelta(days=1)] == [2]
+
+
+def test_report_query_cache_evicts_and_expires():
+    cache = report.ReportQueryCache(max_size=2, ttl=60)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    assert cache.get("a") == [1]
+    cache.set("c", [3])
+    # The least recently used entry is evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+
+    cache.set("open", [4], closed=False)
+    assert cache.get("open") == [4]
+    cache.ttl = 0
+    cache.set("expired", [5], closed=False)
+    assert cache.get("expired") is None
+
+
 def test_report_query_end_index(DBTest):
     stamp = pytool.time.utcnow()
     this_year = stamp.year
@@ -524,6 +1076,303 @@ def test_record_negative_count(DBTest):
         assert sum(Monthly.hourly(event)[-1:]) == -5
 
 
+def test_record_counter_shards(DBTest):
+    class Sharded(Report):
+        config_database = database_name()
+        config_collection = "report.sharded"
+        config_period = MONTH
+        config_intervals = [MONTH, HOUR]
+        config_counter_shards = 4
+
+    event = "event_record_counter_shards"
+    stamp = pytool.time.utcnow()
+    with DBTest:
+        for _ in range(20):
+            Sharded.record(event, stamp)
+
+        # Every shard is preallocated, and the counts are spread across them
+        docs = list(Sharded.find({Sharded.meta.event: event}))
+        assert sorted(doc._id for doc in docs) == sorted(
+            Sharded._shard_ids(Sharded.record_id(event, stamp))
+        )
+        assert sum(doc.month for doc in docs) == 20
+
+        assert Sharded.monthly(event)[-1:] == [20]
+        assert Sharded.daily(event)[-1:] == [20]
+        assert list(Sharded.hourly(event).as_columns()[-1:][event]) == [20]
+
+
+def test_counter_shard_ids():
+    _id = Monthly.record_id("event", pytool.time.utcnow())
+    assert Monthly._shard_ids(_id) == [_id]
+    assert Monthly._shard_id(_id) == _id
+
+    class Sharded(Monthly):
+        config_counter_shards = 3
+
+    assert Sharded._shard_ids(_id) == [_id, _id + "#1", _id + "#2"]
+    assert Sharded._shard_id(_id) in Sharded._shard_ids(_id)
+
+
+def test_record_many(DBTest):
+    stamp = datetime.datetime(2013, 1, 5, 7, 9, 0, tzinfo=pytool.time.UTC())
+    hour = datetime.timedelta(hours=1)
+    with DBTest:
+        result = Monthly.record_many(
+            [
+                ("record_many1", stamp, 1),
+                ("record_many1", stamp, 2),
+                ("record_many1", stamp + hour, 1),
+                ("record_many2", stamp, 5),
+            ]
+        )
+        # The documents are preallocated first, and written once each
+        assert result.operation_count == 2
+        assert result.matched_count == 2
+
+        first = Monthly.find_one({Monthly.meta.event: "record_many1"})
+        second = Monthly.find_one({Monthly.meta.event: "record_many2"})
+
+    assert first.month == 4
+    assert first.hour[4][7] == 3
+    assert first.hour[4][8] == 1
+    assert second.month == 5
+    assert second.hour[4][7] == 5
+
+
+class RolledUp(Report):
+    config_database = database_name()
+    config_collection = "report.rolled_up"
+    config_period = MONTH
+    config_intervals = [MONTH, HOUR]
+    config_rollup_separator = "/"
+
+
+def test_rollup_events():
+    assert RolledUp._rollup_events("home") == ["home"]
+    assert RolledUp._rollup_events("content/a/b") == [
+        "content/a/b",
+        "content/a/*",
+        "content/*",
+    ]
+    assert Monthly._rollup_events("content/a/b") == ["content/a/b"]
+
+
+def test_record_rolls_up_events(DBTest):
+    stamp = pytool.time.utcnow()
+    with DBTest:
+        RolledUp.record("rollup/a/b", stamp)
+        RolledUp.record("rollup/a/c", stamp, count=2)
+        RolledUp.record_many([("rollup/d", stamp, 3)])
+
+        assert RolledUp.monthly("rollup/a/b")[-1:] == [1]
+        assert RolledUp.monthly("rollup/a/*")[-1:] == [3]
+        assert RolledUp.daily("rollup/*")[-1:] == [6]
+
+
+def test_regex_queries_skip_rolled_up_events():
+    stamp = datetime.datetime(2013, 1, 5, 7, tzinfo=pytool.time.UTC())
+    query = RolledUp.hourly("content/", regex=True)._range_query(stamp, stamp)
+    ancestor = query[RolledUp.meta.event]["$not"]
+    assert ancestor.search("content/a/*")
+    assert not ancestor.search("content/a/b")
+
+    query = RolledUp.hourly("content/", regex=True, rollups=True)
+    assert RolledUp.meta.event not in query._range_query(stamp, stamp)
+    assert RolledUp.meta.event not in Monthly.hourly(
+        "content/", regex=True
+    )._range_query(stamp, stamp)
+
+
+def test_regex_queries_dont_double_count_rollups(DBTest):
+    stamp = pytool.time.utcnow()
+    with DBTest:
+        RolledUp.record("regex_rollup/a/b", stamp)
+        RolledUp.record("regex_rollup/a/c", stamp, count=2)
+
+        counts = RolledUp.monthly("regex_rollup/", regex=True)[-1:]
+        rollups = RolledUp.monthly("regex_rollup/", regex=True, rollups=True)[-1:]
+
+    assert sorted(counts) == ["regex_rollup/a/b", "regex_rollup/a/c"]
+    assert sum(sum(c) for c in counts.values()) == 3
+    assert sorted(rollups) == [
+        "regex_rollup/*",
+        "regex_rollup/a/*",
+        "regex_rollup/a/b",
+        "regex_rollup/a/c",
+    ]
+
+
+def test_buffered_record_rolls_up_events():
+    stamp = datetime.datetime(2013, 1, 5, 7, 9, 0, tzinfo=pytool.time.UTC())
+    buf = RolledUp.buffered()
+    buf.record("content/a", stamp)
+
+    assert sorted(event for event, _ in buf._events.values()) == [
+        "content/*",
+        "content/a",
+    ]
+    assert len(buf) == 4
+    buf.clear()
+    buf.close()
+
+
+class Visitors(report.DistinctReport):
+    config_database = database_name()
+    config_collection = "report.visitors"
+    config_period = MONTH
+    config_intervals = [MONTH, HOUR]
+
+
+@pytest.mark.parametrize("precision", [3, 17, 8.0, True, None])
+def test_distinct_report_checks_precision(precision):
+    with pytest.raises(ValueError):
+
+        class BadPrecision(report.DistinctReport):
+            config_precision = precision
+
+
+def test_distinct_report_precision_range():
+    class Coarse(report.DistinctReport):
+        config_precision = 4
+
+    class Fine(report.DistinctReport):
+        config_precision = 16
+
+    assert report._hll_register("visitor", 16)[0] < 2**16
+
+
+def test_hll_estimate():
+    registers = {}
+    for i in range(1000):
+        index, rank = report._hll_register("visitor{}".format(i), 8)
+        registers[index] = max(registers.get(index, 0), rank)
+
+    assert report._hll_estimate({}, 8) == 0
+    assert abs(report._hll_estimate(registers, 8) - 1000) < 200
+
+
+def test_slot_report_query_requires_merge():
+    class Slots(report._SlotReportQuery):
+        pass
+
+    with pytest.raises(TypeError):
+        Slots(Visitors, HOUR)
+
+    assert isinstance(Visitors.hourly, report.DistinctReportQuery)
+
+
+def test_distinct_report(DBTest):
+    event = "event_distinct_report"
+    stamp = datetime.datetime(2013, 1, 5, 7, tzinfo=pytool.time.UTC())
+    day = datetime.timedelta(days=1)
+    with DBTest:
+        for i in range(10):
+            Visitors.record(event, "visitor{}".format(i), stamp)
+            # The same visitors the next day aren't counted twice for the month
+            Visitors.record(event, "visitor{}".format(i), stamp + day)
+        Visitors.record_many([(event, "visitor10", stamp + day)])
+
+        daily = Visitors.daily(event)[stamp : stamp + day * 2]
+        january = datetime.datetime(2013, 1, 1, tzinfo=stamp.tzinfo)
+        monthly = Visitors.monthly(event)[january : january + day * 31]
+        columns = Visitors.hourly(event).as_columns()[stamp : stamp + day]
+
+    assert daily == [10, 11]
+    assert daily[0].timestamp == datetime.datetime(2013, 1, 5, tzinfo=stamp.tzinfo)
+    assert monthly == [11]
+    assert columns[event][0] == 10
+    assert sum(columns[event]) == 10
+
+    with pytest.raises(TypeError):
+        Visitors.buffered()
+
+
+class Latency(report.HistogramReport):
+    config_database = database_name()
+    config_collection = "report.latency"
+    config_period = MONTH
+    config_intervals = [MONTH, HOUR]
+    config_buckets = [10, 20, 50]
+
+
+def test_report_histogram_percentiles():
+    stamp = datetime.datetime(2013, 1, 5)
+    first = report.ReportHistogram([10, 20, 50], [0, 10, 0, 0], stamp)
+    second = report.ReportHistogram([10, 20, 50], [0, 0, 9, 1], stamp)
+
+    merged = sum([first, second])
+    assert merged.counts == [0, 10, 9, 1]
+    assert merged.total == 20
+    assert merged.p50 == 20
+    assert merged.p95 == 50
+    # Overflow values are reported as the last bound
+    assert merged.p99 == 50
+    assert report.ReportHistogram([10], [0, 0], stamp).p50 is None
+
+
+def test_histogram_report_requires_values():
+    with pytest.raises(TypeError):
+        Latency.record("event")
+
+    with pytest.raises(TypeError):
+        Latency.record_many([("event", None, 1)])
+
+    with pytest.raises(TypeError):
+        Latency.buffered()
+
+    with mock.patch.object(Latency, "config_aggregator", ("localhost", 8125)):
+        with pytest.raises(TypeError):
+            Latency.record_value("event", 1)
+
+
+class ShardedLatency(Latency):
+    config_collection = "report.sharded_latency"
+    config_rollup_separator = "/"
+    config_counter_shards = 4
+
+
+def test_histogram_report_rolls_up_and_shards_values(DBTest):
+    stamp = datetime.datetime(2013, 1, 5, 7, tzinfo=pytool.time.UTC())
+    with DBTest:
+        for value in range(1, 21):
+            ShardedLatency.record_value("api/users", value, stamp)
+        ShardedLatency.record_value("api/posts", 100, stamp)
+
+        hour = datetime.timedelta(hours=1)
+        users = ShardedLatency.hourly("api/users")[stamp : stamp + hour]
+        rolled = ShardedLatency.hourly("api/*")[stamp : stamp + hour]
+
+    assert users[0].counts == [10, 10, 0, 0]
+    assert rolled[0].counts == [10, 10, 0, 1]
+
+
+def test_histogram_report(DBTest):
+    event = "event_histogram_report"
+    stamp = datetime.datetime(2013, 1, 5, 7, tzinfo=pytool.time.UTC())
+    hour = datetime.timedelta(hours=1)
+    with DBTest:
+        for value in range(1, 21):
+            Latency.record_value(event, value, stamp)
+        Latency.record_value(event, 100, stamp + hour)
+
+        hourly = Latency.hourly(event)[stamp : stamp + hour * 2]
+        daily = Latency.daily(event)[stamp : stamp + hour * 2]
+
+        with pytest.raises(TypeError):
+            Latency.record(event)
+
+    assert [h.counts for h in hourly] == [[10, 10, 0, 0], [0, 0, 0, 1]]
+    assert hourly[0].timestamp == stamp
+    assert daily[0].counts == [10, 10, 0, 1]
+    assert sum(hourly) == daily[0]
+    assert daily[0].p50 == 10.5
+
+
+def test_record_many_without_records():
+    assert Monthly.record_many([]) is None
+
+
 def test_record_bad_stamp_type_raises_value_error():
     with pytest.raises(ValueError):
         Monthly.record("foo", 20)
@@ -549,3 +1398,94 @@ def test_recording_and_retrieving_in_september_works(DBTest):
         ]
 
     assert sum(vals) == 1
+
+
+def test_buffered_record_coalesces_counts():
+    stamp = datetime.datetime(2013, 1, 5, 7, 9, 0, tzinfo=pytool.time.UTC())
+    buf = Monthly.buffered()
+    buf.record("buffered_coalesce", stamp)
+    buf.record("buffered_coalesce", stamp, count=2)
+    buf.record("buffered_coalesce", stamp + datetime.timedelta(hours=1))
+
+    _id = Monthly.record_id("buffered_coalesce", stamp)
+    assert buf._increments == {
+        _id: {Monthly.month: 4, Monthly.hour + ".4.7": 3, Monthly.hour + ".4.8": 1}
+    }
+    assert len(buf) == 3
+
+    buf.clear()
+    assert len(buf) == 0
+    buf.close()
+
+
+def test_unclosed_buffers_can_be_freed():
+    buf = Monthly.buffered()
+    assert buf in report._OPEN_BUFFERS
+    ref = weakref.ref(buf)
+
+    gc.disable()
+    try:
+        del buf
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_closed_buffers_arent_closed_at_exit():
+    buf = Monthly.buffered()
+    buf.close()
+    assert buf not in report._OPEN_BUFFERS
+
+    with mock.patch.object(report.ReportBuffer, "close") as close:
+        report._close_buffers()
+    close.assert_not_called()
+
+
+def test_buffered_record_checks_arguments():
+    buf = Monthly.buffered()
+    with pytest.raises(ValueError):
+        buf.record("foo", count="bar")
+    with pytest.raises(ValueError):
+        buf.record("foo", 20)
+    buf.close()
+
+
+def test_buffered_record_flushes(DBTest):
+    event = "buffered_flush"
+    stamp = pytool.time.utcnow()
+    buf = Monthly.buffered()
+    for _ in range(5):
+        buf.record(event, stamp)
+
+    with DBTest:
+        assert not Monthly.find_one({Monthly.meta.event: event})
+        buf.flush()
+        doc = Monthly.find_one({Monthly.meta.event: event})
+
+    assert len(buf) == 0
+    assert doc.month == 5
+    assert doc.hour[stamp.day - 1][stamp.hour] == 5
+    buf.close()
+
+
+def test_buffered_record_flushes_when_full(DBTest):
+    event = "buffered_full"
+    buf = Monthly.buffered(DBTest, interval=None, max_size=4)
+    buf.record(event)
+    assert len(buf) == 2
+    buf.record(event, pytool.time.utcnow() - datetime.timedelta(days=40))
+    assert len(buf) == 0
+
+    with DBTest:
+        assert Monthly.find_one({Monthly.meta.event: event}).month == 1
+    buf.close()
+
+
+def test_buffered_record_flushes_on_close(DBTest):
+    event = "buffered_close"
+    with Monthly.buffered(DBTest, interval=60) as buf:
+        buf.record(event, count=3)
+
+    assert not buf._thread.is_alive()
+    with DBTest:
+        assert Monthly.find_one({Monthly.meta.event: event}).month == 3